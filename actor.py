@@ -1,30 +1,27 @@
 #!/usr/bin/env python
+from array import array
+from level import PASSABLE_TABLE
+
+# (deltay, deltax) for each direction code (NORTH, EAST, SOUTH, WEST)
+DIRECTION_DELTAS = ((-1, 0), (0, 1), (1, 0), (0, -1))
 
 class Actor:
 
 
-    def __init__(self, ypos, xpos, sign='@'):
+    def __init__(self, ypos, xpos, sign='@', speed=100):
         self.y = ypos
         self.x = xpos
         self.deltay = 0
         self.deltax = 0
         self.character = sign
+        # how often the actor gets to act, 100 is normal (see scheduler.py)
+        self.speed = speed
 
         self.update()
 
     def move(self, direction):
-        if direction == 0:
-            self.deltay = -1
-            self.deltax = 0
-        elif direction == 1:
-            self.deltay = 0
-            self.deltax = 1
-        elif direction == 2:
-            self.deltay = 1
-            self.deltax = 0
-        elif direction == 3:
-            self.deltay = 0
-            self.deltax = -1
+        if 0 <= direction < len(DIRECTION_DELTAS):
+            self.deltay, self.deltax = DIRECTION_DELTAS[direction]
 
     def update(self):
         self.y += self.deltay
@@ -32,5 +29,272 @@ class Actor:
         self.deltay = 0
         self.deltax = 0
 
+    def setPosition(self, ypos, xpos):
+        """Puts the actor at (ypos, xpos) right away. Returns True."""
+
+        self.y = ypos
+        self.x = xpos
+        return True
+
+    def getCurrentYX(self):
+        return (self.y, self.x)
+
+class ActorHandle:
+    """Lightweight stand-in for an Actor living in an ActorPool. It only holds
+       the pool and a slot number; every attribute reads from and writes to
+       the pool's arrays. Has the same interface as Actor.
+
+       Setting y or x moves the actor on its own, through the cell made of the
+       new y and the old x (or the other way round); use setPosition() to
+       move it in one go."""
+
+    __slots__ = ('pool', 'index')
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    @property
+    def y(self):
+        return self.pool.ys[self.index]
+
+    @y.setter
+    def y(self, value):
+        self.pool.place(self.index, value, self.pool.xs[self.index])
+
+    @property
+    def x(self):
+        return self.pool.xs[self.index]
+
+    @x.setter
+    def x(self, value):
+        self.pool.place(self.index, self.pool.ys[self.index], value)
+
+    @property
+    def character(self):
+        return chr(self.pool.glyphs[self.index])
+
+    @property
+    def speed(self):
+        return self.pool.speeds[self.index]
+
+    @property
+    def alive(self):
+        return self.pool.alive[self.index] == 1
+
+    def setPosition(self, ypos, xpos):
+        """Puts the actor at (ypos, xpos) right away. Returns False (and
+           stays put) if another actor of the pool stands there."""
+
+        return self.pool.place(self.index, ypos, xpos)
+
+    def move(self, direction):
+        self.pool.setMove(self.index, direction)
+
+    def update(self):
+        """Applies this actor's pending move alone; prefer pool.update() for
+           moving everybody at once."""
+
+        self.pool.updateOne(self.index)
+
     def getCurrentYX(self):
-        return (self.y, self.x)
\ No newline at end of file
+        return (self.pool.ys[self.index], self.pool.xs[self.index])
+
+class ActorPool:
+    """Many actors stored as a struct of arrays (positions, pending moves,
+       speeds and glyphs each in one typed array, indexed by slot) instead of
+       one object with its own __dict__ per actor. update() applies every
+       pending move in one pass and refuses moves into tiles that aren't
+       passable (TILES passable column) or cells taken by another actor of
+       the pool. A cell that its actor leaves in the same update() is free
+       for the others, so a line of actors can follow its leader; when two
+       actors want the same cell the one ordered first gets it. Actors that
+       would all have to move at once (two swapping places, a ring) stay
+       put.
+
+       The pool draws itself like an entity layer: add it to level.layers to
+       have the renderer show it. Dead slots are reused by later spawns."""
+
+
+    def __init__(self, level, capacity=64):
+        self.level = level
+        self.ys = array('i', bytes(4 * capacity))
+        self.xs = array('i', bytes(4 * capacity))
+        self.dys = array('b', bytes(capacity))
+        self.dxs = array('b', bytes(capacity))
+        self.speeds = array('i', bytes(4 * capacity))
+        self.glyphs = bytearray(capacity)
+        self.alive = bytearray(capacity)
+        self.handles = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        # levelArr index -> slot of the actor standing there
+        self.cells = {}
+        # slots with a move waiting for update(), in the order given
+        self.pending = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        alive = self.alive
+        for index, handle in enumerate(self.handles):
+            if alive[index]:
+                yield handle
+
+    def _grow(self):
+        old = len(self.alive)
+        new = old * 2 or 16
+        extra = new - old
+        self.ys.extend(array('i', bytes(4 * extra)))
+        self.xs.extend(array('i', bytes(4 * extra)))
+        self.dys.extend(array('b', bytes(extra)))
+        self.dxs.extend(array('b', bytes(extra)))
+        self.speeds.extend(array('i', bytes(4 * extra)))
+        self.glyphs.extend(bytes(extra))
+        self.alive.extend(bytes(extra))
+        self.handles.extend([None] * extra)
+        self.free.extend(range(new - 1, old - 1, -1))
+
+    def spawn(self, ypos, xpos, sign='@', speed=100):
+        """Adds an actor at (ypos, xpos) and returns its handle, or None if the
+           cell is already taken by another actor of the pool."""
+
+        key = ypos * self.level.getXDim() + xpos
+        if key in self.cells:
+            return None
+        if not self.free:
+            self._grow()
+        index = self.free.pop()
+        self.ys[index] = ypos
+        self.xs[index] = xpos
+        self.dys[index] = 0
+        self.dxs[index] = 0
+        self.speeds[index] = speed
+        self.glyphs[index] = ord(sign)
+        self.alive[index] = 1
+        self.cells[key] = index
+        handle = ActorHandle(self, index)
+        self.handles[index] = handle
+        self.count += 1
+        return handle
+
+    def kill(self, handle):
+        """Removes the actor; its handle must not be used afterwards."""
+
+        index = handle.index
+        if not self.alive[index]:
+            return
+        del self.cells[self.ys[index] * self.level.getXDim() + self.xs[index]]
+        self.alive[index] = 0
+        self.dys[index] = 0
+        self.dxs[index] = 0
+        self.handles[index] = None
+        self.free.append(index)
+        self.count -= 1
+
+    def place(self, index, ypos, xpos):
+        """Puts actor in slot index at (ypos, xpos) right away, without any
+           passability check. Returns False and leaves the actor where it is
+           if another actor of the pool stands there."""
+
+        xsize = self.level.getXDim()
+        cells = self.cells
+        new = ypos * xsize + xpos
+        if cells.get(new, index) != index:
+            return False
+        old = self.ys[index] * xsize + self.xs[index]
+        if cells.get(old) == index:
+            del cells[old]
+        self.ys[index] = ypos
+        self.xs[index] = xpos
+        cells[new] = index
+        return True
+
+    def setMove(self, index, direction):
+        """Orders the actor in slot index to step in direction on the next
+           update()."""
+
+        if not 0 <= direction < len(DIRECTION_DELTAS):
+            return
+        if self.dys[index] == 0 and self.dxs[index] == 0:
+            self.pending.append(index)
+        self.dys[index], self.dxs[index] = DIRECTION_DELTAS[direction]
+
+    def getAt(self, ypos, xpos):
+        """Returns handle of the actor at (ypos, xpos), or None."""
+
+        index = self.cells.get(ypos * self.level.getXDim() + xpos)
+        if index is None:
+            return None
+        return self.handles[index]
+
+    def update(self):
+        """Applies all pending moves at once. Returns number of actors that
+           actually moved."""
+
+        pending = self.pending
+        if not pending:
+            return 0
+        self.pending = []
+        ys, xs, dys, dxs = self.ys, self.xs, self.dys, self.dxs
+        alive = self.alive
+        cells = self.cells
+        tiles = self.level.levelArr
+        ysize, xsize = self.level.getYDim(), self.level.getXDim()
+        passable = PASSABLE_TABLE
+        # cell -> slots whose move waits for its actor to leave, in order
+        waiting = {}
+        moved = 0
+        for index in pending:
+            dy, dx = dys[index], dxs[index]
+            dys[index] = 0
+            dxs[index] = 0
+            if not alive[index] or (dy == 0 and dx == 0):
+                continue
+            y, x = ys[index] + dy, xs[index] + dx
+            if y < 0 or y >= ysize or x < 0 or x >= xsize:
+                continue
+            target = y * xsize + x
+            if not passable[tiles[target]]:
+                continue
+            if target in cells:
+                waiting.setdefault(target, []).append(index)
+                continue
+            # move, then hand the cell left behind to the first actor waiting
+            # for it, and so on down the line
+            while True:
+                old = ys[index] * xsize + xs[index]
+                del cells[old]
+                cells[target] = index
+                ys[index], xs[index] = divmod(target, xsize)
+                moved += 1
+                queue = waiting.get(old)
+                if not queue:
+                    break
+                index = queue.pop(0)
+                target = old
+        return moved
+
+    def updateOne(self, index):
+        """Applies the pending move of a single actor (same rules as
+           update()). Returns True if it moved."""
+
+        if index not in self.pending:
+            return False
+        self.pending.remove(index)
+        rest = self.pending
+        self.pending = [index]
+        moved = self.update()
+        self.pending = rest
+        return moved == 1
+
+    def stamp(self, frame, xsize):
+        """Writes every living actor's glyph into frame (see
+           EntityLayer.stamp())."""
+
+        glyphs = self.glyphs
+        size = len(frame)
+        for key, index in self.cells.items():
+            if key < size:
+                frame[key] = glyphs[index]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Statistics and images for large numbers of levels, one level at a time so
+   a corpus of any size runs in constant memory:
+
+       python analysis.py levels.jsonl --ascii levels.txt --pgm images/
+       python analysis.py --generate 100000 --stats stats.jsonl
+
+   Levels come either from a file written by batch.py or are generated on
+   the spot by worker processes, which then also work out each level's
+   numbers. Every count is done on whole tile blocks (bytes.count(),
+   bytes.translate() and slices), never cell by cell in Python.
+
+   Per level: how many tiles of each kind it has, floor coverage (share of
+   cells that can be walked on), wall ratio (share of the built cells that
+   are walls) and the inside area of every room. The totals over all levels
+   are printed as JSON at the end."""
+import argparse
+import base64
+import json
+import os
+import sys
+from collections import Counter
+from level import TILES, TILE_WALL, TILE_UNUSED, GLYPH_TABLE, INTERIOR_TABLE, \
+                  findRoomInterior
+from batch import iterBatch, generateOne, readBatch
+
+# names of the tile IDs in stats, in TILES order
+TILE_NAMES = ('unused', 'floor', 'wall', 'upstairs', 'downstairs',
+              'doorclosed', 'dooropen')
+# tile ID -> gray level in PGM images: empty space black, walls gray, doors
+# lighter, everything walkable white; unknown IDs are black as well
+PGM_TABLE = bytearray(256)
+for tile in TILES:
+    PGM_TABLE[tile[0]] = 255 if tile[2] else 160
+PGM_TABLE[TILE_UNUSED] = 0
+PGM_TABLE[TILE_WALL] = 96
+PGM_TABLE = bytes(PGM_TABLE)
+del tile
+# coverage and wall ratio histograms have this many equal buckets from 0 to 1
+BUCKETS = 20
+
+def tileHistogram(tiles):
+    """Returns how many cells of each tile ID in TILES the tile block has,
+       as a list indexed by tile ID."""
+
+    return [tiles.count(tile[0]) for tile in TILES]
+
+def roomSizes(tiles, xsize, rooms):
+    """Returns the inside area of every room in rooms (as in Level.rooms),
+       measured from the tiles (see level.findRoomInterior())."""
+
+    interior = tiles.translate(INTERIOR_TABLE)
+    sizes = []
+    for room in rooms:
+        top, left, leny, lenx = findRoomInterior(interior, xsize, room[1], room[2])
+        sizes.append(leny * lenx)
+    return sizes
+
+def levelStats(tiles, ysize, xsize, rooms):
+    """Returns the numbers of one level (tiles as one byte per cell, row-major)
+       as a dict ready for json.dumps()."""
+
+    counts = tileHistogram(tiles)
+    cells = ysize * xsize
+    built = cells - counts[TILE_UNUSED]
+    passable = sum(count for tile, count in zip(TILES, counts) if tile[2])
+    return {'cells': cells,
+            'tiles': dict(zip(TILE_NAMES, counts)),
+            'other': cells - sum(counts),
+            'coverage': passable / cells if cells else 0.0,
+            'wallRatio': counts[TILE_WALL] / built if built else 0.0,
+            'roomSizes': roomSizes(tiles, xsize, rooms)}
+
+def analyzeLevel(level):
+    """levelStats() of a Level."""
+
+    return levelStats(bytes(level.levelArr), level.getYDim(), level.getXDim(),
+                      level.rooms)
+
+def analyzeRecord(record):
+    """Adds levelStats() to a level record as read by batch.readBatch()
+       (under 'analysis') and returns it."""
+
+    record['analysis'] = levelStats(record['tiles'], record['ysize'],
+                                    record['xsize'], record['rooms'])
+    return record
+
+def generateAndAnalyze(args):
+    """Worker for iterBatch(): generates one level (see batch.generateOne())
+       and works out its numbers in the worker process."""
+
+    record = generateOne(args)
+    record['tiles'] = base64.b64decode(record['tiles'])
+    return analyzeRecord(record)
+
+class CorpusStats:
+    """Totals over any number of levels, fed one levelStats() dict at a time
+       with add(). Keeps counters and fixed size histograms only, so its size
+       doesn't grow with the number of levels."""
+
+
+    def __init__(self, buckets=BUCKETS):
+        self.levels = 0
+        self.cells = 0
+        self.tiles = dict.fromkeys(TILE_NAMES, 0)
+        self.other = 0
+        self.buckets = buckets
+        self.coverage = [0] * buckets
+        self.wallRatio = [0] * buckets
+        self.coverageSum = 0.0
+        self.wallRatioSum = 0.0
+        self.coverageRange = None
+        self.rooms = 0
+        # inside area -> number of rooms that big
+        self.roomSizes = Counter()
+
+    def _bucket(self, value):
+        return min(int(value * self.buckets), self.buckets - 1)
+
+    def add(self, stats):
+        self.levels += 1
+        self.cells += stats['cells']
+        for name, count in stats['tiles'].items():
+            self.tiles[name] += count
+        self.other += stats['other']
+        coverage, wallRatio = stats['coverage'], stats['wallRatio']
+        self.coverage[self._bucket(coverage)] += 1
+        self.wallRatio[self._bucket(wallRatio)] += 1
+        self.coverageSum += coverage
+        self.wallRatioSum += wallRatio
+        if self.coverageRange is None:
+            self.coverageRange = (coverage, coverage)
+        else:
+            low, high = self.coverageRange
+            self.coverageRange = (min(low, coverage), max(high, coverage))
+        self.rooms += len(stats['roomSizes'])
+        self.roomSizes.update(stats['roomSizes'])
+
+    def asDict(self):
+        """Returns the totals as a plain dict (e.g. for json.dumps())."""
+
+        levels = self.levels or 1
+        area = sum(size * count for size, count in self.roomSizes.items())
+        return {'levels': self.levels,
+                'cells': self.cells,
+                'tiles': dict(self.tiles),
+                'other': self.other,
+                'meanCoverage': self.coverageSum / levels,
+                'coverageRange': self.coverageRange,
+                'coverageHistogram': list(self.coverage),
+                'meanWallRatio': self.wallRatioSum / levels,
+                'wallRatioHistogram': list(self.wallRatio),
+                'rooms': self.rooms,
+                'meanRoomSize': area / self.rooms if self.rooms else 0.0,
+                'roomSizes': dict(sorted(self.roomSizes.items()))}
+
+def writeAscii(out, tiles, ysize, xsize, title=None):
+    """Writes the level to out (a binary file) as text, one line per row,
+       after an optional title line and followed by an empty line."""
+
+    glyphs = tiles.translate(GLYPH_TABLE)
+    lines = [glyphs[y * xsize:(y + 1) * xsize] for y in range(ysize)]
+    if title is not None:
+        lines.insert(0, title.encode('ascii'))
+    lines.append(b'')
+    out.write(b'\n'.join(lines) + b'\n')
+
+def writePGM(out, tiles, ysize, xsize):
+    """Writes the level to out (a binary file) as a binary PGM image, one
+       pixel per cell (see PGM_TABLE)."""
+
+    out.write('P5\n{0} {1}\n255\n'.format(xsize, ysize).encode('ascii'))
+    out.write(tiles.translate(PGM_TABLE))
+
+def analyzeStream(records, totals, ascii=None, pgmDir=None, statsOut=None):
+    """Runs every analyzed record (see analyzeRecord()) through the outputs as
+       it arrives: its stats into totals (a CorpusStats) and, when given, its
+       map into the ascii file, a PGM image in pgmDir and a line of JSON into
+       statsOut. Nothing is kept once a record is done. Returns totals."""
+
+    for record in records:
+        stats = record['analysis']
+        totals.add(stats)
+        tiles, ysize, xsize = record['tiles'], record['ysize'], record['xsize']
+        if ascii is not None:
+            writeAscii(ascii, tiles, ysize, xsize, "seed {0}".format(record['seed']))
+        if pgmDir is not None:
+            path = os.path.join(pgmDir, 'level_{0}.pgm'.format(record['seed']))
+            with open(path, 'wb') as f:
+                writePGM(f, tiles, ysize, xsize)
+        if statsOut is not None:
+            line = dict(stats, seed=record['seed'])
+            statsOut.write(json.dumps(line, separators=(',', ':')))
+            statsOut.write('\n')
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Level statistics and images.")
+    parser.add_argument('batch', nargs='?', default=None,
+                        help="file written by batch.py ('-' for stdin)")
+    parser.add_argument('--generate', type=int, default=None, metavar='N',
+                        help="generate N levels instead of reading a batch")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="seed of the first generated level")
+    parser.add_argument('--size', type=int, nargs=2, default=(80, 20),
+                        metavar=('WIDTH', 'HEIGHT'), help="generated level size")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('--repair', action='store_true',
+                        help="join disconnected areas of generated levels")
+    parser.add_argument('--ascii', default=None, metavar='FILE',
+                        help="write every level as text to FILE")
+    parser.add_argument('--pgm', default=None, metavar='DIR',
+                        help="write every level as a PGM image into DIR")
+    parser.add_argument('--stats', default=None, metavar='FILE',
+                        help="write each level's stats to FILE, one JSON per line")
+    args = parser.parse_args()
+    if (args.batch is None) == (args.generate is None):
+        parser.error("give either a batch file or --generate")
+
+    infile = ascii = statsOut = None
+    try:
+        if args.generate is not None:
+            records = iterBatch(args.generate, args.size[0], args.size[1],
+                                args.seed, args.jobs, args.repair,
+                                generateAndAnalyze)
+        else:
+            infile = sys.stdin if args.batch == '-' else open(args.batch)
+            records = (analyzeRecord(record) for record in readBatch(infile))
+        if args.ascii is not None:
+            ascii = open(args.ascii, 'wb')
+        if args.pgm is not None:
+            os.makedirs(args.pgm, exist_ok=True)
+        if args.stats is not None:
+            statsOut = open(args.stats, 'w')
+        totals = analyzeStream(records, CorpusStats(), ascii, args.pgm, statsOut)
+        print(json.dumps(totals.asDict(), indent=2))
+    finally:
+        for f in (infile, ascii, statsOut):
+            if f is not None and f is not sys.stdin:
+                f.close()
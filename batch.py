@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Generates many levels at once across a pool of worker processes and writes
+   them to a file, one JSON object per line:
+
+       {"seed": ..., "ysize": ..., "xsize": ..., "full": ...,
+        "rooms": [[id, y, x, connected], ...], "stats": {...},
+        "regions": {"regions": ..., "sizes": [...]}, "tiles": "<base64>"}
+
+   "tiles" is the raw row-major tile block (one byte per tile) in base64. Level
+   number i of a batch always uses seed baseseed + i, so running the same batch
+   again gives exactly the same file, however many processes are used
+   ("stats" holds the generation counters, see metrics.py; the phase timings
+   are left out since they differ from run to run). "regions" tells how
+   many separate walkable areas the level has and how big they are (see
+   connectivity.py); anything but one region means part of the level can't
+   be reached."""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+from level import Level
+from connectivity import Regions, repairLevel
+
+
+def generateOne(args):
+    """Builds a single level and returns it as a dict ready for encoding.
+       args is a (ydim, xdim, seed, repair) tuple, same order as Level's
+       constructor; with repair set, disconnected areas are joined up with
+       corridors before the level is stored."""
+
+    ydim, xdim, seed, repair = args
+    lev = Level(ydim, xdim, seed)
+    if repair:
+        regions = repairLevel(lev)
+    else:
+        regions = Regions(lev)
+    stats = lev.stats.asDict()
+    # wall clock times would make two runs of the same batch differ
+    del stats['timings']
+    return {'seed': seed,
+            'ysize': lev.getYDim(),
+            'xsize': lev.getXDim(),
+            'full': lev.isFull,
+            'rooms': lev.rooms,
+            'stats': stats,
+            'regions': regions.asDict(),
+            'tiles': base64.b64encode(lev.levelArr).decode('ascii')}
+
+def iterBatch(count, ydim, xdim, baseseed, processes=None, repair=False,
+              work=generateOne):
+    """Generates count levels with seeds baseseed .. baseseed+count-1 using
+       a process pool and yields what work (a module level function, called
+       in the workers with generateOne's arguments) returns for each, in seed
+       order as they are finished."""
+
+    jobs = ((ydim, xdim, baseseed + i, repair) for i in range(count))
+    with multiprocessing.Pool(processes) as pool:
+        # imap keeps results in order while still letting every worker run;
+        # chunks cut down the inter-process chatter for small levels
+        chunk = max(1, count // (4 * (processes or os.cpu_count() or 1)))
+        for result in pool.imap(work, jobs, chunksize=min(chunk, 64)):
+            yield result
+
+def generateBatch(count, ydim, xdim, baseseed, outfile, processes=None, repair=False):
+    """Generates count levels (see iterBatch()) and streams them to outfile
+       (an open text file) in seed order as they are finished. With repair
+       set every level is run through connectivity.repairLevel() first.
+       Returns number of levels written."""
+
+    written = 0
+    for record in iterBatch(count, ydim, xdim, baseseed, processes, repair):
+        outfile.write(json.dumps(record, separators=(',', ':')))
+        outfile.write('\n')
+        written += 1
+    return written
+
+def readBatch(infile):
+    """Reads levels written by generateBatch back, yielding one dict per level
+       with "tiles" decoded to a bytearray."""
+
+    for line in infile:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        record['tiles'] = bytearray(base64.b64decode(record['tiles']))
+        yield record
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-generate a batch of levels.")
+    parser.add_argument('-n', '--count', type=int, default=100,
+                        help="number of levels to generate")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="seed of the first level, level i uses seed+i")
+    parser.add_argument('--size', type=int, nargs=2, default=(80, 20),
+                        metavar=('WIDTH', 'HEIGHT'), help="level size")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file, '-' for stdout")
+    parser.add_argument('--repair', action='store_true',
+                        help="join disconnected areas of each level with corridors")
+    args = parser.parse_args()
+
+    if args.output == '-':
+        out = sys.stdout
+    else:
+        out = open(args.output, 'w')
+    try:
+        generateBatch(args.count, args.size[0], args.size[1], args.seed, out,
+                      args.jobs, args.repair)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Benchmarks for level generation, tile access, rendering and the game loop.
+   Results are written as JSON so runs from different commits can be
+   compared:
+
+       python bench.py -o before.json
+       ... change things ...
+       python bench.py -o after.json --compare before.json
+
+   Every benchmark uses fixed seeds, so two runs measure the same work."""
+import argparse
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from level import Level, TILE_FLOOR, TILE_WALL
+from render import Renderer
+from actor import Actor
+from main import Game
+
+# (width, height) as passed to Level; from the default game size up to huge
+SIZES = ((80, 20), (200, 100), (500, 500), (1000, 1000), (2000, 2000))
+QUICK_SIZES = SIZES[:3]
+SEEDS = (1, 2, 3)
+
+def _summary(samples):
+    """Returns mean, min, median and 99th percentile of a list of timings."""
+
+    ordered = sorted(samples)
+    return {'mean': sum(ordered) / len(ordered),
+            'min': ordered[0],
+            'p50': ordered[len(ordered) // 2],
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            'samples': len(ordered)}
+
+def benchGeneration(sizes, seeds):
+    """Time to build a Level, with its probe and room counters."""
+
+    results = {}
+    for width, height in sizes:
+        times = []
+        stats = []
+        for seed in seeds:
+            started = time.perf_counter()
+            lev = Level(width, height, seed)
+            times.append(time.perf_counter() - started)
+            stats.append(lev.stats)
+        entry = _summary(times)
+        entry['probes'] = sum(s.probes for s in stats)
+        entry['rejectedProbes'] = sum(s.rejectedProbes for s in stats)
+        entry['roomsBuilt'] = sum(s.roomsBuilt for s in stats)
+        entry['phases'] = {phase: sum(s.timings[phase] for s in stats)
+                           for phase in stats[0].timings}
+        results['{0}x{1}'.format(width, height)] = entry
+    return results
+
+def benchTileAccess(width, height, count=200000):
+    """getTile/setTile calls per second on random cells, plus bulk
+       fillRect/getRect throughput in cells per second."""
+
+    lev = Level(width, height, 1)
+    rng = random.Random(0)
+    ysize, xsize = lev.getYDim(), lev.getXDim()
+    cells = [(rng.randrange(ysize), rng.randrange(xsize)) for i in range(count)]
+
+    getTile = lev.getTile
+    started = time.perf_counter()
+    for y, x in cells:
+        getTile(y, x)
+    gettime = time.perf_counter() - started
+
+    setTile = lev.setTile
+    started = time.perf_counter()
+    for y, x in cells:
+        setTile(y, x, TILE_FLOOR)
+    settime = time.perf_counter() - started
+
+    rects = [(rng.randrange(ysize - 12), rng.randrange(xsize - 12))
+             for i in range(count // 100)]
+    started = time.perf_counter()
+    for y, x in rects:
+        lev.fillRect(y, x, 12, 12, TILE_WALL)
+    filltime = time.perf_counter() - started
+    started = time.perf_counter()
+    for y, x in rects:
+        lev.getRect(y, x, 12, 12)
+    recttime = time.perf_counter() - started
+
+    return {'size': '{0}x{1}'.format(width, height),
+            'getTilePerSec': count / gettime,
+            'setTilePerSec': count / settime,
+            'fillRectCellsPerSec': len(rects) * 144 / filltime,
+            'getRectCellsPerSec': len(rects) * 144 / recttime}
+
+def benchRender(width, height, frames=50):
+    """Cost of a full frame and of a frame where one actor moved, plus how
+       many bytes each sends to the terminal."""
+
+    lev = Level(width, height, 1)
+    start = lev.levelArr.find(bytes((TILE_FLOOR,)))
+    y, x = divmod(start, lev.getXDim())
+    actor = Actor(y, x)
+    lev.entities.add(actor)
+    out = io.StringIO()
+    renderer = Renderer(out)
+
+    full = []
+    for i in range(frames):
+        renderer.invalidate()
+        out.seek(0)
+        out.truncate()
+        started = time.perf_counter()
+        renderer.draw(lev)
+        full.append(time.perf_counter() - started)
+    fullbytes = len(out.getvalue())
+
+    moves = []
+    movebytes = 0
+    for i in range(frames):
+        out.seek(0)
+        out.truncate()
+        # step back and forth between two cells
+        lev.entities.move(actor, y, x + (i % 2))
+        started = time.perf_counter()
+        renderer.draw(lev)
+        moves.append(time.perf_counter() - started)
+        movebytes += len(out.getvalue())
+
+    return {'size': '{0}x{1}'.format(width, height),
+            'fullFrame': _summary(full), 'fullFrameBytes': fullbytes,
+            'moveFrame': _summary(moves), 'moveFrameBytes': movebytes / frames}
+
+def benchKeypress(keys=2000):
+    """Per-key latency of main.Game (turn plus redraw) with scripted keys and
+       rendering into a buffer instead of the terminal."""
+
+    out = io.StringIO()
+    game = Game(Level(80, 20, 1), Renderer(out))
+    game.renderer.draw(game.dungeon)
+    rng = random.Random(0)
+    script = [rng.choice('wasd') for i in range(keys)]
+    latencies = []
+    for key in script:
+        started = time.perf_counter()
+        game.handleKey(key)
+        latencies.append(time.perf_counter() - started)
+        if out.tell() > 1 << 20:
+            out.seek(0)
+            out.truncate()
+    return _summary(latencies)
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=sys.path[0] or '.').decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runAll(sizes):
+    return {'commit': gitCommit(),
+            'python': platform.python_version(),
+            'generation': benchGeneration(sizes, SEEDS),
+            'tileAccess': benchTileAccess(*sizes[-1]),
+            'render': [benchRender(*size) for size in sizes[:3]],
+            'keypress': benchKeypress()}
+
+def _flatten(data, prefix=''):
+    """Turns nested results into {'a.b.c': number} for comparing runs."""
+
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, prefix + str(key) + '.'))
+    elif isinstance(data, list):
+        for value in data:
+            name = value.get('size', '') if isinstance(value, dict) else ''
+            flat.update(_flatten(value, prefix + name + '.'))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix[:-1]] = data
+    return flat
+
+def compare(old, new):
+    """Returns lines showing how each number changed between two runs."""
+
+    before, after = _flatten(old), _flatten(new)
+    lines = []
+    for key in sorted(after):
+        if key in before and before[key]:
+            change = (after[key] - before[key]) / before[key] * 100
+            lines.append('{0:60} {1:>14.6g} {2:>14.6g} {3:>+8.1f}%'.format(
+                         key, before[key], after[key], change))
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument('-o', '--output', default='-',
+                        help="where to write the JSON results, '-' for stdout")
+    parser.add_argument('--quick', action='store_true',
+                        help="only use the smaller map sizes")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="earlier results to compare against")
+    args = parser.parse_args()
+
+    results = runAll(QUICK_SIZES if args.quick else SIZES)
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    if args.compare:
+        with open(args.compare) as old:
+            for line in compare(json.load(old), results):
+                print(line, file=sys.stderr)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import re
+from array import array
+from level import PASSABLE_TABLE, TILE_DOORCLOSED
+
+# tile ID -> 1 if it joins the cells around it; like PASSABLE_TABLE, but
+# a closed door only blocks until somebody opens it
+CONNECTING_TABLE = bytearray(PASSABLE_TABLE)
+CONNECTING_TABLE[TILE_DOORCLOSED] = 1
+CONNECTING_TABLE = bytes(CONNECTING_TABLE)
+
+_RUN = re.compile(b'\x01+')
+
+class Regions:
+    """The connected areas of a level (4-way moves between cells whose tiles
+       are set in the table, CONNECTING_TABLE by default).
+
+       The map is scanned once, row by row. Every row is cut into runs of
+       connecting cells with a regular expression, so the cells themselves
+       are never looked at one by one from Python, and runs that touch a run
+       of the row above are merged with union-find. The cost depends on the
+       number of runs, which is far below the number of cells on any
+       generated map.
+
+       Region labels go from 1 to count, largest region first."""
+
+
+    def __init__(self, level, table=CONNECTING_TABLE):
+        self.ysize = level.getYDim()
+        self.xsize = level.getXDim()
+        # per row, a list of (start, end, run number); end is exclusive
+        self.rows = []
+        parent = []
+
+        def find(run):
+            while parent[run] != run:
+                parent[run] = parent[parent[run]]
+                run = parent[run]
+            return run
+
+        arr = level.levelArr
+        xsize = self.xsize
+        above = []
+        for y in range(self.ysize):
+            line = arr[y * xsize:(y + 1) * xsize].translate(table)
+            runs = []
+            i = 0
+            for match in _RUN.finditer(line):
+                start, end = match.span()
+                run = len(parent)
+                parent.append(run)
+                runs.append((start, end, run))
+                # runs of the row above overlapping this one, both lists are
+                # sorted so one pointer is enough
+                while i < len(above) and above[i][1] <= start:
+                    i += 1
+                j = i
+                while j < len(above) and above[j][0] < end:
+                    a, b = find(above[j][2]), find(run)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+                    j += 1
+            self.rows.append(runs)
+            above = runs
+
+        # number the regions, biggest first
+        sizes = {}
+        for runs in self.rows:
+            for start, end, run in runs:
+                root = find(run)
+                sizes[root] = sizes.get(root, 0) + end - start
+        order = sorted(sizes, key=lambda root: (-sizes[root], root))
+        label = {root: n for n, root in enumerate(order, 1)}
+        self.labels = array('i', (label[find(run)] for run in range(len(parent))))
+        self.sizes = [sizes[root] for root in order]
+        self.count = len(order)
+
+    def isConnected(self):
+        """True if every connecting cell can be reached from every other one."""
+
+        return self.count <= 1
+
+    def getLabel(self, y, x):
+        """Returns the region label of cell (y, x), 0 if it doesn't connect."""
+
+        if not (0 <= y < self.ysize and 0 <= x < self.xsize):
+            return 0
+        for start, end, run in self.rows[y]:
+            if start > x:
+                break
+            if x < end:
+                return self.labels[run]
+        return 0
+
+    def getSize(self, label):
+        return self.sizes[label - 1]
+
+    def getCell(self, label):
+        """Returns some (y, x) cell of region label."""
+
+        for y, runs in enumerate(self.rows):
+            for start, end, run in runs:
+                if self.labels[run] == label:
+                    return (y, (start + end - 1) // 2)
+        return None
+
+    def getLabelMap(self):
+        """Returns the label of every cell as an array laid out like
+           Level.levelArr."""
+
+        xsize = self.xsize
+        labels = array('i', bytes(4 * self.ysize * xsize))
+        for y, runs in enumerate(self.rows):
+            for start, end, run in runs:
+                labels[y * xsize + start:y * xsize + end] = \
+                    array('i', (self.labels[run],)) * (end - start)
+        return labels
+
+    def findClosest(self, y, x, label):
+        """Returns the cell of region label closest to (y, x) (Manhattan
+           distance), or None."""
+
+        best = None
+        bestdist = None
+        for ry, runs in enumerate(self.rows):
+            dy = abs(ry - y)
+            if bestdist is not None and dy >= bestdist:
+                continue
+            for start, end, run in runs:
+                if self.labels[run] != label:
+                    continue
+                rx = min(max(x, start), end - 1)
+                dist = dy + abs(rx - x)
+                if bestdist is None or dist < bestdist:
+                    best, bestdist = (ry, rx), dist
+        return best
+
+    def asDict(self):
+        """Returns a summary (region count and sizes) for reports."""
+
+        return {'regions': self.count, 'sizes': list(self.sizes)}
+
+def repairLevel(level, table=CONNECTING_TABLE):
+    """Joins every region of level to the largest one with a corridor (see
+       Level.generateCorridor()), smallest regions last so they can reuse
+       corridors dug for bigger ones. Returns the Regions of the repaired
+       level; check its isConnected() to see if everything could be joined,
+       if not the level is best thrown away and generated again."""
+
+    regions = Regions(level, table)
+    if regions.isConnected():
+        return regions
+    for label in range(2, regions.count + 1):
+        y, x = regions.getCell(label)
+        target = regions.findClosest(y, x, 1)
+        level.generateCorridor(y, x, target[0], target[1])
+    return Regions(level, table)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import random
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from level import Level, TILE_DOWNSTAIRS, TILE_UPSTAIRS
+from levelfile import dumpLevel, readLevel
+from world import deriveSeed
+
+# how many floors are kept in the cache
+MAX_FLOORS = 16
+
+def buildFloor(ydim, xdim, seed):
+    """Generates a floor and returns it compressed (the form the cache keeps
+       floors in). Runs in the worker process."""
+
+    lev = Level(ydim, xdim, seed)
+    # every room center already holds an up staircase; the last room's one
+    # leads down instead
+    if lev.rooms:
+        roomid, y, x, connected = lev.rooms[-1]
+        lev.setTile(y, x, TILE_DOWNSTAIRS)
+    return zlib.compress(dumpLevel(lev))
+
+class Dungeon:
+    """A stack of floors joined by stairs. Every floor is seeded from the
+       dungeon seed and its depth, so a dungeon can always be generated
+       again.
+
+       The floor below the current one is generated ahead of time on a worker
+       process (pass any concurrent.futures executor to use something else),
+       so going down usually only takes unpacking it. Floors that were
+       left are kept, edits and all, in an LRU cache of zlib compressed level
+       files (see levelfile.py); a floor that fell out of the cache is
+       generated again from its seed when it is revisited."""
+
+
+    def __init__(self, seed=None, ydim=80, xdim=20, maxFloors=MAX_FLOORS, executor=None):
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+        self.seed = seed
+        self.ydim = ydim
+        self.xdim = xdim
+        self.maxFloors = max(1, maxFloors)
+        self.executor = executor
+        self.ownExecutor = executor is None
+        # depth -> compressed floor, least recently used first
+        self.floors = OrderedDict()
+        # depth -> future of a floor being generated
+        self.pending = {}
+        self.depth = 0
+        self.current = self._restore(self._take(0))
+        self.prefetch(1)
+
+    def close(self):
+        """Stops the worker (if the dungeon started it)."""
+
+        if self.ownExecutor and self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def getSeed(self, depth):
+        return deriveSeed(self.seed, 'floor', depth)
+
+    def prefetch(self, depth):
+        """Starts generating floor depth in the background unless it is cached
+           or already on its way."""
+
+        if depth < 0 or depth in self.floors or depth in self.pending:
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1)
+        self.pending[depth] = self.executor.submit(buildFloor, self.ydim,
+                                                   self.xdim, self.getSeed(depth))
+
+    def _take(self, depth):
+        """Returns compressed floor depth, from the cache, from the worker
+           (waiting if it isn't done yet) or generated right here."""
+
+        data = self.floors.pop(depth, None)
+        if data is not None:
+            return data
+        future = self.pending.pop(depth, None)
+        if future is not None:
+            return future.result()
+        return buildFloor(self.ydim, self.xdim, self.getSeed(depth))
+
+    def _restore(self, data):
+        return readLevel(zlib.decompress(data))
+
+    def _store(self, depth, level):
+        self.floors[depth] = zlib.compress(dumpLevel(level))
+        self.floors.move_to_end(depth)
+        while len(self.floors) > self.maxFloors:
+            self.floors.popitem(last=False)
+
+    def changeFloor(self, depth):
+        """Leaves the current floor (it goes into the cache) for floor depth
+           and returns it. The floor after it starts generating right away."""
+
+        if depth < 0:
+            raise ValueError("no floor above the first one")
+        data = self._take(depth)
+        self._store(self.depth, self.current)
+        self.depth = depth
+        self.current = self._restore(data)
+        self.prefetch(depth + 1)
+        return self.current
+
+    def descend(self):
+        return self.changeFloor(self.depth + 1)
+
+    def ascend(self):
+        return self.changeFloor(self.depth - 1)
+
+    def getState(self):
+        """Returns what setState() needs to bring the dungeon back to where it
+           is now: the depth, the current floor and the cached ones (all
+           compressed)."""
+
+        return {'depth': self.depth,
+                'current': zlib.compress(dumpLevel(self.current)),
+                'floors': list(self.floors.items())}
+
+    def setState(self, state):
+        """Puts the dungeon back into a state from getState(). Returns the
+           current floor."""
+
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.floors = OrderedDict(state['floors'])
+        self.depth = state['depth']
+        self.current = self._restore(state['current'])
+        self.prefetch(self.depth + 1)
+        return self.current
+
+    def findStairs(self, tileid):
+        """Returns (y, x) of a staircase of type tileid on the current floor,
+           or None if there is none."""
+
+        i = self.current.levelArr.find(bytes((tileid,)))
+        if i < 0:
+            return None
+        return divmod(i, self.current.getXDim())
+
+    def getArrival(self, down):
+        """Where to put the player after taking the stairs: on an up staircase
+           when going down, on the down staircase when going up."""
+
+        return self.findStairs(TILE_UPSTAIRS if down else TILE_DOWNSTAIRS)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+class EntityLayer:
+    """Keeps track of everything that stands on the map (player, monsters,
+       items) separately from the level's tiles. Entities are hashed by their
+       (y, x) cell, so asking who is at a cell or moving an entity costs O(1)
+       no matter how many entities there are.
+
+       An entity is any object with y, x and character attributes (Actor
+       already has them). Entities sharing a cell are kept in the order they
+       arrived, the last one is drawn on top."""
+
+
+    def __init__(self):
+        self.cells = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for stack in self.cells.values():
+            yield from stack
+
+    def add(self, entity):
+        """Puts entity on the map at its own (y, x) position."""
+
+        key = (entity.y, entity.x)
+        stack = self.cells.get(key)
+        if stack is None:
+            self.cells[key] = [entity]
+        else:
+            stack.append(entity)
+        self.count += 1
+
+    def _unlink(self, entity, y, x):
+        stack = self.cells.get((y, x))
+        if stack is None or entity not in stack:
+            raise KeyError("entity is not at ({0}, {1})".format(y, x))
+        if len(stack) == 1:
+            del self.cells[(y, x)]
+        else:
+            stack.remove(entity)
+
+    def remove(self, entity):
+        """Takes entity off the map."""
+
+        self._unlink(entity, entity.y, entity.x)
+        self.count -= 1
+
+    def move(self, entity, y, x):
+        """Moves entity to (y, x), updating its coordinates."""
+
+        self._unlink(entity, entity.y, entity.x)
+        entity.y = y
+        entity.x = x
+        self.count -= 1
+        self.add(entity)
+
+    def moved(self, entity, oldy, oldx):
+        """Tells the layer that entity has already changed its own coordinates
+           (e.g. through Actor.update()) and was at (oldy, oldx) before."""
+
+        self._unlink(entity, oldy, oldx)
+        self.count -= 1
+        self.add(entity)
+
+    def getAt(self, y, x):
+        """Returns sequence of entities at (y, x), topmost last. It is empty if
+           there is nobody there; don't modify it."""
+
+        return self.cells.get((y, x), ())
+
+    def getTopAt(self, y, x):
+        """Returns the topmost entity at (y, x) or None."""
+
+        stack = self.cells.get((y, x))
+        if stack:
+            return stack[-1]
+        return None
+
+    def isOccupied(self, y, x):
+        return (y, x) in self.cells
+
+    def stamp(self, frame, xsize):
+        """Writes the glyph of the topmost entity of every occupied cell into
+           frame, a bytearray of glyph bytes laid out like Level.levelArr.
+           Cells outside the frame are skipped."""
+
+        size = len(frame)
+        for (y, x), stack in self.cells.items():
+            if 0 <= x < xsize:
+                i = y * xsize + x
+                if 0 <= i < size:
+                    frame[i] = ord(stack[-1].character)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+from level import TILE_UNUSED, TILE_WALL, TILE_DOORCLOSED, GLYPH_TABLE
+
+# tile ID -> 1 if it blocks sight (same use as level.PASSABLE_TABLE); empty
+# space is solid rock
+OPAQUE_TABLE = bytearray(256)
+for tileid in (TILE_UNUSED, TILE_WALL, TILE_DOORCLOSED):
+    OPAQUE_TABLE[tileid] = 1
+OPAQUE_TABLE = bytes(OPAQUE_TABLE)
+del tileid
+
+# how far the player sees
+SIGHT_RADIUS = 8
+
+# (row direction y, row direction x, column direction y, column direction x)
+# of the four quadrants: north, east, south, west
+QUADRANTS = ((-1, 0, 0, 1), (0, 1, 1, 0), (1, 0, 0, 1), (0, -1, 1, 0))
+
+class FieldOfView:
+    """What can be seen from where, using symmetric shadowcasting: each of
+       the four quadrants around the viewer is scanned row by row, and walls
+       cast shadows (slope ranges) that the rows further out skip. Slopes
+       are kept as integer fractions. The result is symmetric: if a can see
+       b, b can see a, so one field of view answers line of sight questions
+       in both directions.
+
+       Results (the set of visible levelArr indices) are cached per
+       (y, x, radius), least recently used first out. The opacity bitmap
+       follows the level's tile changes and only the cached results whose
+       area contains a cell whose opacity changed are dropped.
+
+       update() moves the viewer (the player): what it sees is remembered in
+       explored, and maskFrame() turns a frame into what the player knows
+       of the level."""
+
+
+    def __init__(self, level, maxResults=32):
+        self.level = level
+        self.ysize = level.getYDim()
+        self.xsize = level.getXDim()
+        self.opaque = bytearray(level.levelArr).translate(OPAQUE_TABLE)
+        self.maxResults = maxResults
+        # (y, x, radius) -> frozenset of visible indices, least recently used
+        # first
+        self.results = OrderedDict()
+        # the viewer's current view, and 1 for every cell it has ever seen
+        self.visible = frozenset()
+        self.explored = bytearray(self.ysize * self.xsize)
+        # glyphs of the explored cells as last seen, space elsewhere
+        self.remembered = bytearray(b' ' * (self.ysize * self.xsize))
+        level.addTileListener(self.tilesChanged)
+
+    def close(self):
+        """Stops listening to the level."""
+
+        self.level.removeTileListener(self.tilesChanged)
+
+    def tilesChanged(self, ypos, xpos, leny, lenx):
+        """Tile listener; refreshes the opacity bitmap for the rectangle and
+           drops cached results that could see a cell whose opacity
+           changed."""
+
+        xsize = self.xsize
+        arr = self.level.levelArr
+        changed = []
+        for y in range(ypos, ypos + leny):
+            start = y * xsize + xpos
+            new = arr[start:start + lenx].translate(OPAQUE_TABLE)
+            old = self.opaque[start:start + lenx]
+            if new != old:
+                for x, (was, now) in enumerate(zip(old, new), xpos):
+                    if was != now:
+                        changed.append((y, x))
+                self.opaque[start:start + lenx] = new
+        if not changed or not self.results:
+            return
+        for key in list(self.results):
+            y, x, radius = key
+            for cy, cx in changed:
+                if abs(cy - y) <= radius and abs(cx - x) <= radius:
+                    del self.results[key]
+                    break
+
+    def compute(self, y, x, radius):
+        """Returns the levelArr indices of every cell seen from (y, x) within
+           radius as a frozenset."""
+
+        key = (y, x, radius)
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            return result
+        result = frozenset(self._shadowcast(y, x, radius))
+        self.results[key] = result
+        if len(self.results) > self.maxResults:
+            self.results.popitem(last=False)
+        return result
+
+    def _shadowcast(self, oy, ox, radius):
+        ysize, xsize = self.ysize, self.xsize
+        opaque = self.opaque
+        seen = []
+        if not (0 <= oy < ysize and 0 <= ox < xsize):
+            return seen
+        seen.append(oy * xsize + ox)
+        limit = radius * radius + radius
+        for rowy, rowx, coly, colx in QUADRANTS:
+            # rows still to scan: (depth, start slope, end slope), slopes as
+            # (numerator, denominator) with positive denominators
+            rows = [(1, -1, 1, 1, 1)]
+            while rows:
+                depth, startnum, startden, endnum, endden = rows.pop()
+                if depth > radius:
+                    continue
+                # columns whose centers the slopes cover, ties rounded inwards
+                first = (2 * depth * startnum + startden) // (2 * startden)
+                last = -((endden - 2 * depth * endnum) // (2 * endden))
+                previous = None
+                for col in range(first, last + 1):
+                    y = oy + rowy * depth + coly * col
+                    x = ox + rowx * depth + colx * col
+                    if 0 <= y < ysize and 0 <= x < xsize:
+                        i = y * xsize + x
+                        wall = opaque[i] == 1
+                    else:
+                        i = -1
+                        wall = True
+                    if i >= 0 and depth * depth + col * col <= limit:
+                        # floor is only seen if its center is inside the
+                        # slopes (that's what makes it symmetric), walls as
+                        # soon as any part is
+                        if wall or (col * startden >= depth * startnum and
+                                    col * endden <= depth * endnum):
+                            seen.append(i)
+                    if previous is True and not wall:
+                        startnum, startden = 2 * col - 1, 2 * depth
+                    if previous is False and wall:
+                        rows.append((depth + 1, startnum, startden,
+                                     2 * col - 1, 2 * depth))
+                    previous = wall
+                if previous is False:
+                    rows.append((depth + 1, startnum, startden, endnum, endden))
+        return seen
+
+    def canSee(self, fromy, fromx, toy, tox, radius=SIGHT_RADIUS):
+        """True if (toy, tox) is in sight from (fromy, fromx). Because the
+           result is symmetric, monsters checking if they see the player
+           should ask canSee(player, monster): every monster then shares the
+           player's cached field of view."""
+
+        if not (0 <= toy < self.ysize and 0 <= tox < self.xsize):
+            return False
+        if abs(toy - fromy) > radius or abs(tox - fromx) > radius:
+            return False
+        return toy * self.xsize + tox in self.compute(fromy, fromx, radius)
+
+    def update(self, y, x, radius=SIGHT_RADIUS):
+        """Moves the viewer to (y, x): its view becomes self.visible and
+           everything in it is marked explored and remembered as it looks
+           now."""
+
+        self.visible = self.compute(y, x, radius)
+        explored = self.explored
+        remembered = self.remembered
+        arr = self.level.levelArr
+        glyphs = GLYPH_TABLE
+        for i in self.visible:
+            explored[i] = 1
+            remembered[i] = glyphs[arr[i]]
+        return self.visible
+
+    def isVisible(self, y, x):
+        return y * self.xsize + x in self.visible
+
+    def isExplored(self, y, x):
+        return self.explored[y * self.xsize + x] == 1
+
+    def maskFrame(self, frame):
+        """Returns frame (glyph bytes from Level.getGlyphs()) cut down to what
+           the viewer knows: cells in view as they are, entities included,
+           explored cells as they were last seen and blanks elsewhere."""
+
+        masked = bytearray(self.remembered)
+        for i in self.visible:
+            masked[i] = frame[i]
+        return masked
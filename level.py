@@ -1,7 +1,15 @@
 #!/usr/bin/env python
 import os
+import sys
 import random
-import math
+import heapq
+import time
+from array import array
+from occupancy import OccupancyIndex, CandidatePool
+from entity import EntityLayer
+from spatial import SpatialGrid
+from metrics import GenerationStats
+from snapshot import SnapshotTracker
 
 #       ID      CHAR    PASSABLE?
 TILES =([0,     ' ',    False],     # UNUSED
@@ -10,8 +18,7 @@ TILES =([0,     ' ',    False],     # UNUSED
         [3,     '^',    True],      # STAIRS UP
         [4,     'v',    True],      # STAIRS DOWN
         [5,     '+',    False],     # CLOSED DOOR
-        [6,     '/',    True],      # OPEN DOOR
-        [7,     '@',    True])      # PLAYER (XXX need to make this separate from the level XXX)
+        [6,     '/',    True])      # OPEN DOOR
 
 # Some sugar
 TILE_UNUSED = TILES[0][0]
@@ -23,43 +30,174 @@ TILE_DOWNSTAIRS = TILES[4][0]
 TILE_DOORCLOSED = TILES[5][0]
 TILE_DOOROPEN = TILES[6][0]
 
+# tile ID -> glyph byte, for use with bytes.translate() so whole rows of the
+# map can be turned into printable text at once; unknown IDs show up as '?'
+GLYPH_TABLE = bytearray(b'?' * 256)
+for tile in TILES:
+    GLYPH_TABLE[tile[0]] = ord(tile[1])
+GLYPH_TABLE = bytes(GLYPH_TABLE)
+# tile ID -> 1 if it can be walked on, 0 otherwise (same use as GLYPH_TABLE)
+PASSABLE_TABLE = bytearray(256)
+for tile in TILES:
+    PASSABLE_TABLE[tile[0]] = 1 if tile[2] else 0
+PASSABLE_TABLE = bytes(PASSABLE_TABLE)
+del tile
+# tile ID -> 1 for what the inside of a room is made of (floor, and the stairs
+# put in its center), 0 for everything else (same use as GLYPH_TABLE)
+INTERIOR_TABLE = bytearray(256)
+for tileid in (TILE_FLOOR, TILE_UPSTAIRS, TILE_DOWNSTAIRS):
+    INTERIOR_TABLE[tileid] = 1
+INTERIOR_TABLE = bytes(INTERIOR_TABLE)
+# tile ID -> 1 if the occupancy index counts it
+OCCUPIED_TABLE = b'\x00' + b'\x01' * 255
+del tileid
+
+# step costs used when looking for a corridor path; digging through empty
+# space costs more than following floor that's already there, so corridors
+# tend to merge instead of running side by side
+CORRIDOR_COSTS = [1] * 256
+CORRIDOR_COSTS[TILE_UNUSED] = 2
+CORRIDOR_COSTS[TILE_WALL] = 10
+CORRIDOR_COST_ROOM = 20
+# how far outside the box spanned by its ends a corridor may wander
+CORRIDOR_MARGIN = 10
+# how many nearby rooms (nearest ones, and next ones by x and by y) each room
+# may be linked to
+CORRIDOR_NEIGHBORS = 3
+# bucket size of the room center index
+ROOM_INDEX_CELL = 16
+
 NORTH = 0
 EAST = 1
 SOUTH = 2
 WEST = 3
 
+def findRoomInterior(interior, xsize, y, x):
+    """Returns (top, left, leny, lenx) of the inside of the room centered at
+       (y, x), measured on interior (the tiles translated with
+       INTERIOR_TABLE): rooms are rectangles, so the runs of room interior
+       through the center along its row and its column give the size."""
+
+    row = interior[y * xsize:(y + 1) * xsize]
+    column = interior[x::xsize]
+    left = row.rfind(0, 0, x) + 1
+    right = row.find(0, x)
+    top = column.rfind(0, 0, y) + 1
+    bottom = column.find(0, y)
+    if right == -1:
+        right = xsize
+    if bottom == -1:
+        bottom = len(column)
+    return (top, left, bottom - top, right - left)
+
 class Level:
     """WARNING: This whole class uses (y, x) coordinate system (instead of 
        (x, y)). This means [3][2] doesn't indicate 3rd row of 4th column, but
        4th row of 3rd column."""
 
 
-    def __init__(self, ydim, xdim):
+    def __init__(self, ydim, xdim, seed=None, metrics=None):
         assert (xdim > 0 and ydim > 0), "x and y passed to constructor must \
 be bigger than 0"
         # this is confusing, but it makes it so X is the horizontal
         # (left-to-right) axis and Y is the vertical (top-down) axis
         self.ysize = xdim
         self.xsize = ydim
-        self.maxObjects = random.randint(10, 18)
+        # every level has its own RNG, so generating one level doesn't touch
+        # the global random state and the same seed always gives the same map;
+        # with no seed given we pick one and keep it so the level can be
+        # reproduced later
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+        self.seed = seed
+        self.random = random.Random(seed)
+        # counters and phase timings of the generation, see metrics.py
+        self.stats = GenerationStats(seed, self.ysize, self.xsize)
+        started = time.perf_counter()
+        self.maxObjects = self.random.randint(10, 18)
         self.roomProb = 70
-        self.rooms = []
-        self.levelArr = [[TILE_UNUSED for row in range(self.xsize)] \
-                                      for col in range(self.ysize)]
-        # set seed to use current local time, this is done here to use same
-        # seed for everything
-        random.seed()
+        # chance (percent) for a spare corridor link to be built anyway
+        self.loopProb = 15
+        self._setUp()
         # make a border of unpassable walls around the map (though TILE_UNUSED
         #is also unpassable, and it is the default tile used to initialize maps)
-        for y in range(self.ysize):
-            for x in range(self.xsize):
-                if y == 0 or y == self.ysize-1:
-                    self.setTile(y, x, TILE_WALL)
-                elif x == 0 or x == self.xsize-1:
-                    self.setTile(y, x, TILE_WALL)
+        self.fillRect(0, 0, 1, self.xsize, TILE_WALL)
+        self.fillRect(self.ysize-1, 0, 1, self.xsize, TILE_WALL)
+        self.fillRect(0, 0, self.ysize, 1, TILE_WALL)
+        self.fillRect(0, self.xsize-1, self.ysize, 1, TILE_WALL)
+        self.stats.timings['init'] = time.perf_counter() - started
         # start the level generation algorithm
         self.generateLevel()
+        if metrics is not None:
+            metrics(self.stats)
     
+    def _setUp(self, levelArr=None, lazy=False):
+        """Creates the map storage and the empty containers that go with it.
+           levelArr is allocated unless given, which is how
+           levelfile.loadLevel() builds a Level around a mapped file. With
+           lazy set the occupancy index and room mask are left out; they are
+           worked out from the tiles (and self.rooms) the first time they are
+           used, see __getattr__()."""
+
+        self.rooms = []
+        # the map is stored as one contiguous row-major bytearray, one byte per
+        # tile; cell (y, x) lives at index y * xsize + x
+        if levelArr is None:
+            levelArr = bytearray(self.ysize * self.xsize)
+        self.levelArr = levelArr
+        # keeps count of every cell that isn't TILE_UNUSED, so checking if
+        # a rectangle is empty doesn't need to look at each of its tiles
+        if not lazy:
+            self.occupancy = OccupancyIndex(self.ysize, self.xsize)
+        # room ID + 1 for every cell that is inside a room (not counting its
+        # walls), 0 elsewhere; used by the corridor builder to steer around
+        # rooms other than the two it connects
+        if not lazy:
+            self.roomMask = array('H', bytes(2 * self.ysize * self.xsize))
+        # room centers by room ID, for nearest-room queries
+        self.roomIndex = SpatialGrid(ROOM_INDEX_CELL)
+        self._nearestScratch = []
+        # called with the changed rectangle whenever tiles change (see
+        # addTileListener)
+        self.tileListeners = []
+        # keeps the last snapshot and the rows changed since (see snapshot())
+        self.snapshots = None
+        # actors and items live on their own layer, never in levelArr; more
+        # layers (e.g. actor.ActorPool) can be added to layers, they are drawn
+        # in list order
+        self.entities = EntityLayer()
+        self.layers = [self.entities]
+        self.isFull = False
+
+    def __getattr__(self, name):
+        """Builds the occupancy index or room mask of a level set up with
+           lazy (see _setUp()) when it is first asked for. Only called for
+           attributes that aren't there, so it costs nothing afterwards."""
+
+        if name == 'occupancy':
+            cells = bytes(self.levelArr).translate(OCCUPIED_TABLE)
+            self.occupancy = OccupancyIndex.fromCells(self.ysize, self.xsize, cells)
+        elif name == 'roomMask':
+            self.roomMask = self._findRoomMask()
+        else:
+            raise AttributeError("'Level' object has no attribute '{0}'".format(name))
+        return self.__dict__[name]
+
+    def _findRoomMask(self):
+        """Returns the room mask worked out from the tiles: the inside of
+           every room in self.rooms is marked with its ID + 1."""
+
+        xsize = self.xsize
+        interior = bytes(self.levelArr).translate(INTERIOR_TABLE)
+        mask = array('H', bytes(2 * self.ysize * xsize))
+        for roomid, y, x, connected in self.rooms:
+            top, left, leny, lenx = findRoomInterior(interior, xsize, y, x)
+            inside = array('H', (min(roomid + 1, 0xffff),)) * lenx
+            for row in range(top, top + leny):
+                start = row * xsize + left
+                mask[start:start + lenx] = inside
+        return mask
+
     def generateRoom(self, ypos, xpos, maxylen, maxxlen, direction):
         """Creates a room at given ypos, xpos coordinates. The room is at least
            4 by 4 and at most maxylen by maxxlen, the actual dimensions are
@@ -71,362 +209,449 @@ be bigger than 0"
         if ypos < 0 or ypos > self.ysize or xpos < 0 or xpos > self.xsize:
             print("generateRoom(): Invalid ypos or xpos arguments, skipping")
             return False
+        self.stats.roomAttempts += 1
         # make the room dimensions random
-        roomleny = random.randrange(4, maxylen+1)
-        roomlenx = random.randrange(4, maxxlen+1)
+        roomleny = self.random.randrange(4, maxylen+1)
+        roomlenx = self.random.randrange(4, maxxlen+1)
 
         if not self.scanDirection(ypos, xpos, direction, roomleny, roomlenx):
+            self.stats.roomsRejected += 1
             return False
+        # work out the room's top-left corner; the room grows away from
+        # (ypos, xpos) in the given direction
         # build upwards (north)
         if direction == NORTH:
             xpos = xpos - (roomlenx // 2)
             centery = ypos - (roomleny // 2)
             centerx = xpos + (roomlenx // 2)
-            if (ypos - roomleny) <= 0 or (xpos + roomlenx) >= self.xsize:
-                return False
-            for y in range(roomleny):
-                for x in range(roomlenx):
-                    if self.getTile(ypos-y, xpos+x) != TILE_UNUSED:
-                        return False
-                    if x == 0:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif x == roomlenx-1:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif y == 0:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif y == roomleny-1:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    else:
-                        self.setTile(ypos-y, xpos+x, TILE_FLOOR)
+            outside = (ypos - roomleny) <= 0 or (xpos + roomlenx) >= self.xsize
+            top, left = ypos - roomleny + 1, xpos
         # build right (east)
         elif direction == EAST:
             ypos = ypos + (roomleny // 2)
             centery = ypos - (roomleny // 2)
             centerx = xpos + (roomlenx // 2)
-            if (ypos - roomleny) <= 0 or (xpos + roomlenx) >= self.xsize:
-                return False
-            for y in range(roomleny):
-                for x in range(roomlenx):
-                    if self.getTile(ypos-y, xpos+x) != TILE_UNUSED:
-                        return False
-                    if x == 0:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif x == roomlenx-1:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif y == 0:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    elif y == roomleny-1:
-                        self.setTile(ypos-y, xpos+x, TILE_WALL)
-                    else:
-                        self.setTile(ypos-y, xpos+x, TILE_FLOOR)
+            outside = (ypos - roomleny) <= 0 or (xpos + roomlenx) >= self.xsize
+            top, left = ypos - roomleny + 1, xpos
         # build down (south)
         elif direction == SOUTH:
             xpos = xpos - (roomlenx // 2)
             centery = ypos + (roomleny // 2)
             centerx = xpos + (roomlenx // 2)
-            if (ypos + roomleny) >= self.ysize or (xpos + roomlenx) >= self.xsize:
-                return False
-            for y in range(roomleny):
-                for x in range(roomlenx):
-                    if self.getTile(ypos+y, xpos+x) != TILE_UNUSED:
-                        return False
-                    if x == 0:
-                        self.setTile(ypos+y, xpos+x, TILE_WALL)
-                    elif x == roomlenx-1:
-                        self.setTile(ypos+y, xpos+x, TILE_WALL)
-                    elif y == 0:
-                        self.setTile(ypos+y, xpos+x, TILE_WALL)
-                    elif y == roomleny-1:
-                        self.setTile(ypos+y, xpos+x, TILE_WALL)
-                    else:
-                        self.setTile(ypos+y, xpos+x, TILE_FLOOR)
+            outside = (ypos + roomleny) >= self.ysize or (xpos + roomlenx) >= self.xsize
+            top, left = ypos, xpos
         # build left (west)
         elif direction == WEST:
             ypos = ypos + (roomleny // 2)
             centery = ypos - (roomleny // 2)
             centerx = xpos - (roomlenx // 2)
-            if (ypos - roomleny) >= self.ysize or (xpos - roomlenx) <= 0:
-                return False
-            for y in range(roomleny):
-                for x in range(roomlenx):
-                    if self.getTile(ypos-y, xpos-x) != TILE_UNUSED:
-                        return False
-                    if x == 0:
-                        self.setTile(ypos-y, xpos-x, TILE_WALL)
-                    elif x == roomlenx-1:
-                        self.setTile(ypos-y, xpos-x, TILE_WALL)
-                    elif y == 0:
-                        self.setTile(ypos-y, xpos-x, TILE_WALL)
-                    elif y == roomleny-1:
-                        self.setTile(ypos-y, xpos-x, TILE_WALL)
-                    else:
-                        self.setTile(ypos-y, xpos-x, TILE_FLOOR)
+            outside = (ypos - roomleny) >= self.ysize or (xpos - roomlenx) <= 0
+            top, left = ypos - roomleny + 1, xpos - roomlenx + 1
+
+        if outside or not self.isRectFree(top, left, roomleny, roomlenx):
+            self.stats.roomsRejected += 1
+            return False
+        # carve the room: walls all around, floor inside
+        self.fillRect(top, left, roomleny, roomlenx, TILE_WALL)
+        self.fillRect(top+1, left+1, roomleny-2, roomlenx-2, TILE_FLOOR)
+        inside = array('H', (min(self.objectsOnMap + 1, 0xffff),)) * (roomlenx-2)
+        for y in range(top+1, top+roomleny-1):
+            start = y * self.xsize + left + 1
+            self.roomMask[start:start + roomlenx-2] = inside
 
         # all done with building; add the room's ID and center coordinates to list
-        print("room built at y {0} x {1}".format(ypos, xpos))
+        self.stats.roomsBuilt += 1
         self.setTile(centery, centerx, 3)
         #                   ROOM ID              Y        X    CONNECTED?
         self.rooms.append([self.objectsOnMap, centery, centerx, False])
+        self.roomIndex.insert(self.objectsOnMap, centery, centerx)
         return True
 
     def generateCorridor(self, starty, startx, endy, endx):
-        """Create a corridor at coordinates ypos, xpos of given length, in given
-           direction."""
-
-        # if direction < NORTH or direction > WEST:
-        #     print("generateCorridor(): Invalid direction, skipping")
-        #     return False
-        # if ypos < 0 or ypos > self.ysize or xpos < 0 or xpos > self.xsize:
-        #     print("generateCorridor(): Invalid ypos or xpos arguments, skipping")
-        #     return False
-        # width = 3
-        # length = random.randrange(2, length+1)
-
-        # for y in range(starty, endy+1):
-        #     for x in range(startx, endx+1):
-        #         # if self.getTile(y+1, x) == TILE_WALL or self.getTile(y-1, x) == TILE_WALL \
-        #         #  or self.getTile(y, x+1) == TILE_WALL or self.getTile(y, x-1) == TILE_WALL:
-        #         #     self.setTile(y, x, TILE_DOORCLOSED)
-        #         # else:
-        #         if y < endy:
-        #             self.setTile(y, startx, TILE_FLOOR)
-        #         elif x < endx:
-        #             self.setTile(starty, x, TILE_FLOOR)
-        #         elif y == endy:
-        #             self.setTile(endy, x, TILE_FLOOR)
-        #         elif x == endx:
-        #             self.setTile(y, endx, TILE_FLOOR)
-                # if y == starty or y == endy:
-                #     self.setTile(y, x, TILE_DOORCLOSED)
-                # elif x == startx or x == endx:
-                #     self.setTile(y, x, TILE_DOORCLOSED)
-                # else:
-                #     self.setTile(y, x, TILE_CORRIDOR)
-
-        # if direction == NORTH:
-        #     if not self.scanDirection(ypos, xpos, direction, length, width):
-        #         return False
-        #     if ypos - length <= 0:
-        #         return False
-        #     for y in range(length):
-        #         if y == length-1:
-        #             self.setTile(ypos-y, xpos, TILE_DOORCLOSED)
-        #         else:
-        #             self.setTile(ypos-y, xpos, TILE_CORRIDOR)
-        # if direction == EAST:
-        #     if not self.scanDirection(ypos, xpos, direction, width, length):
-        #         return False
-        #     if xpos + length >= self.xsize:
-        #         return False
-        #     for x in range(length):
-        #         if x == length-1:
-        #             self.setTile(ypos, xpos+x, TILE_DOORCLOSED)
-        #         else:
-        #             self.setTile(ypos, xpos+x, TILE_CORRIDOR)
-        # if direction == SOUTH:
-        #     if not self.scanDirection(ypos, xpos, direction, length, width):
-        #         return False
-        #     if ypos + length >= self.ysize:
-        #         return False
-        #     for y in range(length):
-        #         if y == length-1:
-        #             self.setTile(ypos+y, xpos, TILE_DOORCLOSED)
-        #         else:
-        #             self.setTile(ypos+y, xpos, TILE_CORRIDOR)
-        # if direction == WEST:
-        #     if not self.scanDirection(ypos, xpos, direction, width, length):
-        #         return False
-        #     if xpos - length <= 0:
-        #         return False
-        #     for x in range(length):
-        #         if x == length-1:
-        #             self.setTile(ypos, xpos-x, TILE_DOORCLOSED)
-        #         else:
-        #             self.setTile(ypos, xpos-x, TILE_CORRIDOR)
-
-            # ypos = ypos - (length // 2)
-            # for y in range(width):
-            #     for x in range(length):
-            #         if y == 0 or y == (length - 1):
-            #             self.setTile(ypos+y, xpos-x, TILE_WALL)
-            #         if (xpos - x) == (xpos - width):
-            #             self.setTile(ypos+y, xpos-x, TILE_WALL)
-            #         else:
-            #             self.setTile(ypos+y, xpos-x, TILE_CORRIDOR)
+        """Carves a corridor from (starty, startx) to (endy, endx), following
+           the cheapest path found with A*. Existing floor and empty space are
+           cheap, cutting through a room wall costs more (the wall becomes an
+           open door) and crossing the interior of any room other than the ones
+           the corridor starts and ends in costs the most, so corridors go
+           around rooms instead of through them. The search stays within
+           CORRIDOR_MARGIN tiles of the box spanned by both points and falls
+           back to the whole map if that isn't enough. Returns True if the
+           corridor was built."""
+
+        if self.getTile(starty, startx) == -1 or self.getTile(endy, endx) == -1:
+            print("generateCorridor(): Invalid start or end coordinates, skipping")
+            return False
+        top = min(starty, endy) - CORRIDOR_MARGIN
+        left = min(startx, endx) - CORRIDOR_MARGIN
+        bottom = max(starty, endy) + CORRIDOR_MARGIN
+        right = max(startx, endx) + CORRIDOR_MARGIN
+        path = self._findCorridorPath(starty, startx, endy, endx,
+                                      top, left, bottom, right)
+        if path is None:
+            path = self._findCorridorPath(starty, startx, endy, endx,
+                                          0, 0, self.ysize, self.xsize)
+        if path is None:
+            return False
+        arr = self.levelArr
+        for i in path:
+            if arr[i] == TILE_UNUSED:
+                self.setTile(i // self.xsize, i % self.xsize, TILE_CORRIDOR)
+            elif arr[i] == TILE_WALL:
+                self.setTile(i // self.xsize, i % self.xsize, TILE_DOOROPEN)
         return True
 
+    def _findCorridorPath(self, starty, startx, endy, endx, top, left, bottom, right):
+        """A* search for generateCorridor() limited to rows top..bottom and
+           columns left..right (the outer map border is never used). Returns
+           the path as a list of levelArr indices or None."""
+
+        top, left = max(top, 1), max(left, 1)
+        bottom, right = min(bottom, self.ysize - 2), min(right, self.xsize - 2)
+        xsize = self.xsize
+        arr = self.levelArr
+        mask = self.roomMask
+        start = starty * xsize + startx
+        goal = endy * xsize + endx
+        cost = {start: 0}
+        came = {start: None}
+        startroom, goalroom = mask[start], mask[goal]
+        # the distance left is weighted a bit above the price of digging
+        # through empty space; that's an overestimate, so the path isn't
+        # always the cheapest one, but the search heads straight for the goal
+        # instead of flooding the window around every corridor it meets (ties
+        # go to the cell furthest along, hence the negated cost in the heap)
+        weight = CORRIDOR_COSTS[TILE_UNUSED] + 1
+        heap = [(weight * (abs(starty - endy) + abs(startx - endx)), 0, start)]
+        while heap:
+            estimate, spent, i = heapq.heappop(heap)
+            spent = -spent
+            if i == goal:
+                path = []
+                while i is not None:
+                    path.append(i)
+                    i = came[i]
+                return path
+            if spent > cost[i]:
+                continue
+            y, x = divmod(i, xsize)
+            for ny, nx in ((y-1, x), (y, x+1), (y+1, x), (y, x-1)):
+                if ny < top or ny > bottom or nx < left or nx > right:
+                    continue
+                n = ny * xsize + nx
+                owner = mask[n]
+                if owner and owner != startroom and owner != goalroom:
+                    step = CORRIDOR_COST_ROOM
+                else:
+                    step = CORRIDOR_COSTS[arr[n]]
+                newcost = spent + step
+                if newcost < cost.get(n, newcost + 1):
+                    cost[n] = newcost
+                    came[n] = i
+                    estimate = newcost + weight * (abs(ny - endy) + abs(nx - endx))
+                    heapq.heappush(heap, (estimate, -newcost, n))
+        return None
+
+    def connectRooms(self):
+        """Links all rooms with corridors. Candidate links only join rooms
+           that are close to each other (a few nearest ones per room, plus
+           neighbours in x and y order), a minimum spanning tree of those
+           links makes sure every room can be reached and some of the
+           left-over links (loopProb percent) are added too, so the level has
+           a few loops. Sets the connected flag of every room that got
+           linked."""
+
+        count = len(self.rooms)
+        if count < 2:
+            for room in self.rooms:
+                room[3] = True
+            return
+        # candidate edges: each room's nearest rooms, plus neighbours in
+        # sorted-by-x and sorted-by-y order; the graph stays sparse (O(n)
+        # edges) and the sorted-order links make sure it's connected
+        edges = set()
+        nearby = []
+        for room in self.rooms:
+            a = room[0]
+            for b in self.roomIndex.nearest(room[1], room[2], CORRIDOR_NEIGHBORS,
+                                            nearby, exclude=a):
+                edges.add((min(a, b), max(a, b)))
+        for axis in (2, 1):
+            order = sorted(range(count), key=lambda r: self.rooms[r][axis])
+            for pos, a in enumerate(order):
+                for b in order[pos+1:pos+1+CORRIDOR_NEIGHBORS]:
+                    edges.add((min(a, b), max(a, b)))
+        weighted = []
+        for a, b in edges:
+            dy = self.rooms[a][1] - self.rooms[b][1]
+            dx = self.rooms[a][2] - self.rooms[b][2]
+            weighted.append((dy * dy + dx * dx, a, b))
+        weighted.sort()
+
+        # Kruskal's algorithm with a union-find over room indices
+        parent = list(range(count))
+        def find(r):
+            while parent[r] != r:
+                parent[r] = parent[parent[r]]
+                r = parent[r]
+            return r
+        links = []
+        for dist, a, b in weighted:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[ra] = rb
+                links.append((a, b))
+            elif self.random.randint(1, 100) <= self.loopProb:
+                links.append((a, b))
+
+        for a, b in links:
+            first, second = self.rooms[a], self.rooms[b]
+            if self.generateCorridor(first[1], first[2], second[1], second[2]):
+                first[3] = True
+                second[3] = True
+                self.stats.corridorsBuilt += 1
+            else:
+                self.stats.corridorsFailed += 1
+
     def generateLevel(self):
         """Actual algorithm is in this function. First it generates a single
         room in center of the map (more or less), and then it enters the loop
-        state, where it randomly searches for a wall tile, checks from what
-        side it can be accessed and finally constructs either a room or
-        a corridor."""
+        state, where it draws random anchors from a pool of candidate cells
+        and tries to build a room at each one that has free space around it.
+        Returns True if all maxObjects rooms were placed, False if the map
+        filled up first (self.isFull is set in that case)."""
 
+        started = time.perf_counter()
         self.objectsOnMap = 0
         assert self.generateRoom(self.ysize // 2, self.xsize // 2, 8, 8, \
-                                random.randint(0, 3)), "generateLevel(): \
+                                self.random.randint(0, 3)), "generateLevel(): \
 Error while generating first room"
         self.rooms[0][3] = True # set the first room's connected flag to True for algorithms
         self.objectsOnMap += 1
         # Actual body of the creation algorithm
-        isValidTile = -1
         # First, generate only rooms and mark them all unconnected
         # (False flag in self.rooms list)
         # Rooms are added to the list in generateRoom() method
-        while self.objectsOnMap != self.maxObjects:
-            while isValidTile == -1:
-                # if self.objectsOnMap == self.maxObjects:
-                #     isFull = 1
-                #     break
-                newx, newy = 0, 0
-                # xmod, ymod = 0, 0
-
-                random.seed()
-                newx = random.randrange(self.xsize)
-                newy = random.randrange(self.ysize)
-                isValidTile = -1
-                print("newx = {0}, newy = {1}, searching for suitable place".format(newx, newy))
-                if self.getTile(newy, newx) == TILE_UNUSED:
-                    for y in range(-3, 4):
-                        for x in range(-3, 4):
-                            if self.getTile(newy+y, newx+x) == TILE_WALL or \
-                               self.getTile(newy+y, newx+x) == TILE_FLOOR:
-                                isValidTile = -1
-                                break
-                            else:
-                                isValidTile = random.randint(NORTH, WEST)
-                                break
-                # if self.getTile(newy, newx) == TILE_WALL or self.getTile(newy, newx) == TILE_CORRIDOR:
-                #     # check which way we are (should be) facing
-                #     # north?
-                #     #print("found a wall at x = {0} y = {1}".format(newx, newy))
-                #     if self.getTile(newy+1, newx) == TILE_FLOOR or self.getTile(newy+1, newx) == TILE_CORRIDOR:
-                #         # value of isValidTile also sets the direction for room and
-                #         # corridor generators
-                #         isValidTile = NORTH
-                #         xmod = 0
-                #         ymod = -1
-                #     # east?
-                #     elif self.getTile(newy, newx-1) == TILE_FLOOR or self.getTile(newy, newx-1) == TILE_CORRIDOR:
-                #         isValidTile = EAST
-                #         xmod = 1
-                #         ymod = 0
-                #     # south?
-                #     elif self.getTile(newy-1, newx) == TILE_FLOOR or self.getTile(newy-1, newx) == TILE_CORRIDOR:
-                #         isValidTile = SOUTH
-                #         xmod = 0
-                #         ymod = 1
-                #     # west?
-                #     elif self.getTile(newy, newx+1) == TILE_FLOOR or self.getTile(newy, newx+1) == TILE_CORRIDOR:
-                #         isValidTile = WEST
-                #         xmod = -1
-                #         ymod = 0
-
-                #     # check if any door neighbors with chosen tile
-                #     if isValidTile > -1:
-                #         if self.getTile(newy+1, newx) == TILE_DOORCLOSED:
-                #             isValidTile = -1
-                #         elif self.getTile(newy, newx+1) == TILE_DOORCLOSED:
-                #             isValidTile = -1
-                #         elif self.getTile(newy-1, newx) == TILE_DOORCLOSED:
-                #             isValidTile = -1
-                #         elif self.getTile(newy, newx-1) == TILE_DOORCLOSED:
-                #             isValidTile = -1
-
-                    # if isValidTile > -1:
-                    #     break
-
-            if isValidTile > -1:
-                # objectToBuild = random.randint(0, 100)
-                print("trying to build a room at y {0}, x {1}".format(newy, newx))
-                if self.generateRoom(newy, newx, 11, 12, isValidTile):
+        # Every cell of the map is a candidate anchor for a new room and each
+        # one is drawn (at random) at most once. Occupied space only grows
+        # while rooms are placed, so an anchor that can't fit even the
+        # smallest room now never will; once the pool runs dry the map is full
+        # and we stop.
+        candidates = CandidatePool(self.ysize * self.xsize)
+        self.isFull = False
+        # counted in locals, this loop can run for every cell of the map
+        probes = rejected = 0
+        while self.objectsOnMap < self.maxObjects:
+            if not candidates:
+                self.isFull = True
+                break
+            newy, newx = divmod(candidates.pop(self.random), self.xsize)
+            probes += 1
+            # the anchor needs a free 7x7 neighbourhood, which is enough to
+            # fit the smallest (4x4) room in at least one direction
+            if not self.isRectFree(newy-3, newx-3, 7, 7):
+                rejected += 1
+                continue
+            direction = self.random.randint(NORTH, WEST)
+            # a random size may not fit where the smallest room would; try
+            # that before the anchor is dropped for good
+            for maxylen, maxxlen in ((11, 12), (4, 4)):
+                if any(self.generateRoom(newy, newx, maxylen, maxxlen,
+                                         (direction + turn) % 4)
+                       for turn in range(4)):
                     self.objectsOnMap += 1
-                isValidTile = -1
-
-                # if objectToBuild <= self.roomProb:
-                #     #print("building a room in direction {0}".format(isValidTile))
-                #     if self.generateRoom(newy+ymod, newx+xmod, 8, 8, isValidTile):
-                #         self.objectsOnMap += 1
-                #         self.setTile(newy, newx, TILE_DOORCLOSED)
-                #         self.setTile(newy+ymod, newx+xmod, TILE_FLOOR)
-                # elif objectToBuild >= self.roomProb:
-                #     #print("building a corridor in direction {0}".format(isValidTile))
-                #     if self.generateCorridor(newy+ymod, newx+xmod, 6, isValidTile):
-                #         self.objectsOnMap += 1
-                #         self.setTile(newy, newx, TILE_DOORCLOSED)
-        # Room quota is achieved; now it's time to add corridors between each
-        # room, and switch the connected flag to True
-        for room in self.rooms:
-            for secondroom in self.rooms:
-                # if room[3] == False:
-                    # if secondroom[3] == True:
-                self.generateCorridor(room[1], room[2], secondroom[1], secondroom[2])
-                room[3] = True
-            # if room[3] == False:
-            #     nearest = self.findNearestNeighbor(room[1], room[2])
-            #     if nearest > -1:
-            #         print("nearest neighbor for room {0} is {1}".format(room[0], nearest))
-            #         self.generateCorridor(room[1], room[2], self.rooms[nearest][1],
-            #                               self.rooms[nearest][2])
-            #         room[3] = True
+                    break
+        self.stats.probes += probes
+        self.stats.rejectedProbes += rejected
+        self.stats.full = self.isFull
+        self.stats.timings['placement'] = time.perf_counter() - started
+        # Room quota is achieved (or the map is full); now it's time to add
+        # corridors between the rooms, and switch the connected flag to True
+        started = time.perf_counter()
+        self.connectRooms()
+        self.stats.timings['connectivity'] = time.perf_counter() - started
+        return not self.isFull
 
 
     def findNearestNeighbor(self, y, x):
-        """Looks for room closest to given y, x coords using some simple math.
-           Returns matching room's ID (integer)."""
-
-        # potentialMatch stores ID of room that's (so far) nearest to given y,x
-        # potentialMatch = -1
-        distances = {}
-
-        for room in self.rooms:
-            # if room[3] == False:
-            dist = math.sqrt(((y - room[1])**2) + ((x - room[2])**2))
-            print("room[{0}]: {1} - {2}, {3} - {4} = {5}".format(room[0], y, room[1], x, room[2], int(dist)))
-            if int(dist) > 0:
-                distances[room[0]] = int(dist)
-            else:
-                distances[room[0]] = 100
-                # distances.append(int(dist))
-                # if abs(dist) < lastDist:
-                #     potentialMatch = room[0]
-                # lastDist = dist
-
-        # distances.remove(0)
-        shortest = min(distances.values())
-        for key, val in distances.items():
-            if val == shortest:
-                return key # returns ID of room
-        # if len(distances) > 0:
-        #     return distances.index(min(distances))
-        # else:
-        #     return
-
-        # if potentialMatch > -1:
-        #     return potentialMatch
-        # else:
-        #     print("Couldn't find nearest neighbor; skipping")
-        #     return -1
+        """Looks for room closest to given y, x coords (ignoring a room whose
+           center is exactly there, i.e. the one asking). Returns matching
+           room's ID (integer) or -1 if there is no other room."""
 
+        found = self.roomIndex.nearest(y, x, 2, self._nearestScratch)
+        for roomid in found:
+            if self.roomIndex.getPosition(roomid) != (y, x):
+                return roomid
+        return -1
 
     def getTile(self, y, x):
         """Returns tile ID at given [y][x]."""
 
-        if y >= 0 and y < self.ysize and x >= 0 and x < self.xsize:
-            return self.levelArr[y][x]
+        if 0 <= y < self.ysize and 0 <= x < self.xsize:
+            return self.levelArr[y * self.xsize + x]
         else:
             return -1
 
     def setTile(self, y, x, tileid):
         """Sets [y][x] coordinates to given tile ID."""
 
-        if y >= 0 and y < self.ysize and x >= 0 and x < self.xsize:
-            self.levelArr[y][x] = TILES[tileid][0]
+        if 0 <= y < self.ysize and 0 <= x < self.xsize:
+            i = y * self.xsize + x
+            old = self.levelArr[i]
+            # built (if lazy) from the tiles as they were, but only updated
+            # once the write went through (a level loaded read-only refuses
+            # it)
+            occupancy = self.occupancy
+            self.levelArr[i] = tileid
+            if old == TILE_UNUSED and tileid != TILE_UNUSED:
+                occupancy.add(y, x, 1)
+            elif old != TILE_UNUSED and tileid == TILE_UNUSED:
+                occupancy.add(y, x, -1)
+            if self.tileListeners and old != tileid:
+                self._tilesChanged(y, x, 1, 1)
         else:
             return -1
 
+    def addTileListener(self, callback):
+        """Registers callback(ypos, xpos, leny, lenx), called after tiles in
+           that rectangle were changed through setTile/setRect/fillRect."""
+
+        self.tileListeners.append(callback)
+
+    def removeTileListener(self, callback):
+        self.tileListeners.remove(callback)
+
+    def _tilesChanged(self, ypos, xpos, leny, lenx):
+        for callback in self.tileListeners:
+            callback(ypos, xpos, leny, lenx)
+
+    def snapshot(self):
+        """Returns a snapshot.Snapshot of the tiles. Rows that haven't changed
+           since the previous snapshot are shared with it, so taking one
+           after a few changes only copies the changed rows. snapshot.fork()
+           gives a changeable copy-on-write version for trying things out."""
+
+        if self.snapshots is None:
+            self.snapshots = SnapshotTracker(self)
+        return self.snapshots.take()
+
+    def restore(self, snapshot):
+        """Puts the tiles back the way they were in snapshot (a Snapshot of
+           this level, or of a Fork of one), rewriting only the rows that
+           differ."""
+
+        if self.snapshots is None:
+            self.snapshots = SnapshotTracker(self)
+        self.snapshots.restore(snapshot)
+
+    def diff(self, snapshot):
+        """Returns a list of (y, x, tile in snapshot, tile now) for every cell
+           changed since snapshot was taken."""
+
+        return snapshot.diff(self.snapshot())
+
+    def isRectFree(self, ypos, xpos, leny, lenx):
+        """Returns True if leny by lenx rectangle starting at (ypos, xpos) lies
+           inside the map and contains only TILE_UNUSED tiles."""
+
+        if ypos < 0 or xpos < 0 or leny <= 0 or lenx <= 0 or \
+           ypos + leny > self.ysize or xpos + lenx > self.xsize:
+            return False
+        return self.occupancy.count(ypos, xpos, leny, lenx) == 0
+
+    def clipRect(self, ypos, xpos, leny, lenx):
+        """Clips a rectangle with top-left corner at (ypos, xpos) to the map.
+           Returns (ypos, xpos, leny, lenx) of the part that is inside the
+           map, lengths are 0 if nothing is left."""
+
+        starty, startx = max(ypos, 0), max(xpos, 0)
+        endy = min(ypos + leny, self.ysize)
+        endx = min(xpos + lenx, self.xsize)
+        return (starty, startx, max(endy - starty, 0), max(endx - startx, 0))
+
+    def getRow(self, y):
+        """Returns row y as a read-only memoryview into the map (no copy is
+           made). Tiles must be changed through setTile/setRect/fillRect so the
+           occupancy index stays correct."""
+
+        view = memoryview(self.levelArr).toreadonly()
+        return view[y * self.xsize:(y+1) * self.xsize]
+
+    def getRect(self, ypos, xpos, leny, lenx):
+        """Returns a copy of leny by lenx rectangle starting at (ypos, xpos) as
+           a list of bytes objects, one per row. Parts of the rectangle outside
+           the map are cut off."""
+
+        ypos, xpos, leny, lenx = self.clipRect(ypos, xpos, leny, lenx)
+        arr = self.levelArr
+        rows = []
+        for y in range(ypos, ypos + leny):
+            start = y * self.xsize + xpos
+            rows.append(bytes(arr[start:start + lenx]))
+        return rows
+
+    def setRect(self, ypos, xpos, rows):
+        """Copies rows (sequence of bytes-like objects of equal length) into
+           the map with top-left corner at (ypos, xpos). Parts falling outside
+           the map are cut off."""
+
+        if not rows:
+            return
+        lenx = len(rows[0])
+        cy, cx, leny, clenx = self.clipRect(ypos, xpos, len(rows), lenx)
+        arr = self.levelArr
+        # built (if lazy) before any tile changes, updated after each write
+        occupancy = self.occupancy
+        for y in range(cy, cy + leny):
+            row = bytes(rows[y - ypos][cx - xpos:cx - xpos + clenx])
+            start = y * self.xsize + cx
+            old = arr[start:start + clenx]
+            arr[start:start + clenx] = row
+            if old != row:
+                for x, (was, now) in enumerate(zip(old, row), cx):
+                    if was == TILE_UNUSED and now != TILE_UNUSED:
+                        occupancy.add(y, x, 1)
+                    elif was != TILE_UNUSED and now == TILE_UNUSED:
+                        occupancy.add(y, x, -1)
+        if self.tileListeners and leny and clenx:
+            self._tilesChanged(cy, cx, leny, clenx)
+
+    def fillRect(self, ypos, xpos, leny, lenx, tileid):
+        """Fills leny by lenx rectangle starting at (ypos, xpos) with given
+           tile ID, one slice assignment per row."""
+
+        ypos, xpos, leny, lenx = self.clipRect(ypos, xpos, leny, lenx)
+        if leny == 0 or lenx == 0:
+            return
+        arr = self.levelArr
+        # counting builds a lazy index from the tiles as they were; the index
+        # itself only changes after each write went through
+        occupancy = self.occupancy
+        occupied = occupancy.count(ypos, xpos, leny, lenx)
+        mixed = occupied != 0 and occupied != leny * lenx
+        delta = 1 if tileid != TILE_UNUSED else -1
+        line = bytes((tileid,)) * lenx
+        for y in range(ypos, ypos + leny):
+            start = y * self.xsize + xpos
+            old = arr[start:start + lenx] if mixed else None
+            arr[start:start + lenx] = line
+            if mixed:
+                for x, val in enumerate(old, xpos):
+                    if (val == TILE_UNUSED) == (delta == 1):
+                        occupancy.add(y, x, delta)
+        # the common cases (filling an empty area or clearing a full one) are
+        # a single range update of the index
+        if tileid != TILE_UNUSED and occupied == 0:
+            occupancy.addRect(ypos, xpos, leny, lenx, 1)
+        elif tileid == TILE_UNUSED and occupied == leny * lenx:
+            occupancy.addRect(ypos, xpos, leny, lenx, -1)
+        if self.tileListeners:
+            self._tilesChanged(ypos, xpos, leny, lenx)
+
     def getDungeon(self):
-        return self.levelArr
+        """Returns the map as a list of rows. Each row is a read-only memoryview
+           into the level, so dungeon[y][x] reads the actual tiles."""
+
+        return [self.getRow(y) for y in range(self.ysize)]
 
     def getXDim(self):
         return self.xsize
@@ -434,30 +659,33 @@ Error while generating first room"
     def getYDim(self):
         return self.ysize
 
+    def getPassability(self):
+        """Returns a bitmap (one byte per cell, same layout as levelArr) with
+           1 for every passable tile and 0 for the rest."""
+
+        return bytearray(self.levelArr).translate(PASSABLE_TABLE)
+
+    def getGlyphs(self):
+        """Returns the map as glyph bytes (same layout as levelArr) with the
+           entity layers (self.layers) drawn over the terrain. The tiles
+           themselves are not touched."""
+
+        glyphs = bytearray(self.levelArr).translate(GLYPH_TABLE)
+        for layer in self.layers:
+            layer.stamp(glyphs, self.xsize)
+        return glyphs
+
     def drawLevel(self):
-        """Draws the generated dungeon in terminal."""
-
-        print(self.rooms)
-    #    os.system('clear')
-        for row in self.levelArr:
-            print('')
-            for val in row:
-                if val == TILE_UNUSED:
-                    print(TILES[TILE_UNUSED][1], end='')
-                elif val == TILE_FLOOR:
-                    print(TILES[TILE_FLOOR][1], end='')
-                elif val == TILE_WALL:
-                    print(TILES[TILE_WALL][1], end='')
-                elif val == TILE_UPSTAIRS:
-                    print(TILES[TILE_UPSTAIRS][1], end='')
-                elif val == TILE_DOWNSTAIRS:
-                    print(TILES[TILE_DOWNSTAIRS][1], end='')
-                elif val == TILE_DOORCLOSED:
-                    print(TILES[TILE_DOORCLOSED][1], end='')
-                elif val == TILE_DOOROPEN:
-                    print(TILES[TILE_DOOROPEN][1], end='')
-                elif val == 7:
-                    print(TILES[7][1], end='')
+        """Draws the generated dungeon in terminal, all of it in one write.
+           For redrawing a level that changes over time use render.Renderer,
+           which only sends the cells that changed."""
+
+        glyphs = self.getGlyphs()
+        xsize = self.xsize
+        lines = [glyphs[y * xsize:(y+1) * xsize].decode('ascii')
+                 for y in range(self.ysize)]
+        sys.stdout.write('\n' + '\n'.join(lines))
+        sys.stdout.flush()
 
     def scanDirection(self, ypos, xpos, direction, leny, lenx):
         """Scans the level in direction originating from (y, x) coordinates for
@@ -465,38 +693,16 @@ Error while generating first room"
            otherwise."""
 
         if direction == 0:
-            xpos = xpos - (lenx // 2)
-            for y in range(leny):
-                for x in range(lenx):
-                    if self.getTile(ypos-y, xpos+x) != TILE_UNUSED:
-                        #print("Scan failed")
-                        return False
+            return self.isRectFree(ypos - leny + 1, xpos - (lenx // 2), leny, lenx)
         elif direction == 1:
-            ypos = ypos - (leny // 2)
-            for y in range(leny):
-                for x in range(lenx):
-                    if self.getTile(ypos+y, xpos+x) != TILE_UNUSED:
-                        #rint("Scan failed")
-                        return False
+            return self.isRectFree(ypos - (leny // 2), xpos, leny, lenx)
         elif direction == 2:
-            xpos = xpos - (lenx // 2)
-            for y in range(leny):
-                for x in range(lenx):
-                    if self.getTile(ypos+y, xpos+x) != TILE_UNUSED:
-                        #print("Scan failed")
-                        return False
+            return self.isRectFree(ypos, xpos - (lenx // 2), leny, lenx)
         elif direction == 3:
-            ypos = ypos - (leny // 2)
-            for y in range(leny):
-                for x in range(lenx):
-                    if self.getTile(ypos+y, xpos-x) != TILE_UNUSED:
-                        #print("Scan failed")
-                        return False
+            return self.isRectFree(ypos - (leny // 2), xpos - lenx + 1, leny, lenx)
         else:
             print("scanDirection(): Invalid direction value. Skipping...")
             return False
-        #print("Scan succeeded")
-        return True
 
 
 if __name__ == "__main__":
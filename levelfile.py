@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Binary level files. A file holds one generated Level: a fixed header
+   (dimensions, seed, flags, tile block offset), the room table and then the
+   raw tiles, ysize * xsize bytes exactly like Level.levelArr, starting on
+   a BLOCK_ALIGN boundary so the block can be mapped on its own.
+
+   Numbers are little-endian. loadLevel() maps the tiles into memory and
+   builds the Level right on top of them, so nothing is copied: loading
+   costs the same for any map size, and processes loading the same file
+   share its pages. The occupancy index and room mask aren't stored, the
+   level works them out from the tiles when it first needs them (see
+   Level._setUp())."""
+import io
+import mmap
+import os
+import random
+import struct
+from level import Level
+from metrics import GenerationStats
+
+MAGIC = b'PYRL'
+VERSION = 2
+# magic, version, flags, ysize, xsize, seed, room count and the offset of the
+# tile block
+HEADER = struct.Struct('<4sHHIIqIQ')
+# room ID, center y, center x, connected flag
+ROOM = struct.Struct('<IIIB3x')
+BLOCK_ALIGN = 4096
+
+# header flags
+FLAG_FULL = 1
+
+# how loadLevel() maps the file: 'read' makes the level read-only, 'copy'
+# lets it be changed in memory without touching the file (pages are only
+# copied once written to), 'write' writes changes back to the file
+ACCESS_MODES = {'read': mmap.ACCESS_READ,
+                'copy': mmap.ACCESS_COPY,
+                'write': mmap.ACCESS_WRITE}
+
+class LevelFileError(Exception):
+    pass
+
+def _align(offset):
+    return (offset + BLOCK_ALIGN - 1) // BLOCK_ALIGN * BLOCK_ALIGN
+
+def dumpLevel(level):
+    """Returns level in the file format, as bytes."""
+
+    tilesAt = _align(HEADER.size + ROOM.size * len(level.rooms))
+    flags = FLAG_FULL if level.isFull else 0
+    out = bytearray(HEADER.pack(MAGIC, VERSION, flags, level.getYDim(),
+                                level.getXDim(), level.seed, len(level.rooms),
+                                tilesAt))
+    for roomid, y, x, connected in level.rooms:
+        out += ROOM.pack(roomid, y, x, bool(connected))
+    out += bytes(tilesAt - len(out))
+    out += level.levelArr
+    return bytes(out)
+
+def saveLevel(level, path):
+    """Writes level to path (replacing the file only once it is complete)."""
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(dumpLevel(level))
+    os.replace(path + '.tmp', path)
+
+def readHeader(f):
+    """Reads and checks the header and room table of an open level file.
+       Returns (header fields as a dict, list of rooms)."""
+
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise LevelFileError("file too short for a level header")
+    magic, version, flags, ysize, xsize, seed, roomcount, tilesAt = \
+        HEADER.unpack(data)
+    if magic != MAGIC:
+        raise LevelFileError("not a level file")
+    if version != VERSION:
+        raise LevelFileError("unsupported level file version {0}".format(version))
+    rooms = []
+    for i in range(roomcount):
+        roomid, y, x, connected = ROOM.unpack(f.read(ROOM.size))
+        rooms.append([roomid, y, x, bool(connected)])
+    header = {'version': version, 'flags': flags, 'ysize': ysize,
+              'xsize': xsize, 'seed': seed, 'tilesAt': tilesAt}
+    return header, rooms
+
+def _mapBlock(f, offset, length, access):
+    if offset % mmap.ALLOCATIONGRANULARITY:
+        raise LevelFileError("block at {0} can't be mapped on this "
+                             "platform".format(offset))
+    try:
+        return mmap.mmap(f.fileno(), length, access=access, offset=offset)
+    except ValueError:
+        raise LevelFileError("level file is truncated")
+
+def loadLevel(path, mode='copy'):
+    """Returns the Level stored in path, mapped into memory rather than read.
+       mode is one of ACCESS_MODES. The level's levelArr is an mmap object."""
+
+    if mode not in ACCESS_MODES:
+        raise ValueError("mode must be one of {0}".format(sorted(ACCESS_MODES)))
+    access = ACCESS_MODES[mode]
+    with open(path, 'rb' if mode != 'write' else 'r+b') as f:
+        header, rooms = readHeader(f)
+        tiles = _mapBlock(f, header['tilesAt'], header['ysize'] * header['xsize'],
+                          access)
+    return _buildLevel(header, rooms, tiles)
+
+def readLevel(data):
+    """Returns the Level held in data (bytes in the file format, e.g. from
+       dumpLevel()). Unlike loadLevel() the level gets its own copy of the
+       tiles, so data can be thrown away afterwards."""
+
+    header, rooms = readHeader(io.BytesIO(data))
+    tilesAt = header['tilesAt']
+    tilesEnd = tilesAt + header['ysize'] * header['xsize']
+    if len(data) < tilesEnd:
+        raise LevelFileError("level data is truncated")
+    return _buildLevel(header, rooms, bytearray(data[tilesAt:tilesEnd]))
+
+def _buildLevel(header, rooms, tiles):
+    """Puts a Level together around an existing tile buffer, without
+       generating anything."""
+
+    ysize, xsize = header['ysize'], header['xsize']
+    level = Level.__new__(Level)
+    level.ysize = ysize
+    level.xsize = xsize
+    level.seed = header['seed']
+    level.random = random.Random(level.seed)
+    level.stats = GenerationStats(level.seed, ysize, xsize)
+    level.maxObjects = len(rooms)
+    level.roomProb = 70
+    level.loopProb = 15
+    level._setUp(tiles, lazy=True)
+    level.rooms = rooms
+    for roomid, y, x, connected in rooms:
+        level.roomIndex.insert(roomid, y, x)
+    level.isFull = bool(header['flags'] & FLAG_FULL)
+    level.stats.full = level.isFull
+    level.stats.roomsBuilt = len(rooms)
+    return level
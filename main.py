@@ -1,70 +1,299 @@
 #!/usr/bin/env python
+import io
 import sys
-import tty
-import termios
+import time
+import random
+import argparse
+import zlib
 from level import *
 from actor import *
+from render import Renderer, NullRenderer
+from terminal import Terminal, ESCAPE_KEYS
+from scheduler import Scheduler, getDelay
+from dungeon import Dungeon
+from fov import FieldOfView
+from levelfile import dumpLevel, readLevel
 
-def _getch():
-    """Hack to get keyboard input in real-time.
-       Thanks to: http://code.activestate.com/recipes/134892/
-       WARNING: Disables CTRL-D and CTRL-C combos in terminal, so there must
-       be an event handler that closes the program, otherwise it will run
-       infinitely until terminated forcefully."""
-
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    try:
-        tty.setraw(sys.stdin.fileno())
-        ch = sys.stdin.read(1)
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return ch
+# key -> direction passed to Actor.move()
+MOVE_KEYS = {'w': NORTH, 'd': EAST, 's': SOUTH, 'a': WEST,
+             'UP': NORTH, 'RIGHT': EAST, 'DOWN': SOUTH, 'LEFT': WEST}
 
-class Game:
+# key -> True to take the stairs down, False for up
+STAIR_KEYS = {'>': True, '<': False}
 
+# names written as <NAME> in key scripts; any other '<' is the key itself
+SCRIPT_NAMES = frozenset(ESCAPE_KEYS.values())
 
-    def __init__(self):
-        os.system('setterm -cursor off')
+class Game:
+    """One game session, split so it can be driven by anything: __init__()
+       sets it up (around a given level or floors, drawing with a given
+       renderer), handleKey() plays one turn for one key, run() reads keys
+       from the terminal and runHeadless() takes them from any iterable.
+       Movement keys are looked up in MOVE_KEYS and the stairs in
+       STAIR_KEYS."""
 
-        self.dungeon = Level(80, 20)
-        for y in range(self.dungeon.getYDim()):
-            for x in range(self.dungeon.getXDim()):
-                if self.dungeon.getTile(y, x) == TILE_FLOOR:
-                    playerY = y
-                    playerX = x
-                    continue
+
+    def __init__(self, dungeon=None, renderer=None, floors=None):
+        # floors is a dungeon.Dungeon for a game with more than one level
+        self.floors = floors
+        if floors is not None:
+            dungeon = floors.current
+        elif dungeon is None:
+            dungeon = Level(80, 20)
+        self.dungeon = dungeon
+        # start on the last floor tile of the map
+        start = self.dungeon.levelArr.rfind(bytes((TILE_FLOOR,)))
+        playerY, playerX = divmod(start, self.dungeon.getXDim())
 
         self.player = Actor(playerY, playerX, '@')
-        self.dungeon.setTile(playerY, playerX, 7)
-        self.dungeon.drawLevel()
+        self.dungeon.entities.add(self.player)
+        if renderer is None:
+            renderer = Renderer()
+        self.renderer = renderer
+        # what the player sees and remembers; the renderer only shows that
+        self.fov = FieldOfView(self.dungeon)
+        self.fov.update(playerY, playerX)
+        self.renderer.fov = self.fov
+        # everybody but the player; the player acts on key presses and each of
+        # its actions lets the clock run on for as long as the action took
+        self.scheduler = Scheduler()
+        # a recording.Recorder logging the keys, if the session is recorded
+        self.recorder = None
 
-        while True:
-            print('')
-            keypress = _getch()
-            if keypress == 'Q':
-                break
-            elif keypress == 'w':
-                self.player.move(0)
-            elif keypress == 'd':
-                self.player.move(1)
-            elif keypress == 's':
-                self.player.move(2)
-            elif keypress == 'd':
-                self.player.move(3)
-            else:
+    def addActor(self, actor, delay=0):
+        """Puts a (non-player) actor on the map and in the turn order."""
+
+        self.dungeon.entities.add(actor)
+        self.scheduler.add(actor, delay)
+
+    def actorTurn(self, actor):
+        """Scheduler callback: carries out actor's pending move. Returns time
+           until its next turn."""
+
+        oldpos = actor.getCurrentYX()
+        actor.update()
+        if actor.getCurrentYX() != oldpos:
+            self.dungeon.entities.moved(actor, oldpos[0], oldpos[1])
+        return getDelay(actor)
+
+    def takeStairs(self, down):
+        """Moves the player one floor down (or up) if it stands on the right
+           staircase. Returns True if the floor changed."""
+
+        wanted = TILE_DOWNSTAIRS if down else TILE_UPSTAIRS
+        if self.floors is None:
+            return False
+        if self.dungeon.getTile(self.player.y, self.player.x) != wanted:
+            return False
+        if not down and self.floors.depth == 0:
+            return False
+        self.dungeon.entities.remove(self.player)
+        self.dungeon = self.floors.descend() if down else self.floors.ascend()
+        arrival = self.floors.getArrival(down)
+        if arrival is None:
+            start = self.dungeon.levelArr.rfind(bytes((TILE_FLOOR,)))
+            arrival = divmod(start, self.dungeon.getXDim())
+        self.player.setPosition(*arrival)
+        self.dungeon.entities.add(self.player)
+        self.fov.close()
+        self.fov = FieldOfView(self.dungeon)
+        self.renderer.fov = self.fov
+        # the actors of the old floor stay behind
+        self.scheduler = Scheduler()
+        self.renderer.invalidate()
+        return True
+
+    def getState(self):
+        """Returns everything needed to carry on the game from here (see
+           setState()): the floor(s), where the player is, what it has
+           seen and the clock. Actors other than the player aren't kept."""
+
+        if self.floors is not None:
+            floors = self.floors.getState()
+        else:
+            floors = {'depth': 0,
+                      'current': zlib.compress(dumpLevel(self.dungeon)),
+                      'floors': []}
+        return {'floors': floors,
+                'player': self.player.getCurrentYX(),
+                'explored': zlib.compress(self.fov.explored),
+                'remembered': zlib.compress(self.fov.remembered),
+                'time': self.scheduler.time}
+
+    def setState(self, state):
+        """Puts the game back into a state returned by getState()."""
+
+        if self.floors is not None:
+            self.dungeon = self.floors.setState(state['floors'])
+        else:
+            self.dungeon = readLevel(zlib.decompress(state['floors']['current']))
+        self.player.setPosition(*state['player'])
+        self.dungeon.entities.add(self.player)
+        self.fov.close()
+        self.fov = FieldOfView(self.dungeon)
+        self.fov.explored[:] = zlib.decompress(state['explored'])
+        self.fov.remembered[:] = zlib.decompress(state['remembered'])
+        self.fov.update(self.player.y, self.player.x)
+        self.renderer.fov = self.fov
+        self.scheduler = Scheduler()
+        self.scheduler.time = state['time']
+        self.renderer.invalidate()
+
+    def handleKey(self, keypress, draw=True):
+        """Runs one turn for a key press and redraws (unless draw is False).
+           Returns False if the key quits the game."""
+
+        if self.recorder is not None:
+            self.recorder.record(keypress)
+        if keypress == 'Q':
+            return False
+        if keypress in STAIR_KEYS:
+            self.takeStairs(STAIR_KEYS[keypress])
+        elif keypress in MOVE_KEYS:
+            direction = MOVE_KEYS[keypress]
+            dy, dx = DIRECTION_DELTAS[direction]
+            # walls, closed doors and the edge of the map stop the player
+            tile = self.dungeon.getTile(self.player.y + dy, self.player.x + dx)
+            if tile != -1 and PASSABLE_TABLE[tile]:
+                self.player.move(direction)
+
+        oldpos = self.player.getCurrentYX()
+        self.player.update()
+        self.dungeon.entities.moved(self.player, oldpos[0], oldpos[1])
+        # everyone due before the player's next turn acts now
+        self.scheduler.runFor(getDelay(self.player), self.actorTurn)
+        self.fov.update(self.player.y, self.player.x)
+        if self.recorder is not None:
+            self.recorder.turnDone(self)
+        if draw:
+            self.renderer.draw(self.dungeon)
+        return True
+
+    def handleKeys(self, keys):
+        """Runs a turn for every key in keys, then draws one frame. Returns
+           False if one of the keys quits the game (the keys after it are
+           dropped)."""
+
+        for keypress in keys:
+            if not self.handleKey(keypress, draw=False):
+                return False
+        self.renderer.draw(self.dungeon)
+        return True
+
+    def run(self):
+        """Main loop, reads keys from the terminal until 'Q' is pressed. Keys
+           that queue up while a frame is drawn are all handled before the
+           next frame, so holding a key down doesn't make the game fall
+           behind."""
+
+        with Terminal() as term:
+            self.renderer.draw(self.dungeon)
+            while self.handleKeys(term.readKeys()):
                 pass
-            
-            oldpos = self.player.getCurrentYX()
-            self.player.update()
-            move = self.player.getCurrentYX()
-            self.dungeon.setTile(move[0], move[1], 7)
-            self.dungeon.setTile(oldpos[0], oldpos[1], TILE_FLOOR)
-            self.dungeon.drawLevel()
-
-        os.system('setterm -cursor on')
-        sys.exit()
+
+    def runHeadless(self, keys, drawEvery=0):
+        """Runs the game without a terminal, as fast as it goes, taking keys
+           from any iterable (a list, readScript(), a bot's generator...)
+           until it runs out or a key quits. The game's renderer is used
+           every drawEvery ticks (0 never draws; give the Game a NullRenderer
+           or a Renderer writing to a buffer to skip or capture output).
+           Returns a dict with the number of ticks, seconds taken and ticks
+           per second."""
+
+        ticks = 0
+        started = time.perf_counter()
+        for keypress in keys:
+            draw = drawEvery > 0 and (ticks + 1) % drawEvery == 0
+            if not self.handleKey(keypress, draw):
+                break
+            ticks += 1
+        seconds = time.perf_counter() - started
+        return {'ticks': ticks,
+                'seconds': seconds,
+                'ticksPerSecond': ticks / seconds if seconds > 0 else 0.0}
+
+
+def readScript(script):
+    """Yields keys from a script for Game.runHeadless(), script being a path
+       or an open text file (sys.stdin...): every character is a key press,
+       whitespace is skipped, lines starting with '#' are comments and arrow
+       keys are written as <UP>, <DOWN>, <LEFT>, <RIGHT> (a '<' not starting
+       one of those is the stairs key as usual)."""
+
+    if isinstance(script, str):
+        with open(script) as f:
+            yield from readScript(f)
+        return
+    for line in script:
+        if line.startswith('#'):
+            continue
+        i = 0
+        while i < len(line):
+            if line[i] == '<':
+                end = line.find('>', i)
+                if end > i and line[i+1:end] in SCRIPT_NAMES:
+                    yield line[i+1:end]
+                    i = end + 1
+                    continue
+            if not line[i].isspace():
+                yield line[i]
+            i += 1
+
+def randomKeys(count, seed=None):
+    """Yields count random movement keys, a stand-in for a bot player."""
+
+    rng = random.Random(seed)
+    for i in range(count):
+        yield rng.choice('wasd')
 
 
 if __name__ == '__main__':
-    g = Game()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="A roguelike in Python.")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="dungeon seed (random if not given)")
+    parser.add_argument('--headless', metavar='SCRIPT',
+                        help="run without a terminal, reading keys from SCRIPT "
+                             "('-' for stdin)")
+    parser.add_argument('--random', type=int, metavar='N', default=None,
+                        help="run headless with N random moves")
+    parser.add_argument('--draw-every', type=int, default=0, metavar='N',
+                        help="headless: render every N ticks into a buffer")
+    parser.add_argument('--record', metavar='FILE',
+                        help="record the session to FILE (see recording.py)")
+    args = parser.parse_args()
+
+    floors = Dungeon(args.seed)
+    recorder = None
+    if args.headless is None and args.random is None:
+        g = Game(renderer=Renderer(), floors=floors)
+        if args.record:
+            from recording import Recorder
+            recorder = Recorder(g)
+        try:
+            g.run()
+        finally:
+            floors.close()
+            if recorder is not None:
+                recorder.save(args.record)
+        sys.exit()
+
+    if args.random is not None:
+        keys = randomKeys(args.random, args.seed)
+    elif args.headless == '-':
+        keys = readScript(sys.stdin)
+    else:
+        keys = readScript(args.headless)
+    if args.draw_every:
+        renderer = Renderer(io.StringIO())
+    else:
+        renderer = NullRenderer()
+    g = Game(renderer=renderer, floors=floors)
+    if args.record:
+        from recording import Recorder
+        recorder = Recorder(g)
+    result = g.runHeadless(keys, args.draw_every)
+    floors.close()
+    if recorder is not None:
+        recorder.save(args.record)
+    print("{0} ticks in {1:.3f} s, {2:.0f} ticks/s".format(
+          result['ticks'], result['seconds'], result['ticksPerSecond']))
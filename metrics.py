@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# names of the generation phases, in the order they run
+PHASES = ('init', 'placement', 'connectivity')
+
+class GenerationStats:
+    """What happened while generating one Level: how many anchors were probed
+       and rejected, how many rooms and corridors were built, and how long
+       each phase took (in seconds). Every Level fills one in as it is
+       generated (level.stats); counting is a few integer additions, so it is
+       always on.
+
+       To collect stats from many levels pass a callback as the metrics
+       argument of Level; it is called with the finished GenerationStats."""
+
+
+    def __init__(self, seed, ysize, xsize):
+        self.seed = seed
+        self.ysize = ysize
+        self.xsize = xsize
+        # anchors drawn from the candidate pool
+        self.probes = 0
+        # anchors thrown away because their neighbourhood wasn't free
+        self.rejectedProbes = 0
+        # generateRoom() calls, and how many of them built nothing
+        self.roomAttempts = 0
+        self.roomsRejected = 0
+        self.roomsBuilt = 0
+        self.corridorsBuilt = 0
+        self.corridorsFailed = 0
+        # True if the map filled up before all rooms were placed
+        self.full = False
+        # phase name -> seconds
+        self.timings = dict.fromkeys(PHASES, 0.0)
+
+    def getTotalTime(self):
+        return sum(self.timings.values())
+
+    def asDict(self):
+        """Returns the stats as a plain dict (e.g. for json.dumps())."""
+
+        result = dict(self.__dict__)
+        result['timings'] = dict(self.timings)
+        return result
+
+    def __repr__(self):
+        return "GenerationStats({0})".format(self.asDict())
+
+class StatsCollector:
+    """Metrics sink that keeps totals over many generated levels, plus the
+       slowest levels seen so far. An instance can be passed straight to Level
+       as its metrics callback."""
+
+
+    def __init__(self, keepSlowest=10):
+        self.levels = 0
+        self.totals = {}
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.keepSlowest = keepSlowest
+        # (total time, seed) of the slowest levels, slowest first
+        self.slowest = []
+
+    def __call__(self, stats):
+        self.levels += 1
+        for name, value in stats.__dict__.items():
+            if isinstance(value, int) and not isinstance(value, bool) and \
+               name not in ('seed', 'ysize', 'xsize'):
+                self.totals[name] = self.totals.get(name, 0) + value
+        for phase, seconds in stats.timings.items():
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.slowest.append((stats.getTotalTime(), stats.seed))
+        self.slowest.sort(reverse=True)
+        del self.slowest[self.keepSlowest:]
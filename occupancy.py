@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+from array import array
+from itertools import accumulate
+from operator import add, sub
+
+class OccupancyIndex:
+    """Counts occupied cells of a ysize by xsize grid using a 2D Fenwick
+       (binary indexed) tree, so the number of occupied cells inside any
+       rectangle can be read in O(log y * log x) time, no matter how big the
+       rectangle is. Like Level, everything here is in (y, x) order."""
+
+
+    def __init__(self, ysize, xsize, tree=None):
+        self.ysize = ysize
+        self.xsize = xsize
+        # tree is 1-based in both dimensions, row 0 and column 0 are unused;
+        # an existing tree (e.g. mapped from a level file) can be passed in
+        self.stride = xsize + 1
+        if tree is None:
+            tree = array('i', bytes(4 * (ysize + 1) * self.stride))
+        self.tree = tree
+
+    @classmethod
+    def fromCells(cls, ysize, xsize, cells):
+        """Returns an index counting the cells set in cells (one byte per cell,
+           row-major, 1 if occupied and 0 if not), built in one O(n) pass:
+           every row becomes a 1D Fenwick row from its prefix sums, and each
+           row is then added into the row that covers it, the same way a 1D
+           tree is built."""
+
+        starts = [j - (j & -j) for j in range(1, xsize + 1)]
+        rows = [None]
+        for y in range(ysize):
+            sums = list(accumulate(cells[y * xsize:(y + 1) * xsize], initial=0))
+            rows.append(array('i', map(sub, sums[1:], map(sums.__getitem__, starts))))
+        tree = array('i', bytes(4 * (xsize + 1)))
+        for i in range(1, ysize + 1):
+            parent = i + (i & -i)
+            if parent <= ysize:
+                rows[parent] = array('i', map(add, rows[parent], rows[i]))
+            tree.append(0)
+            tree.extend(rows[i])
+            rows[i] = None
+        return cls(ysize, xsize, tree)
+
+    def add(self, y, x, delta):
+        """Adds delta to the occupancy count of a single cell."""
+
+        tree = self.tree
+        stride = self.stride
+        i = y + 1
+        while i <= self.ysize:
+            j = x + 1
+            base = i * stride
+            while j <= self.xsize:
+                tree[base + j] += delta
+                j += j & -j
+            i += i & -i
+
+    def _nodes(self, start, length, size):
+        """Returns a list of (node, overlap) pairs: every Fenwick node touched
+           when each position in [start, start+length) is updated once, along
+           with how many of those positions the node covers."""
+
+        first, last = start + 1, start + length
+        nodes = []
+        seen = set()
+        for pos in range(first, last + 1):
+            node = pos
+            while node <= size and node not in seen:
+                seen.add(node)
+                low = node - (node & -node) + 1
+                nodes.append((node, min(node, last) - max(low, first) + 1))
+                node += node & -node
+        return nodes
+
+    def addRect(self, ypos, xpos, leny, lenx, delta):
+        """Adds delta to every cell of the rectangle. Costs
+           O((leny + log y) * (lenx + log x)) instead of one full point update
+           per cell."""
+
+        if leny <= 0 or lenx <= 0:
+            return
+        tree = self.tree
+        stride = self.stride
+        xnodes = self._nodes(xpos, lenx, self.xsize)
+        for ynode, ycount in self._nodes(ypos, leny, self.ysize):
+            base = ynode * stride
+            for xnode, xcount in xnodes:
+                tree[base + xnode] += delta * ycount * xcount
+
+    def _prefix(self, y, x):
+        """Returns number of occupied cells in rows [0, y) and columns [0, x)."""
+
+        tree = self.tree
+        stride = self.stride
+        total = 0
+        i = y
+        while i > 0:
+            j = x
+            base = i * stride
+            while j > 0:
+                total += tree[base + j]
+                j -= j & -j
+            i -= i & -i
+        return total
+
+    def count(self, ypos, xpos, leny, lenx):
+        """Returns number of occupied cells in the rectangle. The rectangle must
+           lie inside the grid."""
+
+        endy, endx = ypos + leny, xpos + lenx
+        return (self._prefix(endy, endx) - self._prefix(ypos, endx)
+                - self._prefix(endy, xpos) + self._prefix(ypos, xpos))
+
+class CandidatePool:
+    """Pool of integers 0..size-1 that hands them out in random order, each one
+       exactly once. Uses a lazy Fisher-Yates shuffle, so creating a pool is
+       O(1) and memory only grows with the number of values drawn."""
+
+
+    def __init__(self, size):
+        self.remaining = size
+        # positions swapped by earlier draws; every other position i < remaining
+        # still holds its own value i
+        self.swapped = {}
+
+    def __len__(self):
+        return self.remaining
+
+    def pop(self, rng):
+        """Removes and returns a random value from the pool. rng is anything
+           with a randrange() method (the random module or a random.Random)."""
+
+        if self.remaining == 0:
+            raise IndexError("pop from empty CandidatePool")
+        i = rng.randrange(self.remaining)
+        last = self.remaining - 1
+        value = self.swapped.get(i, i)
+        if i != last:
+            self.swapped[i] = self.swapped.pop(last, last)
+        else:
+            self.swapped.pop(last, None)
+        self.remaining = last
+        return value
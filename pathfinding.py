@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+import heapq
+from array import array
+from collections import deque, OrderedDict
+from level import PASSABLE_TABLE
+
+# distance of cells a distance map never reached
+UNREACHED = 0x7fffffff
+
+class DistanceMap:
+    """Number of steps from every cell to a target cell (Dijkstra over the
+       passable cells, 4-way moves, every step costs 1). Any number of actors
+       can chase the same target by reading this one map: from any cell, the
+       neighbour with the smallest distance is the next step.
+
+       Distances are only stored for a window of the level: all of it for an
+       unbounded map, the (2 * maxdist + 1) square around the target (cut to
+       the level) for a map limited to maxdist steps, as nothing outside it
+       can be reached anyway."""
+
+
+    def __init__(self, targety, targetx, maxdist, window, dist, bounds):
+        self.targety = targety
+        self.targetx = targetx
+        self.maxdist = maxdist
+        # (top, left, height, width) of the window in level coordinates
+        self.top, self.left, self.height, self.width = window
+        # array of distances, laid out row-major like Level.levelArr but
+        # covering only the window
+        self.dist = dist
+        # (miny, minx, maxy, maxx) of the cells that were reached
+        self.bounds = bounds
+
+    def getDistance(self, y, x):
+        """Returns number of steps from (y, x) to the target, or UNREACHED."""
+
+        y -= self.top
+        x -= self.left
+        if 0 <= y < self.height and 0 <= x < self.width:
+            return self.dist[y * self.width + x]
+        return UNREACHED
+
+class Pathfinder:
+    """Pathfinding over a Level's passability bitmap. Offers A* for single
+       point-to-point paths and cached distance maps for targets that many
+       actors go after (usually the player).
+
+       The pathfinder listens to the level's tile changes and only throws away
+       the cached maps the change can actually affect: a cell that got blocked
+       matters only to maps that reached it, a cell that opened up only to
+       maps that reached one of its neighbours or have it as their target
+       (a map to a blocked target reaches nothing at all)."""
+
+
+    def __init__(self, level, maxMaps=32):
+        self.level = level
+        self.ysize = level.getYDim()
+        self.xsize = level.getXDim()
+        self.passable = level.getPassability()
+        self.maxMaps = maxMaps
+        # (targety, targetx, maxdist) -> DistanceMap, least recently used first
+        self.maps = OrderedDict()
+        level.addTileListener(self.tilesChanged)
+
+    def close(self):
+        """Stops listening to the level."""
+
+        self.level.removeTileListener(self.tilesChanged)
+
+    def isPassable(self, y, x):
+        if 0 <= y < self.ysize and 0 <= x < self.xsize:
+            return self.passable[y * self.xsize + x] == 1
+        return False
+
+    def tilesChanged(self, ypos, xpos, leny, lenx):
+        """Tile listener; refreshes the bitmap for the rectangle and drops
+           cached distance maps the change could affect."""
+
+        xsize = self.xsize
+        arr = self.level.levelArr
+        changed = []
+        for y in range(ypos, ypos + leny):
+            start = y * xsize + xpos
+            new = arr[start:start + lenx].translate(PASSABLE_TABLE)
+            old = self.passable[start:start + lenx]
+            if new != old:
+                for x, (was, now) in enumerate(zip(old, new), xpos):
+                    if was != now:
+                        changed.append((y, x, now))
+                self.passable[start:start + lenx] = new
+        if not changed or not self.maps:
+            return
+        stale = []
+        for key, dmap in self.maps.items():
+            miny, minx, maxy, maxx = dmap.bounds
+            distance = dmap.getDistance
+            for y, x, now in changed:
+                if y == dmap.targety and x == dmap.targetx:
+                    stale.append(key)
+                    break
+                if y < miny - 1 or y > maxy + 1 or x < minx - 1 or x > maxx + 1:
+                    continue
+                if now == 0:
+                    hit = distance(y, x) != UNREACHED
+                else:
+                    hit = (distance(y - 1, x) != UNREACHED or
+                           distance(y + 1, x) != UNREACHED or
+                           distance(y, x - 1) != UNREACHED or
+                           distance(y, x + 1) != UNREACHED)
+                if hit:
+                    stale.append(key)
+                    break
+        for key in stale:
+            del self.maps[key]
+
+    def getDistanceMap(self, targety, targetx, maxdist=None):
+        """Returns the DistanceMap for a target, building it only if there is
+           no valid cached one. maxdist limits how far out the map is filled
+           (cells further away stay UNREACHED), which keeps maps for big
+           levels cheap."""
+
+        key = (targety, targetx, maxdist)
+        dmap = self.maps.get(key)
+        if dmap is not None:
+            self.maps.move_to_end(key)
+            return dmap
+        dmap = self._buildDistanceMap(targety, targetx, maxdist)
+        self.maps[key] = dmap
+        if len(self.maps) > self.maxMaps:
+            self.maps.popitem(last=False)
+        return dmap
+
+    def _buildDistanceMap(self, targety, targetx, maxdist):
+        if maxdist is None:
+            top, left, height, width = 0, 0, self.ysize, self.xsize
+        else:
+            top, left = max(targety - maxdist, 0), max(targetx - maxdist, 0)
+            height = min(targety + maxdist + 1, self.ysize) - top
+            width = min(targetx + maxdist + 1, self.xsize) - left
+        # the search runs in window coordinates on a copy of the window's
+        # passability
+        xsize = self.xsize
+        passable = b''.join(self.passable[y * xsize + left:y * xsize + left + width]
+                            for y in range(top, top + height))
+        dist = array('i', [UNREACHED]) * (height * width)
+        ty, tx = targety - top, targetx - left
+        miny = maxy = ty
+        minx = maxx = tx
+        if 0 <= ty < height and 0 <= tx < width and passable[ty * width + tx]:
+            limit = UNREACHED if maxdist is None else maxdist
+            start = ty * width + tx
+            dist[start] = 0
+            queue = deque((start,))
+            # every step costs the same, so Dijkstra is a breadth-first search
+            while queue:
+                i = queue.popleft()
+                d = dist[i] + 1
+                if d > limit:
+                    continue
+                y, x = divmod(i, width)
+                if y < miny:
+                    miny = y
+                elif y > maxy:
+                    maxy = y
+                if x < minx:
+                    minx = x
+                elif x > maxx:
+                    maxx = x
+                if y > 0:
+                    n = i - width
+                    if passable[n] and dist[n] == UNREACHED:
+                        dist[n] = d
+                        queue.append(n)
+                if y < height - 1:
+                    n = i + width
+                    if passable[n] and dist[n] == UNREACHED:
+                        dist[n] = d
+                        queue.append(n)
+                if x > 0:
+                    n = i - 1
+                    if passable[n] and dist[n] == UNREACHED:
+                        dist[n] = d
+                        queue.append(n)
+                if x < width - 1:
+                    n = i + 1
+                    if passable[n] and dist[n] == UNREACHED:
+                        dist[n] = d
+                        queue.append(n)
+        return DistanceMap(targety, targetx, maxdist, (top, left, height, width),
+                           dist, (miny + top, minx + left, maxy + top, maxx + left))
+
+    def stepToward(self, y, x, targety, targetx, maxdist=None):
+        """Returns (y, x) of the next cell on a shortest path from (y, x) to
+           the target using the shared distance map, or None if the target
+           can't be reached (or (y, x) is the target)."""
+
+        dmap = self.getDistanceMap(targety, targetx, maxdist)
+        distance = dmap.getDistance
+        best = distance(y, x)
+        step = None
+        for ny, nx in ((y-1, x), (y, x+1), (y+1, x), (y, x-1)):
+            d = distance(ny, nx)
+            if d < best:
+                best = d
+                step = (ny, nx)
+        return step
+
+    def findPath(self, starty, startx, endy, endx):
+        """A* search between two cells. Returns list of (y, x) cells from the
+           one after the start up to and including the end (empty if they're
+           the same cell), or None if there is no path."""
+
+        if not self.isPassable(endy, endx) or not self.isPassable(starty, startx):
+            return None
+        xsize, ysize = self.xsize, self.ysize
+        passable = self.passable
+        start = starty * xsize + startx
+        goal = endy * xsize + endx
+        cost = {start: 0}
+        came = {start: -1}
+        heap = [(abs(starty - endy) + abs(startx - endx), 0, start)]
+        while heap:
+            estimate, spent, i = heapq.heappop(heap)
+            if i == goal:
+                path = []
+                while i != start:
+                    path.append(divmod(i, xsize))
+                    i = came[i]
+                path.reverse()
+                return path
+            if spent > cost[i]:
+                continue
+            y, x = divmod(i, xsize)
+            spent += 1
+            for ny, nx in ((y-1, x), (y, x+1), (y+1, x), (y, x-1)):
+                if 0 <= ny < ysize and 0 <= nx < xsize:
+                    n = ny * xsize + nx
+                    if passable[n] and spent < cost.get(n, UNREACHED):
+                        cost[n] = spent
+                        came[n] = i
+                        heapq.heappush(heap, (spent + abs(ny - endy) + abs(nx - endx),
+                                              spent, n))
+        return None
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""Recording and replaying game sessions. A recording holds what is needed
+   to build the same game again (its seed and size) and every key pressed,
+   a few bytes per key: the milliseconds since the previous key and
+   the key itself. Every keyframeEvery turns the whole game state is saved
+   as well, so seeking to turn N starts from the closest keyframe before it
+   and only replays the turns after that.
+
+       python main.py --seed 5 --record session.rec
+       python recording.py session.rec --seek 120000
+
+   File layout: MAGIC, then the header, the key stream and the keyframes,
+   each preceded by its length as a varint (keyframes are turn, offset in
+   the key stream and zlib compressed state)."""
+import argparse
+import base64
+import bisect
+import json
+import os
+import time
+import zlib
+from dungeon import Dungeon
+from level import Level
+from main import Game
+from render import NullRenderer
+
+MAGIC = b'PYRR\x01'
+# turns between two keyframes
+KEYFRAME_EVERY = 10000
+
+# keys with names (see terminal.KeyDecoder) get one byte codes from 0x80 up;
+# plain ASCII keys are stored as themselves and anything else as LITERAL,
+# a length and its UTF-8 bytes
+NAMED_KEYS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+NAMED_CODES = {name: 0x80 + i for i, name in enumerate(NAMED_KEYS)}
+LITERAL = 0xff
+
+def writeVarint(out, value):
+    """Appends value (>= 0) to bytearray out, 7 bits per byte."""
+
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def readVarint(data, pos):
+    """Returns (value, position after it) for the varint at data[pos]."""
+
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _toJSON(value):
+    if isinstance(value, bytes):
+        return {'$b': base64.b64encode(value).decode('ascii')}
+    raise TypeError("can't store {0!r} in a keyframe".format(value))
+
+def _fromJSON(obj):
+    if '$b' in obj:
+        return base64.b64decode(obj['$b'])
+    return obj
+
+def encodeState(state):
+    return zlib.compress(json.dumps(state, default=_toJSON).encode())
+
+def decodeState(data):
+    return json.loads(zlib.decompress(data), object_hook=_fromJSON)
+
+class Recording:
+    """A recorded session: header (dict with 'seed', 'ydim', 'xdim',
+       'dungeon'), the encoded key stream and keyframes as sorted lists of
+       turns, stream offsets and encoded states."""
+
+
+    def __init__(self, header, keyframeEvery=KEYFRAME_EVERY):
+        self.header = dict(header, keyframeEvery=keyframeEvery)
+        self.keyframeEvery = keyframeEvery
+        self.stream = bytearray()
+        self.turns = 0
+        self.keyframeTurns = []
+        self.keyframeOffsets = []
+        self.keyframeStates = []
+
+    def addKey(self, keypress, millis):
+        out = self.stream
+        writeVarint(out, millis)
+        if keypress in NAMED_CODES:
+            out.append(NAMED_CODES[keypress])
+        elif len(keypress) == 1 and ord(keypress) < 0x80:
+            out.append(ord(keypress))
+        else:
+            data = keypress.encode('utf-8')
+            out.append(LITERAL)
+            writeVarint(out, len(data))
+            out += data
+
+    def addKeyframe(self, turn, state):
+        self.keyframeTurns.append(turn)
+        self.keyframeOffsets.append(len(self.stream))
+        self.keyframeStates.append(encodeState(state))
+
+    def readKeys(self, offset=0):
+        """Yields (milliseconds since the previous key, key, offset of the
+           next key) from stream offset on."""
+
+        data = self.stream
+        pos = offset
+        while pos < len(data):
+            millis, pos = readVarint(data, pos)
+            code = data[pos]
+            pos += 1
+            if code == LITERAL:
+                length, pos = readVarint(data, pos)
+                key = bytes(data[pos:pos + length]).decode('utf-8')
+                pos += length
+            elif code >= 0x80:
+                key = NAMED_KEYS[code - 0x80]
+            else:
+                key = chr(code)
+            yield millis, key, pos
+
+    def findKeyframe(self, turn):
+        """Returns index of the last keyframe at or before turn."""
+
+        return max(0, bisect.bisect_right(self.keyframeTurns, turn) - 1)
+
+    def save(self, path):
+        self.header['turns'] = self.turns
+        out = bytearray(MAGIC)
+        for block in (json.dumps(self.header).encode(), self.stream):
+            writeVarint(out, len(block))
+            out += block
+        writeVarint(out, len(self.keyframeTurns))
+        for turn, offset, state in zip(self.keyframeTurns, self.keyframeOffsets,
+                                       self.keyframeStates):
+            writeVarint(out, turn)
+            writeVarint(out, offset)
+            writeVarint(out, len(state))
+            out += state
+        with open(path + '.tmp', 'wb') as f:
+            f.write(out)
+        os.replace(path + '.tmp', path)
+
+def loadRecording(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("not a recording (or a newer version)")
+    pos = len(MAGIC)
+    length, pos = readVarint(data, pos)
+    header = json.loads(data[pos:pos + length])
+    pos += length
+    recording = Recording(header, header['keyframeEvery'])
+    length, pos = readVarint(data, pos)
+    recording.stream = bytearray(data[pos:pos + length])
+    pos += length
+    count, pos = readVarint(data, pos)
+    for i in range(count):
+        turn, pos = readVarint(data, pos)
+        offset, pos = readVarint(data, pos)
+        length, pos = readVarint(data, pos)
+        recording.keyframeTurns.append(turn)
+        recording.keyframeOffsets.append(offset)
+        recording.keyframeStates.append(data[pos:pos + length])
+        pos += length
+    recording.turns = header.get('turns', 0)
+    return recording
+
+class Recorder:
+    """Records a game as it is played: set it as the game's recorder (done by
+       the constructor) and Game.handleKey() reports every key to it."""
+
+
+    def __init__(self, game, keyframeEvery=KEYFRAME_EVERY, clock=time.monotonic):
+        if game.floors is not None:
+            header = {'dungeon': True, 'seed': game.floors.seed,
+                      'ydim': game.floors.ydim, 'xdim': game.floors.xdim}
+        else:
+            level = game.dungeon
+            header = {'dungeon': False, 'seed': level.seed,
+                      'ydim': level.getXDim(), 'xdim': level.getYDim()}
+        self.recording = Recording(header, keyframeEvery)
+        self.clock = clock
+        self.last = clock()
+        self.turn = 0
+        self.recording.addKeyframe(0, game.getState())
+        game.recorder = self
+
+    def record(self, keypress):
+        now = self.clock()
+        self.recording.addKey(keypress, max(0, int((now - self.last) * 1000)))
+        self.last = now
+
+    def turnDone(self, game):
+        self.turn += 1
+        self.recording.turns = self.turn
+        if self.turn % self.recording.keyframeEvery == 0:
+            self.recording.addKeyframe(self.turn, game.getState())
+
+    def save(self, path):
+        self.recording.save(path)
+
+def makeGame(header, renderer=None):
+    """Builds the game a recording was made from, as it was at turn 0."""
+
+    if renderer is None:
+        renderer = NullRenderer()
+    if header['dungeon']:
+        return Game(renderer=renderer,
+                    floors=Dungeon(header['seed'], header['ydim'], header['xdim']))
+    return Game(Level(header['ydim'], header['xdim'], header['seed']), renderer)
+
+class Replayer:
+    """Plays a Recording back without a terminal, as fast as possible."""
+
+
+    def __init__(self, recording, renderer=None):
+        self.recording = recording
+        self.game = makeGame(recording.header, renderer)
+        self.turn = 0
+        self.offset = 0
+        self.finished = False
+
+    def close(self):
+        if self.game.floors is not None:
+            self.game.floors.close()
+
+    def _play(self, count):
+        """Replays up to count turns from the current position. Returns number
+           of turns played."""
+
+        game = self.game
+        played = 0
+        if self.finished or count <= 0:
+            return played
+        for millis, keypress, end in self.recording.readKeys(self.offset):
+            self.offset = end
+            if not game.handleKey(keypress, draw=False):
+                self.finished = True
+                break
+            played += 1
+            self.turn += 1
+            if played >= count:
+                break
+        return played
+
+    def seek(self, turn):
+        """Brings the game to the state after turn keys: jumps to the closest
+           keyframe at or before turn (unless the game is already between it
+           and turn) and replays the rest. Returns the turn reached."""
+
+        recording = self.recording
+        i = recording.findKeyframe(turn)
+        if recording.keyframeTurns and not (recording.keyframeTurns[i] <= self.turn <= turn):
+            self.game.setState(decodeState(recording.keyframeStates[i]))
+            self.turn = recording.keyframeTurns[i]
+            self.offset = recording.keyframeOffsets[i]
+            self.finished = False
+        self._play(turn - self.turn)
+        return self.turn
+
+    def run(self):
+        """Replays everything left. Returns a dict with turns played, seconds
+           and turns per second."""
+
+        started = time.perf_counter()
+        played = self._play(float('inf'))
+        seconds = time.perf_counter() - started
+        return {'turns': played, 'seconds': seconds,
+                'turnsPerSecond': played / seconds if seconds > 0 else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded session.")
+    parser.add_argument('recording')
+    parser.add_argument('--seek', type=int, default=None, metavar='TURN',
+                        help="only go to this turn (from the nearest keyframe)")
+    args = parser.parse_args()
+
+    replayer = Replayer(loadRecording(args.recording))
+    try:
+        if args.seek is not None:
+            started = time.perf_counter()
+            turn = replayer.seek(args.seek)
+            print("at turn {0} in {1:.3f} s, player at {2}".format(
+                  turn, time.perf_counter() - started,
+                  replayer.game.player.getCurrentYX()))
+        else:
+            result = replayer.run()
+            print("{0} turns in {1:.3f} s, {2:.0f} turns/s, player at {3}".format(
+                  result['turns'], result['seconds'], result['turnsPerSecond'],
+                  replayer.game.player.getCurrentYX()))
+    finally:
+        replayer.close()
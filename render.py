@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import sys
+
+# ANSI escape sequences
+CSI = '\x1b['
+CLEAR_SCREEN = CSI + '2J'
+
+# changed cells closer together than this are sent as one run, it's cheaper to
+# resend a few unchanged glyphs than to move the cursor again
+RUN_GAP = 4
+
+def moveTo(y, x):
+    """Returns escape sequence moving the cursor to 0-based (y, x)."""
+
+    return '{0}{1};{2}H'.format(CSI, y + 1, x + 1)
+
+class Renderer:
+    """Draws a Level in the terminal, remembering what is currently on screen.
+       Only the first frame (or one after invalidate()) is sent in full, every
+       later frame sends just the cells that changed, using ANSI cursor
+       addressing. Each frame goes out in a single write.
+
+       originy, originx is where the top-left corner of the map goes on screen
+       (0-based). With a fov.FieldOfView set, only the cells in view and the
+       ones remembered from before are drawn."""
+
+
+    def __init__(self, out=None, originy=0, originx=0, fov=None):
+        self.out = out if out is not None else sys.stdout
+        self.originy = originy
+        self.originx = originx
+        self.fov = fov
+        # glyph bytes of the last frame sent, None means the screen is unknown
+        self.lastFrame = None
+        self.lastDims = None
+
+    def invalidate(self):
+        """Forgets what is on screen so the next frame is drawn in full (after
+           a terminal resize or something else drawing over the map)."""
+
+        self.lastFrame = None
+
+    def composeFrame(self, level):
+        """Returns glyph bytes (row-major, one byte per cell) for the level,
+           entities included."""
+
+        if self.fov is not None:
+            return self.fov.maskFrame(level.getGlyphs())
+        return level.getGlyphs()
+
+    def frameToText(self, frame, ysize, xsize):
+        """Returns text that draws the whole frame, starting with a clear
+           screen."""
+
+        parts = [CLEAR_SCREEN]
+        for y in range(ysize):
+            parts.append(moveTo(self.originy + y, self.originx))
+            parts.append(frame[y * xsize:(y+1) * xsize].decode('ascii'))
+        return ''.join(parts)
+
+    def diffToText(self, old, new, ysize, xsize):
+        """Returns text that turns frame old into frame new on screen, or an
+           empty string if they're the same."""
+
+        parts = []
+        oldview = memoryview(old)
+        newview = memoryview(new)
+        for y in range(ysize):
+            start = y * xsize
+            end = start + xsize
+            if oldview[start:end] == newview[start:end]:
+                continue
+            x = 0
+            while x < xsize:
+                if old[start + x] == new[start + x]:
+                    x += 1
+                    continue
+                # found a changed cell; extend the run while changes keep
+                # coming within RUN_GAP cells of each other
+                runstart = x
+                runend = x + 1
+                x += 1
+                while x < xsize and x - runend < RUN_GAP:
+                    if old[start + x] != new[start + x]:
+                        runend = x + 1
+                    x += 1
+                parts.append(moveTo(self.originy + y, self.originx + runstart))
+                parts.append(new[start + runstart:start + runend].decode('ascii'))
+                x = runend
+        return ''.join(parts)
+
+    def draw(self, level):
+        """Draws the level, sending only what changed since the last frame.
+           Returns number of characters written."""
+
+        ysize, xsize = level.getYDim(), level.getXDim()
+        frame = self.composeFrame(level)
+        if self.lastFrame is None or self.lastDims != (ysize, xsize):
+            text = self.frameToText(frame, ysize, xsize)
+        else:
+            text = self.diffToText(self.lastFrame, frame, ysize, xsize)
+        self.lastFrame = frame
+        self.lastDims = (ysize, xsize)
+        if text:
+            # park the cursor below the map so other output doesn't land on it
+            text += moveTo(self.originy + ysize, 0)
+            self.out.write(text)
+            self.out.flush()
+        return len(text)
+
+class NullRenderer:
+    """Renderer that draws nothing, for running the game without a terminal
+       (see Game.runHeadless())."""
+
+
+    def __init__(self):
+        self.fov = None
+
+    def invalidate(self):
+        pass
+
+    def draw(self, level):
+        return 0
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import heapq
+
+# speed of a normal actor; twice this acts twice as often
+NORMAL_SPEED = 100
+# time an action takes at normal speed
+ACTION_COST = 100
+
+def getDelay(actor, cost=ACTION_COST):
+    """Returns how long an action of given cost takes for actor, based on its
+       speed attribute (NORMAL_SPEED if it has none)."""
+
+    speed = getattr(actor, 'speed', NORMAL_SPEED)
+    return max(1, cost * NORMAL_SPEED // max(speed, 1))
+
+class Scheduler:
+    """Turn order for any number of actors, kept in a heap by the time of
+       their next action (an energy system: fast actors come back sooner).
+       Only actors that are due get looked at, so the cost of a turn depends
+       on the number of actions taken, not on how many actors exist. Actors
+       with nothing to do simply aren't scheduled until something wakes
+       them up with add().
+
+       Actors can be any hashable objects; each is in the queue at most once."""
+
+
+    def __init__(self):
+        self.time = 0
+        self.heap = []
+        # actor -> its heap entry [time, order, actor, alive]
+        self.entries = {}
+        # tie breaker so actors due at the same time act in the order they
+        # were scheduled
+        self.order = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, actor):
+        return actor in self.entries
+
+    def add(self, actor, delay=0):
+        """Schedules actor to act delay time units from now. An actor that is
+           already scheduled is moved to the new time."""
+
+        old = self.entries.get(actor)
+        if old is not None:
+            old[3] = False
+        entry = [self.time + delay, self.order, actor, True]
+        self.order += 1
+        self.entries[actor] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, actor):
+        """Takes actor out of the queue (dead, asleep...). Its heap entry is
+           only marked, it gets dropped when it reaches the top."""
+
+        entry = self.entries.pop(actor, None)
+        if entry is not None:
+            entry[3] = False
+
+    def getNextTime(self):
+        """Returns time of the next action, or None if nobody is scheduled."""
+
+        heap = self.heap
+        while heap and not heap[0][3]:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0][0]
+        return None
+
+    def popDue(self, out):
+        """Moves the clock to the next action time and fills out with every
+           actor due then, in order. The actors are taken out of the queue;
+           put them back with add() once they have acted. Returns out."""
+
+        out.clear()
+        when = self.getNextTime()
+        if when is None:
+            return out
+        self.time = when
+        heap = self.heap
+        entries = self.entries
+        while heap and heap[0][0] == when:
+            entry = heapq.heappop(heap)
+            if entry[3]:
+                del entries[entry[2]]
+                out.append(entry[2])
+        return out
+
+    def runUntil(self, time, act):
+        """Lets every actor due up to (and including) time act, in time order.
+           act(actor) does the actor's turn and returns how long until it
+           acts again, or None to leave it unscheduled. The clock ends at
+           time. Returns number of actions taken."""
+
+        actions = 0
+        batch = []
+        while True:
+            when = self.getNextTime()
+            if when is None or when > time:
+                break
+            for actor in self.popDue(batch):
+                delay = act(actor)
+                actions += 1
+                if delay is not None:
+                    self.add(actor, delay)
+        self.time = max(self.time, time)
+        return actions
+
+    def runFor(self, duration, act):
+        """Same as runUntil(), duration time units from now."""
+
+        return self.runUntil(self.time + duration, act)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""Hosts any number of games from one process over TCP. Connect with a
+   telnet client:
+
+       python server.py --port 4000
+       telnet localhost 4000
+
+   Every connection is a session with its own Game and Renderer, run as an
+   asyncio task, so a session only costs memory and CPU while its player is
+   actually doing something. Levels come ready-made from a LevelPool that
+   worker processes keep topped up."""
+import argparse
+import asyncio
+import codecs
+import functools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import zlib
+from dungeon import buildFloor
+from levelfile import readLevel
+from main import Game
+from render import Renderer, CLEAR_SCREEN
+from terminal import KeyDecoder, ESCAPE_DELAY, HIDE_CURSOR, SHOW_CURSOR
+
+# telnet commands and options we use
+IAC = 255
+SE, SB, WILL, WONT, DO, DONT = 240, 250, 251, 252, 253, 254
+ECHO = 1
+SUPPRESS_GO_AHEAD = 3
+# we echo (that is, we don't) and send characters as they are typed, which
+# puts telnet clients in character mode
+TELNET_SETUP = bytes((IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD))
+
+# ready levels kept in the pool
+POOL_SIZE = 32
+MAX_SESSIONS = 256
+# most bytes read from a client at once
+MAX_INPUT = 1024
+# a session with more than this many bytes of output not yet sent stops
+# drawing until the client catches up (its next frame then covers everything
+# it missed)
+MAX_OUTPUT = 64 * 1024
+# seconds without a key press before a session is dropped
+IDLE_TIMEOUT = 600
+# seconds a new session waits for a level before giving up
+TAKE_TIMEOUT = 30
+# levels failing to build in a row before the pool stops trying
+MAX_FAILURES = 8
+
+class PoolError(Exception):
+    pass
+
+class TelnetFilter:
+    """Strips telnet commands out of what a client sends, leaving the bytes
+       the player typed. Commands may be split across reads."""
+
+    NORMAL, COMMAND, OPTION, SUBNEGOTIATION, SUBCOMMAND = range(5)
+
+
+    def __init__(self):
+        self.state = self.NORMAL
+
+    def feed(self, data):
+        if self.state == self.NORMAL and IAC not in data:
+            return data
+        out = bytearray()
+        for byte in data:
+            state = self.state
+            if state == self.NORMAL:
+                if byte == IAC:
+                    self.state = self.COMMAND
+                else:
+                    out.append(byte)
+            elif state == self.COMMAND:
+                if byte == IAC:
+                    # escaped 255 data byte
+                    out.append(byte)
+                    self.state = self.NORMAL
+                elif byte == SB:
+                    self.state = self.SUBNEGOTIATION
+                elif WILL <= byte <= DONT:
+                    self.state = self.OPTION
+                else:
+                    self.state = self.NORMAL
+            elif state == self.OPTION:
+                self.state = self.NORMAL
+            elif state == self.SUBNEGOTIATION:
+                if byte == IAC:
+                    self.state = self.SUBCOMMAND
+            elif state == self.SUBCOMMAND:
+                self.state = self.NORMAL if byte == SE else self.SUBNEGOTIATION
+        return bytes(out)
+
+class LevelPool:
+    """Pre-generated levels shared by all sessions. Levels are built by an
+       executor (worker processes by default) and kept compressed; take()
+       hands out a fresh copy and starts building a replacement. Level
+       number i of the pool uses seed baseseed + i.
+
+       A level that fails to build is reported on stderr and replaced; after
+       MAX_FAILURES failures in a row the pool stops building and take()
+       raises PoolError instead of waiting for levels that won't come."""
+
+
+    def __init__(self, size=POOL_SIZE, ydim=80, xdim=20, baseseed=0, executor=None):
+        self.size = size
+        self.ydim = ydim
+        self.xdim = xdim
+        self.nextSeed = baseseed
+        self.executor = executor
+        self.ownExecutor = executor is None
+        self.ready = None
+        self.building = 0
+        # levels failed in a row, and the last error
+        self.failures = 0
+        self.error = None
+
+    def fill(self):
+        """Starts building levels until the pool (ready and on their way) is
+           full again. Must be called from the event loop."""
+
+        if self.ready is None:
+            self.ready = asyncio.Queue()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+        loop = asyncio.get_running_loop()
+        while self.failures < MAX_FAILURES and \
+              self.ready.qsize() + self.building < self.size:
+            try:
+                job = loop.run_in_executor(self.executor, buildFloor, self.ydim,
+                                           self.xdim, self.nextSeed)
+            except Exception as e:
+                # a broken executor refuses new jobs right away
+                self._failed(self.nextSeed, e)
+                continue
+            job.add_done_callback(functools.partial(self._built, seed=self.nextSeed))
+            self.nextSeed += 1
+            self.building += 1
+
+    def _failed(self, seed, error):
+        self.failures += 1
+        self.error = error
+        print("LevelPool: level {0} failed: {1!r}".format(seed, error),
+              file=sys.stderr)
+        if self.failures == MAX_FAILURES:
+            print("LevelPool: {0} failures in a row, giving up".format(
+                  MAX_FAILURES), file=sys.stderr)
+            # wakes up sessions waiting in take()
+            self.ready.put_nowait(None)
+
+    def _built(self, job, seed):
+        self.building -= 1
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            self._failed(seed, job.exception())
+        else:
+            self.failures = 0
+            self.ready.put_nowait(job.result())
+        # replace what failed; does nothing once the pool has given up
+        self.fill()
+
+    async def take(self, timeout=TAKE_TIMEOUT):
+        """Returns a Level of its own for a session. Raises PoolError if
+           none comes within timeout seconds or building levels keeps
+           failing."""
+
+        self.fill()
+        try:
+            data = await asyncio.wait_for(self.ready.get(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolError("no level ready after {0} s".format(timeout)) from None
+        if data is None:
+            # the pool gave up; leave the marker for the next one asking
+            self.ready.put_nowait(None)
+            raise PoolError("can't build levels: {0!r}".format(self.error))
+        self.fill()
+        return readLevel(zlib.decompress(data))
+
+    def close(self):
+        if self.ownExecutor and self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+class SessionOutput:
+    """What a session's Renderer writes to: sends the text to the client."""
+
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(text.encode('ascii', 'replace'))
+
+    def flush(self):
+        pass
+
+class GameServer:
+    """Accepts telnet connections and runs a game session for each one."""
+
+
+    def __init__(self, pool, maxSessions=MAX_SESSIONS):
+        self.pool = pool
+        self.maxSessions = maxSessions
+        self.sessions = 0
+
+    async def handle(self, reader, writer):
+        """Runs one session, from connecting to quitting (or the client going
+           away)."""
+
+        if self.sessions >= self.maxSessions:
+            writer.write(b"Server full, try again later.\r\n")
+            writer.close()
+            return
+        self.sessions += 1
+        try:
+            await self._play(reader, writer)
+        except PoolError:
+            writer.write(b"\r\nNo level available, try again later.\r\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions -= 1
+            if not writer.is_closing():
+                writer.write(SHOW_CURSOR.encode())
+                writer.close()
+
+    async def _play(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=MAX_OUTPUT)
+        writer.write(TELNET_SETUP + (CLEAR_SCREEN + HIDE_CURSOR).encode())
+        game = Game(await self.pool.take(), Renderer(SessionOutput(writer)))
+        game.renderer.draw(game.dungeon)
+        telnet = TelnetFilter()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        keys = KeyDecoder()
+        while True:
+            timeout = ESCAPE_DELAY if keys.pending else IDLE_TIMEOUT
+            try:
+                data = await asyncio.wait_for(reader.read(MAX_INPUT), timeout)
+            except asyncio.TimeoutError:
+                if not keys.pending:
+                    return
+                pressed = keys.flush()
+            else:
+                if not data:
+                    return
+                pressed = keys.feed(decoder.decode(telnet.feed(data)))
+            for keypress in pressed:
+                if not game.handleKey(keypress, draw=False):
+                    return
+            if pressed:
+                game.renderer.draw(game.dungeon)
+                # waits only while more than MAX_OUTPUT is queued; keys
+                # pile up meanwhile and get handled with a single frame
+                await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        self.pool.fill()
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Host games over telnet.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4000)
+    parser.add_argument('--pool', type=int, default=POOL_SIZE,
+                        help="number of levels kept ready")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="seed of the first pooled level")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS)
+    args = parser.parse_args()
+
+    pool = LevelPool(args.pool, baseseed=args.seed)
+    try:
+        asyncio.run(GameServer(pool, args.max_sessions).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
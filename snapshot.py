@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+def changedSpan(old, new):
+    """Returns (start, end) of the part of two equally long rows that differs,
+       the first and last differing cell found by bisection on slice
+       comparisons rather than cell by cell. Returns (0, 0) if they match."""
+
+    if old == new:
+        return (0, 0)
+    low, high = 0, len(old)
+    # longest common prefix
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[:mid] == new[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    start = low
+    low, high = 0, len(old) - start
+    # longest common suffix of what's left
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            low = mid
+        else:
+            high = mid - 1
+    return (start, len(old) - low)
+
+class Snapshot:
+    """Frozen copy of a level's tiles, stored as one bytes object per row.
+       Snapshots taken one after another share every row that didn't change
+       in between, so a snapshot costs one reference per row plus a copy of
+       each changed row. Get them from Level.snapshot(), put one back with
+       Level.restore(). Only tiles are kept, not entities."""
+
+
+    def __init__(self, rows, ysize, xsize):
+        self.rows = rows
+        self.ysize = ysize
+        self.xsize = xsize
+
+    def getTile(self, y, x):
+        if 0 <= y < self.ysize and 0 <= x < self.xsize:
+            return self.rows[y][x]
+        return -1
+
+    def getRow(self, y):
+        return self.rows[y]
+
+    def diff(self, other):
+        """Returns a list of (y, x, tile here, tile in other) for every cell
+           that differs between this snapshot and other. Shared rows are
+           skipped without looking at them."""
+
+        if (self.ysize, self.xsize) != (other.ysize, other.xsize):
+            raise ValueError("snapshots of different map sizes")
+        changes = []
+        for y, (mine, theirs) in enumerate(zip(self.rows, other.rows)):
+            if mine is theirs or mine == theirs:
+                continue
+            for x, (old, new) in enumerate(zip(mine, theirs)):
+                if old != new:
+                    changes.append((y, x, old, new))
+        return changes
+
+    def fork(self):
+        """Returns a Fork: a changeable copy that starts out sharing every row
+           with this snapshot."""
+
+        return Fork(self)
+
+class Fork:
+    """Copy-on-write version of a Snapshot for trying things out (search
+       trees, predictions): reading costs nothing extra, and a row is only
+       copied the first time something in it is changed. snapshot() freezes
+       it again, so it can be forked further, compared with diff() or put
+       back into the level with Level.restore()."""
+
+
+    def __init__(self, base):
+        self.ysize = base.ysize
+        self.xsize = base.xsize
+        self.rows = list(base.rows)
+        # rows copied into bytearrays of our own
+        self.owned = set()
+
+    def getTile(self, y, x):
+        if 0 <= y < self.ysize and 0 <= x < self.xsize:
+            return self.rows[y][x]
+        return -1
+
+    def setTile(self, y, x, tileid):
+        if not (0 <= y < self.ysize and 0 <= x < self.xsize):
+            return -1
+        if y not in self.owned:
+            if self.rows[y][x] == tileid:
+                return
+            self.rows[y] = bytearray(self.rows[y])
+            self.owned.add(y)
+        self.rows[y][x] = tileid
+
+    def fillRect(self, ypos, xpos, leny, lenx, tileid):
+        ypos, leny = max(ypos, 0), min(ypos + leny, self.ysize) - max(ypos, 0)
+        xpos, lenx = max(xpos, 0), min(xpos + lenx, self.xsize) - max(xpos, 0)
+        if lenx <= 0:
+            return
+        line = bytes((tileid,)) * lenx
+        for y in range(ypos, ypos + leny):
+            if y not in self.owned:
+                self.rows[y] = bytearray(self.rows[y])
+                self.owned.add(y)
+            self.rows[y][xpos:xpos + lenx] = line
+
+    def snapshot(self):
+        rows = tuple(bytes(row) if y in self.owned else row
+                     for y, row in enumerate(self.rows))
+        return Snapshot(rows, self.ysize, self.xsize)
+
+class SnapshotTracker:
+    """Keeps a level's last snapshot and the rows changed since (through
+       a tile listener), so the next snapshot only copies those rows. Made by
+       Level.snapshot() the first time it is called."""
+
+
+    def __init__(self, level):
+        self.level = level
+        self.last = None
+        self.dirty = set()
+        level.addTileListener(self.tilesChanged)
+
+    def close(self):
+        self.level.removeTileListener(self.tilesChanged)
+
+    def tilesChanged(self, ypos, xpos, leny, lenx):
+        self.dirty.update(range(ypos, ypos + leny))
+
+    def _readRow(self, y):
+        xsize = self.level.getXDim()
+        return bytes(self.level.levelArr[y * xsize:(y + 1) * xsize])
+
+    def take(self):
+        """Returns a Snapshot of the level as it is now."""
+
+        ysize, xsize = self.level.getYDim(), self.level.getXDim()
+        if self.last is None:
+            rows = tuple(self._readRow(y) for y in range(ysize))
+        elif not self.dirty:
+            return self.last
+        else:
+            rows = list(self.last.rows)
+            for y in self.dirty:
+                row = self._readRow(y)
+                # a row changed and changed back is still shared
+                if row != rows[y]:
+                    rows[y] = row
+            rows = tuple(rows)
+        self.dirty.clear()
+        self.last = Snapshot(rows, ysize, xsize)
+        return self.last
+
+    def restore(self, snapshot):
+        """Writes back every row of the level that differs from snapshot,
+           through Level.setRect() so the occupancy index and tile listeners
+           hear about it."""
+
+        level = self.level
+        if (snapshot.ysize, snapshot.xsize) != (level.getYDim(), level.getXDim()):
+            raise ValueError("snapshot is of a different map size")
+        current = self.take()
+        for y, (row, wanted) in enumerate(zip(current.rows, snapshot.rows)):
+            if row is not wanted:
+                start, end = changedSpan(row, wanted)
+                if start != end:
+                    level.setRect(y, start, [wanted[start:end]])
+        self.dirty.clear()
+        self.last = snapshot
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+class SpatialGrid:
+    """Uniform grid of buckets for points on the map (room centers, actors,
+       anything hashable with a position). Each bucket covers cellsize by
+       cellsize tiles, so nearest-k and radius queries only look at buckets
+       around the query point instead of at every item.
+
+       Query methods fill a list passed in by the caller (it is cleared first)
+       and reuse internal scratch space, so they don't build new containers on
+       every call. Distances are straight-line; (y, x) order as in Level."""
+
+
+    def __init__(self, cellsize=16):
+        assert cellsize > 0, "cellsize must be bigger than 0"
+        self.cellsize = cellsize
+        self.buckets = {}
+        # item -> (y, x)
+        self.positions = {}
+        # bounds of buckets that ever held an item, to know when to stop
+        # widening a search
+        self.minby = self.minbx = self.maxby = self.maxbx = 0
+        self._scratch = []
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def insert(self, item, y, x):
+        """Adds item at (y, x). Inserting an item that's already there moves
+           it."""
+
+        if item in self.positions:
+            self.remove(item)
+        by, bx = y // self.cellsize, x // self.cellsize
+        bucket = self.buckets.get((by, bx))
+        if bucket is None:
+            self.buckets[(by, bx)] = [item]
+        else:
+            bucket.append(item)
+        if not self.positions:
+            self.minby = self.maxby = by
+            self.minbx = self.maxbx = bx
+        else:
+            self.minby = min(self.minby, by)
+            self.maxby = max(self.maxby, by)
+            self.minbx = min(self.minbx, bx)
+            self.maxbx = max(self.maxbx, bx)
+        self.positions[item] = (y, x)
+
+    def remove(self, item):
+        y, x = self.positions.pop(item)
+        key = (y // self.cellsize, x // self.cellsize)
+        bucket = self.buckets[key]
+        if len(bucket) == 1:
+            del self.buckets[key]
+        else:
+            bucket.remove(item)
+
+    def move(self, item, y, x):
+        """Moves item to (y, x); cheap when it stays in the same bucket."""
+
+        oldy, oldx = self.positions[item]
+        cs = self.cellsize
+        if oldy // cs == y // cs and oldx // cs == x // cs:
+            self.positions[item] = (y, x)
+        else:
+            self.insert(item, y, x)
+
+    def getPosition(self, item):
+        return self.positions[item]
+
+    def _scanBucket(self, bucket, y, x, k, exclude, found):
+        """Merges items of bucket into found, a list of (distsq, item) kept
+           sorted and at most k long."""
+
+        positions = self.positions
+        for item in bucket:
+            if item == exclude:
+                continue
+            iy, ix = positions[item]
+            dist = (iy - y) * (iy - y) + (ix - x) * (ix - x)
+            if len(found) < k:
+                found.append((dist, item))
+                found.sort(key=_first)
+            elif dist < found[-1][0]:
+                found[-1] = (dist, item)
+                found.sort(key=_first)
+
+    def nearest(self, y, x, k, out, exclude=None):
+        """Fills out with up to k items closest to (y, x), closest first, and
+           returns it. exclude is an item to leave out (e.g. the one asking)."""
+
+        out.clear()
+        if not self.positions or k <= 0:
+            return out
+        found = self._scratch
+        found.clear()
+        cs = self.cellsize
+        cy, cx = y // cs, x // cs
+        buckets = self.buckets
+        # furthest ring of buckets that can hold anything
+        maxring = max(cy - self.minby, self.maxby - cy,
+                      cx - self.minbx, self.maxbx - cx, 0)
+        ring = 0
+        while ring <= maxring:
+            # everything in this ring or further out is at least this far away
+            if len(found) == k:
+                reach = (ring - 1) * cs
+                if reach > 0 and found[-1][0] <= reach * reach:
+                    break
+            if ring == 0:
+                bucket = buckets.get((cy, cx))
+                if bucket:
+                    self._scanBucket(bucket, y, x, k, exclude, found)
+            else:
+                for bx in range(cx - ring, cx + ring + 1):
+                    for by in (cy - ring, cy + ring):
+                        bucket = buckets.get((by, bx))
+                        if bucket:
+                            self._scanBucket(bucket, y, x, k, exclude, found)
+                for by in range(cy - ring + 1, cy + ring):
+                    for bx in (cx - ring, cx + ring):
+                        bucket = buckets.get((by, bx))
+                        if bucket:
+                            self._scanBucket(bucket, y, x, k, exclude, found)
+            ring += 1
+        for dist, item in found:
+            out.append(item)
+        found.clear()
+        return out
+
+    def withinRadius(self, y, x, radius, out, exclude=None):
+        """Fills out with every item at most radius tiles from (y, x), in no
+           particular order, and returns it."""
+
+        out.clear()
+        cs = self.cellsize
+        limit = radius * radius
+        positions = self.positions
+        buckets = self.buckets
+        for by in range(max((y - radius) // cs, self.minby),
+                        min((y + radius) // cs, self.maxby) + 1):
+            for bx in range(max((x - radius) // cs, self.minbx),
+                            min((x + radius) // cs, self.maxbx) + 1):
+                bucket = buckets.get((by, bx))
+                if not bucket:
+                    continue
+                for item in bucket:
+                    if item == exclude:
+                        continue
+                    iy, ix = positions[item]
+                    if (iy - y) * (iy - y) + (ix - x) * (ix - x) <= limit:
+                        out.append(item)
+        return out
+
+
+def _first(pair):
+    return pair[0]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+import atexit
+import codecs
+import os
+import selectors
+import signal
+import sys
+import termios
+import tty
+
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+
+# escape sequences sent by common keys, and the names readKeys() gives them
+ESCAPE_KEYS = {'\x1b[A': 'UP', '\x1b[B': 'DOWN', '\x1b[C': 'RIGHT', '\x1b[D': 'LEFT',
+               '\x1bOA': 'UP', '\x1bOB': 'DOWN', '\x1bOC': 'RIGHT', '\x1bOD': 'LEFT'}
+
+# how long (seconds) to wait for the rest of a split escape sequence
+ESCAPE_DELAY = 0.05
+
+# signals that would otherwise kill us with the terminal still in raw mode
+RESTORE_SIGNALS = (signal.SIGTERM, signal.SIGHUP)
+
+class KeyDecoder:
+    """Turns text typed at a terminal into key names: plain keys are
+       returned as themselves, arrow keys as 'UP', 'DOWN', 'LEFT' and
+       'RIGHT'. An escape sequence cut in half between two reads is kept
+       until the rest arrives (or flush() gives up on it)."""
+
+
+    def __init__(self):
+        # text read but not handed out yet (an incomplete escape sequence)
+        self.pending = ''
+
+    def feed(self, text):
+        """Returns list of keys in text (plus whatever was pending)."""
+
+        text = self.pending + text
+        self.pending = ''
+        keys = []
+        i = 0
+        while i < len(text):
+            if text[i] == '\x1b':
+                sequence = text[i:i+3]
+                if sequence in ESCAPE_KEYS:
+                    keys.append(ESCAPE_KEYS[sequence])
+                    i += 3
+                    continue
+                if sequence in ('\x1b', '\x1b[', '\x1bO'):
+                    # the rest of the sequence hasn't arrived yet
+                    self.pending = sequence
+                    break
+            keys.append(text[i])
+            i += 1
+        return keys
+
+    def flush(self):
+        """Hands out a pending half sequence as plain keys; it was a lone ESC
+           (or junk) after all."""
+
+        keys = list(self.pending)
+        self.pending = ''
+        return keys
+
+class Terminal:
+    """Keyboard input for the game. The terminal is switched to raw mode once
+       (not around every key) and stdin is polled through a selector, so
+       every key that piled up since the last frame is picked up at once.
+       The descriptor itself stays blocking: stdout usually shares it, and
+       non-blocking writes would silently cut large frames short.
+
+       Use it as a context manager; the terminal settings and cursor are put
+       back on exit, at interpreter exit and on SIGTERM/SIGHUP.
+       WARNING: raw mode disables CTRL-C and CTRL-D, the game has to offer its
+       own way out."""
+
+
+    def __init__(self, infile=None, out=None):
+        self.infile = infile if infile is not None else sys.stdin
+        self.out = out if out is not None else sys.stdout
+        self.fd = self.infile.fileno()
+        self.savedAttrs = None
+        self.savedHandlers = {}
+        self.selector = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.keys = KeyDecoder()
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc):
+        self.restore()
+        return False
+
+    def enter(self):
+        """Puts the terminal in raw mode and hides the cursor."""
+
+        if self.savedAttrs is not None:
+            return
+        self.savedAttrs = termios.tcgetattr(self.fd)
+        tty.setraw(self.fd)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ)
+        atexit.register(self.restore)
+        for signum in RESTORE_SIGNALS:
+            self.savedHandlers[signum] = signal.signal(signum, self._onSignal)
+        self.out.write(HIDE_CURSOR)
+        self.out.flush()
+
+    def restore(self):
+        """Puts everything back the way enter() found it. Safe to call more
+           than once."""
+
+        if self.savedAttrs is None:
+            return
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self.savedAttrs)
+        self.savedAttrs = None
+        self.selector.close()
+        self.selector = None
+        for signum, handler in self.savedHandlers.items():
+            signal.signal(signum, handler)
+        self.savedHandlers = {}
+        atexit.unregister(self.restore)
+        self.out.write(SHOW_CURSOR)
+        self.out.flush()
+
+    def _onSignal(self, signum, frame):
+        self.restore()
+        # die the way the signal meant us to
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    def readKeys(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for input and returns
+           a list of every key queued so far, oldest first. Plain keys are
+           returned as themselves, arrow keys as 'UP', 'DOWN', 'LEFT' and
+           'RIGHT'. Returns an empty list on timeout."""
+
+        if self.keys.pending:
+            # half an escape sequence is waiting; if the rest doesn't turn up
+            # soon it was a lone ESC (or junk), hand it out as it is
+            if not self.selector.select(ESCAPE_DELAY):
+                return self.keys.flush()
+        elif not self.selector.select(timeout):
+            return []
+        # the selector said there is input, so this read won't block; read
+        # again only while it says more is ready
+        chunks = [os.read(self.fd, 4096)]
+        while chunks[-1] and self.selector.select(0):
+            chunks.append(os.read(self.fd, 4096))
+        return self.keys.feed(self.decoder.decode(b''.join(chunks)))
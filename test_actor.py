@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Checks actor.ActorPool: batched moves, including actors following each
+   other, and placing actors directly."""
+import random
+import unittest
+from level import Level, TILE_FLOOR, TILE_WALL, NORTH, EAST, SOUTH, WEST
+from actor import ActorPool, DIRECTION_DELTAS
+
+def openRoom():
+    """A 20x80 level that is one walled room."""
+
+    level = Level(80, 20, 1)
+    level.fillRect(0, 0, 20, 80, TILE_WALL)
+    level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+    return level
+
+def positions(actors):
+    return [actor.getCurrentYX() for actor in actors]
+
+class ActorPoolMoveTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.pool = ActorPool(openRoom())
+
+    def spawnLine(self, length, y=5, x=5):
+        return [self.pool.spawn(y, x + i) for i in range(length)]
+
+    def checkCells(self):
+        pool = self.pool
+        self.assertEqual(len(pool.cells), len(pool))
+        for key, index in pool.cells.items():
+            self.assertEqual(key, pool.ys[index] * 80 + pool.xs[index])
+            self.assertIs(pool.getAt(*divmod(key, 80)), pool.handles[index])
+
+    def testLineFollowsLeader(self):
+        actors = self.spawnLine(3)
+        actors[1].move(EAST)
+        actors[2].move(EAST)
+        self.assertEqual(self.pool.update(), 2)
+        self.assertEqual(positions(actors), [(5, 5), (5, 7), (5, 8)])
+        self.checkCells()
+
+    def testLongLineAnyOrder(self):
+        rng = random.Random(13)
+        actors = self.spawnLine(30)
+        order = list(actors)
+        rng.shuffle(order)
+        for actor in order:
+            actor.move(EAST)
+        self.assertEqual(self.pool.update(), 30)
+        self.assertEqual(positions(actors), [(5, 6 + i) for i in range(30)])
+        self.checkCells()
+
+    def testFirstOrderedGetsContestedCell(self):
+        west, east = self.pool.spawn(5, 5), self.pool.spawn(5, 7)
+        leaving = self.pool.spawn(5, 6)
+        east.move(WEST)
+        leaving.move(SOUTH)
+        west.move(EAST)
+        self.assertEqual(self.pool.update(), 2)
+        self.assertEqual(positions((west, east, leaving)), [(5, 5), (5, 6), (6, 6)])
+        self.checkCells()
+
+    def testSwapAndWallsRefused(self):
+        a, b = self.pool.spawn(5, 5), self.pool.spawn(5, 6)
+        a.move(EAST)
+        b.move(WEST)
+        corner = self.pool.spawn(1, 1)
+        corner.move(NORTH)
+        self.assertEqual(self.pool.update(), 0)
+        self.assertEqual(positions((a, b, corner)), [(5, 5), (5, 6), (1, 1)])
+        self.checkCells()
+
+    def testRandomBatches(self):
+        rng = random.Random(14)
+        pool = self.pool
+        actors = [actor for actor in (pool.spawn(rng.randint(1, 18), rng.randint(1, 78))
+                                      for i in range(300)) if actor is not None]
+        for step in range(30):
+            before = {actor.index: actor.getCurrentYX() for actor in actors}
+            ordered = {}
+            for actor in rng.sample(actors, len(actors) // 2):
+                direction = rng.randrange(4)
+                actor.move(direction)
+                ordered[actor.index] = DIRECTION_DELTAS[direction]
+            moved = pool.update()
+            self.checkCells()
+            count = 0
+            for actor in actors:
+                (y, x), (ny, nx) = before[actor.index], actor.getCurrentYX()
+                if (y, x) != (ny, nx):
+                    count += 1
+                    self.assertEqual((ny - y, nx - x), ordered[actor.index])
+                elif actor.index in ordered:
+                    # refused: the cell is a wall, or still taken now
+                    dy, dx = ordered[actor.index]
+                    self.assertTrue(pool.level.getTile(y + dy, x + dx) == TILE_WALL or
+                                    pool.getAt(y + dy, x + dx) is not None)
+            self.assertEqual(moved, count)
+
+class ActorPoolPlaceTest(unittest.TestCase):
+
+
+    def testSetPositionRefusesTakenCell(self):
+        pool = ActorPool(openRoom())
+        a, b = pool.spawn(5, 5), pool.spawn(5, 6)
+        self.assertFalse(b.setPosition(5, 5))
+        self.assertEqual(b.getCurrentYX(), (5, 6))
+        self.assertTrue(b.setPosition(9, 9))
+        self.assertIs(pool.getAt(9, 9), b)
+        self.assertIsNone(pool.getAt(5, 6))
+
+    def testSetPositionThroughOccupiedCell(self):
+        pool = ActorPool(openRoom())
+        mover, bystander = pool.spawn(5, 5), pool.spawn(9, 5)
+        # setting y then x would pass through the bystander's cell
+        self.assertTrue(mover.setPosition(9, 8))
+        self.assertIs(pool.getAt(9, 5), bystander)
+        pool.kill(bystander)
+        pool.kill(mover)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.cells, {})
+
+    def testCoordinateSetters(self):
+        pool = ActorPool(openRoom())
+        a, b = pool.spawn(5, 5), pool.spawn(9, 5)
+        a.y = 9
+        # refused, (9, 5) is taken
+        self.assertEqual(a.getCurrentYX(), (5, 5))
+        a.x = 7
+        a.y = 9
+        self.assertEqual(a.getCurrentYX(), (9, 7))
+        self.assertIs(pool.getAt(9, 5), b)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Checks connectivity.Regions against a flood fill done cell by cell."""
+import random
+import unittest
+from collections import deque
+from level import Level, TILE_UNUSED, TILE_FLOOR, TILE_WALL, TILE_DOORCLOSED
+from connectivity import Regions, CONNECTING_TABLE, repairLevel
+
+def floodRegions(level, table=CONNECTING_TABLE):
+    """Returns a dict (y, x) -> region number for every connecting cell,
+       found with a breadth-first search from each cell not yet reached."""
+
+    ysize, xsize = level.getYDim(), level.getXDim()
+    region = {}
+    count = 0
+    for y in range(ysize):
+        for x in range(xsize):
+            if (y, x) in region or not table[level.getTile(y, x)]:
+                continue
+            count += 1
+            region[(y, x)] = count
+            queue = deque(((y, x),))
+            while queue:
+                cy, cx = queue.popleft()
+                for ny, nx in ((cy-1, cx), (cy+1, cx), (cy, cx-1), (cy, cx+1)):
+                    if 0 <= ny < ysize and 0 <= nx < xsize and \
+                       (ny, nx) not in region and table[level.getTile(ny, nx)]:
+                        region[(ny, nx)] = count
+                        queue.append((ny, nx))
+    return region
+
+def scramble(level, rng, changes=200):
+    """Punches random floor, wall and closed door rectangles into level, so
+       it falls apart into many regions."""
+
+    tiles = (TILE_UNUSED, TILE_FLOOR, TILE_WALL, TILE_DOORCLOSED)
+    for i in range(changes):
+        level.fillRect(rng.randrange(level.getYDim()), rng.randrange(level.getXDim()),
+                       rng.randint(1, 4), rng.randint(1, 6), rng.choice(tiles))
+
+class RegionsTest(unittest.TestCase):
+
+
+    def checkAgainstFlood(self, level):
+        regions = Regions(level)
+        flood = floodRegions(level)
+        xsize = level.getXDim()
+        labelMap = regions.getLabelMap()
+        # same partition: flood region -> label is one-to-one
+        labelOf = {}
+        for y in range(level.getYDim()):
+            for x in range(xsize):
+                label = regions.getLabel(y, x)
+                self.assertEqual(labelMap[y * xsize + x], label)
+                if (y, x) not in flood:
+                    self.assertEqual(label, 0)
+                    continue
+                self.assertNotEqual(label, 0)
+                self.assertEqual(labelOf.setdefault(flood[(y, x)], label), label)
+        self.assertEqual(len(set(labelOf.values())), len(labelOf))
+        self.assertEqual(regions.count, len(labelOf))
+        # sizes match and labels go largest first
+        sizes = {}
+        for number in flood.values():
+            sizes[labelOf[number]] = sizes.get(labelOf[number], 0) + 1
+        self.assertEqual(regions.sizes, [sizes[label] for label in range(1, regions.count + 1)])
+        self.assertEqual(regions.sizes, sorted(regions.sizes, reverse=True))
+        return regions
+
+    def testGeneratedLevels(self):
+        for seed in range(20):
+            self.checkAgainstFlood(Level(80, 20, seed))
+
+    def testScrambledLevels(self):
+        rng = random.Random(5)
+        for seed in range(10):
+            level = Level(60, 30, seed)
+            scramble(level, rng)
+            regions = self.checkAgainstFlood(level)
+            self.assertGreater(regions.count, 1)
+
+    def testGetCellAndFindClosest(self):
+        rng = random.Random(6)
+        level = Level(60, 30, 3)
+        scramble(level, rng)
+        regions = Regions(level)
+        cells = floodRegions(level)
+        for label in range(1, regions.count + 1):
+            y, x = regions.getCell(label)
+            self.assertEqual(regions.getLabel(y, x), label)
+        for i in range(50):
+            y, x = rng.randrange(30), rng.randrange(60)
+            label = rng.randint(1, regions.count)
+            found = regions.findClosest(y, x, label)
+            self.assertEqual(regions.getLabel(*found), label)
+            best = min(abs(cy - y) + abs(cx - x) for cy, cx in cells
+                       if regions.getLabel(cy, cx) == label)
+            self.assertEqual(abs(found[0] - y) + abs(found[1] - x), best)
+
+    def testRepairJoinsGeneratedLevels(self):
+        rng = random.Random(7)
+        for seed in range(5):
+            level = Level(80, 20, seed)
+            # cut the level up with walls, then let repair join it again
+            for i in range(4):
+                level.fillRect(0, rng.randrange(10, 70), 20, 1, TILE_WALL)
+            regions = repairLevel(level)
+            self.assertTrue(regions.isConnected())
+            self.assertEqual(regions.count, len(set(floodRegions(level).values())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Checks fov.FieldOfView: symmetry, walls stopping sight, the result cache
+   following tile changes, and the explored map."""
+import random
+import unittest
+from level import Level, TILE_FLOOR, TILE_WALL, GLYPH_TABLE
+from fov import FieldOfView, OPAQUE_TABLE
+
+def floorCells(level):
+    xsize = level.getXDim()
+    return [divmod(i, xsize) for i, tile in enumerate(level.levelArr)
+            if tile == TILE_FLOOR]
+
+class FieldOfViewTest(unittest.TestCase):
+
+
+    def testSymmetric(self):
+        rng = random.Random(8)
+        for seed in range(5):
+            level = Level(80, 20, seed)
+            fov = FieldOfView(level)
+            cells = floorCells(level)
+            for i in range(150):
+                (ay, ax), (by, bx) = rng.choice(cells), rng.choice(cells)
+                self.assertEqual(fov.canSee(ay, ax, by, bx, 6),
+                                 fov.canSee(by, bx, ay, ax, 6))
+            fov.close()
+
+    def testOpenRoom(self):
+        level = Level(80, 20, 1)
+        level.fillRect(0, 0, 20, 80, TILE_WALL)
+        level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+        fov = FieldOfView(level)
+        seen = fov.compute(10, 40, 5)
+        # in an empty room everything inside the radius is in view
+        for y in range(20):
+            for x in range(80):
+                dy, dx = abs(y - 10), abs(x - 40)
+                inside = dy <= 5 and dx <= 5 and dy * dy + dx * dx <= 5 * 5 + 5
+                self.assertEqual(y * 80 + x in seen, inside, (y, x))
+
+    def testWallBlocksSight(self):
+        level = Level(80, 20, 1)
+        level.fillRect(0, 0, 20, 80, TILE_WALL)
+        level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+        level.fillRect(1, 40, 18, 1, TILE_WALL)
+        fov = FieldOfView(level)
+        self.assertTrue(fov.canSee(10, 38, 10, 40))
+        self.assertFalse(fov.canSee(10, 38, 10, 42))
+        self.assertFalse(fov.canSee(10, 42, 10, 38))
+
+    def testCacheFollowsTileChanges(self):
+        level = Level(80, 20, 1)
+        level.fillRect(0, 0, 20, 80, TILE_WALL)
+        level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+        fov = FieldOfView(level)
+        self.assertTrue(fov.canSee(10, 30, 10, 34))
+        far = fov.compute(10, 70, 5)
+        level.setTile(10, 32, TILE_WALL)
+        self.assertFalse(fov.canSee(10, 30, 10, 34))
+        self.assertEqual(fov.opaque, bytearray(level.levelArr).translate(OPAQUE_TABLE))
+        # a view too far away to see the change stays cached
+        self.assertIs(fov.compute(10, 70, 5), far)
+        level.setTile(10, 32, TILE_FLOOR)
+        self.assertTrue(fov.canSee(10, 30, 10, 34))
+
+    def testExploredAndRemembered(self):
+        level = Level(80, 20, 2)
+        fov = FieldOfView(level)
+        y, x = floorCells(level)[0]
+        visible = fov.update(y, x)
+        for i in visible:
+            self.assertEqual(fov.explored[i], 1)
+            self.assertEqual(fov.remembered[i], GLYPH_TABLE[level.levelArr[i]])
+        self.assertEqual(sum(fov.explored), len(visible))
+        frame = fov.maskFrame(level.getGlyphs())
+        for i, glyph in enumerate(frame):
+            if not fov.explored[i]:
+                self.assertEqual(glyph, ord(' '))
+
+
+if __name__ == '__main__':
+    unittest.main()
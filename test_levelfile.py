@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Checks level files: round trips through dumpLevel()/readLevel() and
+   loadLevel(), the occupancy index and room mask a loaded level works out
+   for itself, and the three mapping modes."""
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+from level import Level, TILE_UNUSED, TILE_FLOOR, TILE_WALL
+from levelfile import dumpLevel, readLevel, saveLevel, loadLevel, \
+                      LevelFileError, HEADER
+
+TILES = (TILE_UNUSED, TILE_FLOOR, TILE_WALL)
+
+def bruteCount(level, ypos, xpos, leny, lenx):
+    return sum(1 for y in range(ypos, ypos + leny)
+                 for x in range(xpos, xpos + lenx)
+                 if level.getTile(y, x) != TILE_UNUSED)
+
+class LevelFileTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'level.pyrl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def checkSame(self, loaded, level):
+        self.assertEqual(bytes(loaded.levelArr), bytes(level.levelArr))
+        self.assertEqual((loaded.getYDim(), loaded.getXDim(), loaded.seed),
+                         (level.getYDim(), level.getXDim(), level.seed))
+        self.assertEqual(loaded.rooms, [[r[0], r[1], r[2], bool(r[3])] for r in level.rooms])
+        self.assertEqual(loaded.isFull, level.isFull)
+        # neither is stored, both are rebuilt the way the generator had them
+        self.assertNotIn('occupancy', loaded.__dict__)
+        self.assertNotIn('roomMask', loaded.__dict__)
+        self.assertEqual(loaded.roomMask, level.roomMask)
+        self.assertEqual(loaded.occupancy.tree, level.occupancy.tree)
+
+    def testRoundTrips(self):
+        for seed in range(20):
+            level = Level(80, 20, seed)
+            self.checkSame(readLevel(dumpLevel(level)), level)
+        level = Level(120, 45, 7)
+        saveLevel(level, self.path)
+        self.checkSame(loadLevel(self.path), level)
+
+    def testEditsAfterLoading(self):
+        rng = random.Random(15)
+        level = Level(80, 20, 2)
+        saveLevel(level, self.path)
+        for early in (False, True):
+            loaded = loadLevel(self.path)
+            if early:
+                loaded.occupancy
+            for step in range(100):
+                y, x = rng.randint(-2, 21), rng.randint(-2, 81)
+                kind = rng.randrange(3)
+                if kind == 0:
+                    loaded.setTile(y, x, rng.choice(TILES))
+                elif kind == 1:
+                    loaded.fillRect(y, x, rng.randint(0, 6), rng.randint(0, 9),
+                                    rng.choice(TILES))
+                else:
+                    loaded.setRect(y, x, [bytes(rng.choice(TILES) for i in range(5))] * 3)
+                ypos, xpos = rng.randrange(20), rng.randrange(80)
+                leny, lenx = rng.randint(1, 20 - ypos), rng.randint(1, 80 - xpos)
+                self.assertEqual(loaded.occupancy.count(ypos, xpos, leny, lenx),
+                                 bruteCount(loaded, ypos, xpos, leny, lenx))
+            self.assertEqual(loaded.occupancy.count(0, 0, 20, 80),
+                             bruteCount(loaded, 0, 0, 20, 80))
+
+    def testModes(self):
+        level = Level(80, 20, 3)
+        saveLevel(level, self.path)
+        y, x = divmod(level.levelArr.find(bytes((TILE_UNUSED,))), 80)
+
+        copied = loadLevel(self.path, 'copy')
+        copied.setTile(y, x, TILE_FLOOR)
+        self.assertEqual(copied.getTile(y, x), TILE_FLOOR)
+        self.assertEqual(loadLevel(self.path).getTile(y, x), TILE_UNUSED)
+
+        written = loadLevel(self.path, 'write')
+        written.setTile(y, x, TILE_FLOOR)
+        written.levelArr.flush()
+        self.assertEqual(loadLevel(self.path).getTile(y, x), TILE_FLOOR)
+        written.setTile(y, x, TILE_UNUSED)
+        written.levelArr.flush()
+
+        self.assertRaises(ValueError, loadLevel, self.path, 'append')
+
+    def testReadOnlyRefusesWrites(self):
+        level = Level(80, 20, 4)
+        saveLevel(level, self.path)
+        y, x = divmod(level.levelArr.find(bytes((TILE_UNUSED,))), 80)
+        for early in (False, True):
+            loaded = loadLevel(self.path, 'read')
+            if early:
+                loaded.occupancy
+            self.assertRaises(TypeError, loaded.setTile, y, x, TILE_FLOOR)
+            self.assertRaises(TypeError, loaded.fillRect, y, x, 2, 3, TILE_WALL)
+            self.assertRaises(TypeError, loaded.setRect, y, x, [b'\x01\x01'])
+            # nothing was written, so nothing was counted either
+            self.assertEqual(bytes(loaded.levelArr), bytes(level.levelArr))
+            self.assertEqual(loaded.occupancy.tree, level.occupancy.tree)
+
+    def testBadFiles(self):
+        data = dumpLevel(Level(80, 20, 5))
+        self.assertRaises(LevelFileError, readLevel, b'JUNK' + data[4:])
+        self.assertRaises(LevelFileError, readLevel, data[:-1])
+        self.assertRaises(LevelFileError, readLevel, data[:HEADER.size - 1])
+        newer = bytearray(data)
+        struct.pack_into('<H', newer, 4, 99)
+        self.assertRaises(LevelFileError, readLevel, bytes(newer))
+        with open(self.path, 'wb') as f:
+            f.write(data[:-1])
+        self.assertRaises(LevelFileError, loadLevel, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
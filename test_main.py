@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Checks the headless game: readScript() parsing, runHeadless() and the
+   player being stopped by walls."""
+import io
+import os
+import tempfile
+import unittest
+from dungeon import Dungeon
+from level import Level, TILE_FLOOR, TILE_WALL, TILE_DOWNSTAIRS, PASSABLE_TABLE
+from main import Game, readScript, randomKeys
+from pathfinding import Pathfinder
+from render import NullRenderer
+
+# (dy, dx) of a step -> key making it
+STEP_KEYS = {(-1, 0): 'w', (0, 1): 'd', (1, 0): 's', (0, -1): 'a'}
+
+def openRoom():
+    """A 20x80 level that is one walled room."""
+
+    level = Level(80, 20, 1)
+    level.fillRect(0, 0, 20, 80, TILE_WALL)
+    level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+    return level
+
+def keysTo(game, tile):
+    """Script text walking the player to the first tile of that kind."""
+
+    target = divmod(game.dungeon.levelArr.find(bytes((tile,))), game.dungeon.getXDim())
+    pathfinder = Pathfinder(game.dungeon)
+    path = pathfinder.findPath(game.player.y, game.player.x, *target)
+    pathfinder.close()
+    keys = []
+    y, x = game.player.getCurrentYX()
+    for ny, nx in path:
+        keys.append(STEP_KEYS[(ny - y, nx - x)])
+        y, x = ny, nx
+    return ''.join(keys)
+
+class ReadScriptTest(unittest.TestCase):
+
+
+    def testParsing(self):
+        script = io.StringIO("# a comment <UP>\n"
+                             "wa sd\n"
+                             "<UP><LEFT> <RIGHT>\t<DOWN>\n"
+                             "<w> <x <NOPE>\n"
+                             "><\n")
+        self.assertEqual(list(readScript(script)),
+                         ['w', 'a', 's', 'd', 'UP', 'LEFT', 'RIGHT', 'DOWN',
+                          '<', 'w', '>', '<', 'x', '<', 'N', 'O', 'P', 'E', '>',
+                          '>', '<'])
+
+    def testPath(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write("dd\n<LEFT>\n")
+            self.assertEqual(list(readScript(path)), ['d', 'd', 'LEFT'])
+        finally:
+            os.remove(path)
+
+class HeadlessTest(unittest.TestCase):
+
+
+    def testWallsStopPlayer(self):
+        game = Game(openRoom(), NullRenderer())
+        self.assertEqual(game.player.getCurrentYX(), (18, 78))
+        game.runHeadless(readScript(io.StringIO("dddsss<RIGHT><DOWN>")))
+        self.assertEqual(game.player.getCurrentYX(), (18, 78))
+        game.runHeadless(readScript(io.StringIO("aawww")))
+        self.assertEqual(game.player.getCurrentYX(), (15, 76))
+
+    def testRandomWalkStaysOnPassableTiles(self):
+        for seed in range(5):
+            game = Game(Level(80, 20, seed), NullRenderer())
+            for key in randomKeys(2000, seed):
+                game.handleKey(key, draw=False)
+                tile = game.dungeon.getTile(game.player.y, game.player.x)
+                self.assertNotEqual(tile, -1)
+                self.assertTrue(PASSABLE_TABLE[tile])
+
+    def testTicksAndQuit(self):
+        game = Game(openRoom(), NullRenderer())
+        result = game.runHeadless(readScript(io.StringIO("wwwQwww")))
+        self.assertEqual(result['ticks'], 3)
+        self.assertEqual(game.player.getCurrentYX(), (15, 78))
+        result = game.runHeadless(randomKeys(100, 1))
+        self.assertEqual(result['ticks'], 100)
+
+    def testScriptTakesStairs(self):
+        floors = Dungeon(4)
+        try:
+            game = Game(renderer=NullRenderer(), floors=floors)
+            game.runHeadless(readScript(io.StringIO(keysTo(game, TILE_DOWNSTAIRS) + ">")))
+            self.assertEqual(floors.depth, 1)
+            # the player arrives on the up staircase, so '>' does nothing there
+            # and '<' goes back up, to the down staircase; '<' ... '>' on one
+            # line are still two stairs keys, not a key name
+            game.runHeadless(readScript(io.StringIO(">da<")))
+            self.assertEqual(floors.depth, 0)
+            game.runHeadless(readScript(io.StringIO("da<da>")))
+            self.assertEqual(floors.depth, 1)
+        finally:
+            floors.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+"""Checks that the generation counters of metrics.GenerationStats add up."""
+import unittest
+from level import Level
+from metrics import StatsCollector
+
+class GenerationStatsTest(unittest.TestCase):
+
+
+    def testRoomAttemptsAddUp(self):
+        collector = StatsCollector()
+        for seed in range(200):
+            level = Level(80, 20, seed, metrics=collector)
+            stats = level.stats
+            self.assertEqual(stats.roomAttempts, stats.roomsRejected + stats.roomsBuilt,
+                             seed)
+            self.assertEqual(stats.roomsBuilt, len(level.rooms))
+        totals = collector.totals
+        self.assertEqual(collector.levels, 200)
+        self.assertEqual(totals['roomAttempts'],
+                         totals['roomsRejected'] + totals['roomsBuilt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
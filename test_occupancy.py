@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Checks the occupancy index, and Level's bookkeeping of it, against
+   counting the tiles one by one."""
+import random
+import unittest
+from level import Level, TILE_UNUSED, TILE_FLOOR, TILE_WALL
+from occupancy import OccupancyIndex, CandidatePool
+
+def bruteCount(level, ypos, xpos, leny, lenx):
+    """Number of tiles in the rectangle that aren't TILE_UNUSED."""
+
+    return sum(1 for y in range(ypos, ypos + leny)
+                 for x in range(xpos, xpos + lenx)
+                 if level.getTile(y, x) != TILE_UNUSED)
+
+def randomRect(rng, ysize, xsize):
+    """Returns (ypos, xpos, leny, lenx) of a rectangle inside the grid."""
+
+    ypos, xpos = rng.randrange(ysize), rng.randrange(xsize)
+    return (ypos, xpos, rng.randint(1, ysize - ypos), rng.randint(1, xsize - xpos))
+
+class OccupancyIndexTest(unittest.TestCase):
+
+
+    def testAddRectMatchesPointUpdates(self):
+        rng = random.Random(2)
+        for ysize, xsize in ((1, 1), (7, 13), (32, 32), (33, 17)):
+            byRect = OccupancyIndex(ysize, xsize)
+            byCell = OccupancyIndex(ysize, xsize)
+            for i in range(40):
+                ypos, xpos, leny, lenx = randomRect(rng, ysize, xsize)
+                delta = rng.choice((-2, -1, 1, 3))
+                byRect.addRect(ypos, xpos, leny, lenx, delta)
+                for y in range(ypos, ypos + leny):
+                    for x in range(xpos, xpos + lenx):
+                        byCell.add(y, x, delta)
+                self.assertEqual(byRect.tree, byCell.tree)
+
+    def testNodesCoverEachPositionOnce(self):
+        index = OccupancyIndex(1, 40)
+        for start in range(40):
+            for length in range(1, 41 - start):
+                covered = {}
+                for node, count in index._nodes(start, length, 40):
+                    low = node - (node & -node) + 1
+                    inside = [p for p in range(low, node + 1)
+                              if start < p <= start + length]
+                    self.assertEqual(count, len(inside))
+                    for p in inside:
+                        covered[p] = covered.get(p, 0) + 1
+                # together the nodes reach every updated position
+                self.assertEqual(sorted(covered), list(range(start + 1, start + length + 1)))
+
+class LevelOccupancyTest(unittest.TestCase):
+
+
+    def checkCounts(self, level, rng, rects=30):
+        ysize, xsize = level.getYDim(), level.getXDim()
+        self.assertEqual(level.occupancy.count(0, 0, ysize, xsize),
+                         bruteCount(level, 0, 0, ysize, xsize))
+        for i in range(rects):
+            rect = randomRect(rng, ysize, xsize)
+            self.assertEqual(level.occupancy.count(*rect), bruteCount(level, *rect))
+
+    def testGeneratedLevels(self):
+        rng = random.Random(0)
+        for seed in range(10):
+            self.checkCounts(Level(60, 30, seed), rng)
+
+    def testRandomChanges(self):
+        rng = random.Random(1)
+        level = Level(50, 25, 4)
+        tiles = (TILE_UNUSED, TILE_FLOOR, TILE_WALL)
+        for step in range(300):
+            kind = rng.randrange(3)
+            # rectangles may stick out of the map, Level clips them
+            y, x = rng.randint(-3, 27), rng.randint(-3, 52)
+            if kind == 0:
+                level.setTile(y, x, rng.choice(tiles))
+            elif kind == 1:
+                level.fillRect(y, x, rng.randint(0, 8), rng.randint(0, 8),
+                               rng.choice(tiles))
+            else:
+                rows = [bytes(rng.choice(tiles) for i in range(rng.randint(1, 6)))]
+                rows *= rng.randint(1, 4)
+                level.setRect(y, x, rows)
+            self.checkCounts(level, rng, 5)
+
+class CandidatePoolTest(unittest.TestCase):
+
+
+    def testEveryValueOnce(self):
+        rng = random.Random(3)
+        for size in (0, 1, 2, 10, 1000):
+            pool = CandidatePool(size)
+            drawn = [pool.pop(rng) for i in range(size)]
+            self.assertEqual(sorted(drawn), list(range(size)))
+            self.assertEqual(len(pool), 0)
+            self.assertRaises(IndexError, pool.pop, rng)
+
+    def testPartialDrawsStayDistinct(self):
+        rng = random.Random(4)
+        pool = CandidatePool(500)
+        drawn = set()
+        for i in range(250):
+            value = pool.pop(rng)
+            self.assertNotIn(value, drawn)
+            self.assertTrue(0 <= value < 500)
+            drawn.add(value)
+        self.assertEqual(len(pool), 250)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Checks pathfinding.Pathfinder: distance maps against a fresh search, which
+   cached maps a tile change throws away, and A* path lengths."""
+import random
+import unittest
+from level import Level, TILE_FLOOR, TILE_WALL, TILE_DOORCLOSED, TILE_DOOROPEN
+from pathfinding import Pathfinder, UNREACHED
+
+def passableCells(pathfinder):
+    return [(y, x) for y in range(pathfinder.ysize) for x in range(pathfinder.xsize)
+            if pathfinder.isPassable(y, x)]
+
+def sameDistances(pathfinder, dmap, fresh):
+    return all(dmap.getDistance(y, x) == fresh.getDistance(y, x)
+               for y in range(pathfinder.ysize) for x in range(pathfinder.xsize))
+
+def openRoom():
+    """A 20x80 level that is one walled room with a wall across the middle."""
+
+    level = Level(80, 20, 1)
+    level.fillRect(0, 0, 20, 80, TILE_WALL)
+    level.fillRect(1, 1, 18, 78, TILE_FLOOR)
+    level.fillRect(1, 40, 18, 1, TILE_WALL)
+    return level
+
+class DistanceMapTest(unittest.TestCase):
+
+
+    def testCachedMapsStayCorrect(self):
+        rng = random.Random(11)
+        tiles = (TILE_FLOOR, TILE_WALL, TILE_DOORCLOSED, TILE_DOOROPEN)
+        for seed in range(2):
+            level = Level(80, 20, seed)
+            pathfinder = Pathfinder(level, maxMaps=1000)
+            cells = passableCells(pathfinder)
+            keys = [rng.choice(cells) + (rng.choice((None, 3, 10)),) for i in range(30)]
+            for step in range(50):
+                for key in keys:
+                    pathfinder.getDistanceMap(*key)
+                y, x = rng.randrange(20), rng.randrange(80)
+                if rng.random() < 0.3:
+                    # a changed cell that is some map's target
+                    y, x = rng.choice(keys)[:2]
+                level.setTile(y, x, rng.choice(tiles))
+                # whatever survived the change is still right
+                for key, dmap in list(pathfinder.maps.items()):
+                    fresh = pathfinder._buildDistanceMap(*key)
+                    self.assertTrue(sameDistances(pathfinder, dmap, fresh), (key, y, x))
+            pathfinder.close()
+
+    def testOpenedTarget(self):
+        level = openRoom()
+        level.setTile(10, 40, TILE_DOORCLOSED)
+        pathfinder = Pathfinder(level)
+        dmap = pathfinder.getDistanceMap(10, 40)
+        self.assertEqual(dmap.getDistance(10, 41), UNREACHED)
+        level.setTile(10, 40, TILE_DOOROPEN)
+        self.assertIsNot(pathfinder.getDistanceMap(10, 40), dmap)
+        self.assertEqual(pathfinder.getDistanceMap(10, 40).getDistance(10, 41), 1)
+        self.assertEqual(pathfinder.stepToward(10, 42, 10, 40), (10, 41))
+
+    def testOpenedNeighbour(self):
+        level = openRoom()
+        pathfinder = Pathfinder(level)
+        dmap = pathfinder.getDistanceMap(10, 30)
+        self.assertEqual(dmap.getDistance(10, 50), UNREACHED)
+        level.setTile(5, 40, TILE_DOOROPEN)
+        dmap = pathfinder.getDistanceMap(10, 30)
+        self.assertEqual(dmap.getDistance(5, 41), 16)
+
+    def testBlockedCell(self):
+        level = openRoom()
+        pathfinder = Pathfinder(level)
+        dmap = pathfinder.getDistanceMap(10, 30)
+        level.setTile(10, 31, TILE_WALL)
+        self.assertIsNot(pathfinder.getDistanceMap(10, 30), dmap)
+        self.assertEqual(pathfinder.getDistanceMap(10, 30).getDistance(10, 32), 4)
+
+    def testUnaffectedMapsKept(self):
+        level = openRoom()
+        pathfinder = Pathfinder(level)
+        near = pathfinder.getDistanceMap(10, 10, 5)
+        whole = pathfinder.getDistanceMap(10, 10)
+        # out of the bounded map's reach, but inside the whole map
+        level.setTile(10, 30, TILE_WALL)
+        self.assertIs(pathfinder.getDistanceMap(10, 10, 5), near)
+        self.assertIsNot(pathfinder.getDistanceMap(10, 10), whole)
+        # behind the middle wall neither map reached anything
+        level.setTile(10, 60, TILE_WALL)
+        whole = pathfinder.getDistanceMap(10, 10)
+        level.setTile(10, 60, TILE_FLOOR)
+        self.assertIs(pathfinder.getDistanceMap(10, 10), whole)
+
+class FindPathTest(unittest.TestCase):
+
+
+    def testPathLengthMatchesDistanceMap(self):
+        rng = random.Random(12)
+        for seed in range(5):
+            level = Level(80, 20, seed)
+            pathfinder = Pathfinder(level)
+            cells = passableCells(pathfinder)
+            for i in range(30):
+                (sy, sx), (ey, ex) = rng.choice(cells), rng.choice(cells)
+                path = pathfinder.findPath(sy, sx, ey, ex)
+                distance = pathfinder.getDistanceMap(ey, ex).getDistance(sy, sx)
+                if distance == UNREACHED:
+                    self.assertIsNone(path)
+                    continue
+                self.assertEqual(len(path), distance)
+                for (ay, ax), (by, bx) in zip([(sy, sx)] + path, path):
+                    self.assertEqual(abs(ay - by) + abs(ax - bx), 1)
+                    self.assertTrue(pathfinder.isPassable(by, bx))
+            pathfinder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Checks recordings: the key stream round trip and Replayer.seek() landing
+   in the same state as a game played live."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from dungeon import Dungeon
+from level import Level, TILE_UPSTAIRS, TILE_DOWNSTAIRS
+from main import Game
+from pathfinding import Pathfinder
+from render import NullRenderer
+from recording import Recording, Recorder, Replayer, loadRecording, NAMED_KEYS
+
+# mostly moves, some stairs, a few keys that do nothing
+KEYS = tuple('wasd') * 4 + NAMED_KEYS + ('>', '<', 'x', 'é')
+
+# (dy, dx) of a step -> key making it
+STEP_KEYS = {(-1, 0): 'w', (0, 1): 'd', (1, 0): 's', (0, -1): 'a'}
+
+def randomKey(game, rng):
+    return rng.choice(KEYS)
+
+class StairBot:
+    """Picks keys that walk the player to a staircase (down twice as often
+       as up) and take it, with random keys in between, so a recording
+       covers changing floors."""
+
+
+    def __init__(self):
+        self.path = []
+        self.stairKey = None
+
+    def __call__(self, game, rng):
+        if self.path:
+            y, x = self.path.pop(0)
+            return STEP_KEYS[(y - game.player.y, x - game.player.x)]
+        if self.stairKey is not None:
+            key, self.stairKey = self.stairKey, None
+            return key
+        if rng.random() < 0.5:
+            return randomKey(game, rng)
+        down = game.floors.depth == 0 or rng.random() < 0.67
+        tile = TILE_DOWNSTAIRS if down else TILE_UPSTAIRS
+        stairs = game.dungeon.levelArr.find(bytes((tile,)))
+        if stairs < 0:
+            return randomKey(game, rng)
+        pathfinder = Pathfinder(game.dungeon)
+        path = pathfinder.findPath(game.player.y, game.player.x,
+                                   *divmod(stairs, game.dungeon.getXDim()))
+        pathfinder.close()
+        if not path:
+            return randomKey(game, rng)
+        self.path = path
+        self.stairKey = '>' if down else '<'
+        return self(game, rng)
+
+def gameState(game):
+    """What seek() has to get right, in a form assertEqual() can compare."""
+
+    return (game.player.getCurrentYX(), bytes(game.dungeon.levelArr),
+            bytes(game.fov.explored))
+
+class KeyStreamTest(unittest.TestCase):
+
+
+    def testRoundTrip(self):
+        keys = list(NAMED_KEYS) + ['w', '>', ' ', 'é', 'F1', '\x7f']
+        recording = Recording({'dungeon': False, 'seed': 0, 'ydim': 80, 'xdim': 20})
+        for i, key in enumerate(keys):
+            recording.addKey(key, i * 300)
+        read = [(millis, key) for millis, key, end in recording.readKeys()]
+        self.assertEqual(read, [(i * 300, key) for i, key in enumerate(keys)])
+
+class SeekTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def checkSeek(self, makeGame, chooseKey, turns, seed):
+        """Records turns keys (picked by chooseKey(game, rng)) played on
+           makeGame(), then seeks the saved recording to random turns (back
+           and forth) and compares with the live game at each of them."""
+
+        rng = random.Random(seed)
+        game = makeGame()
+        recorder = Recorder(game, keyframeEvery=50)
+        live = {0: gameState(game)}
+        deepest = 0
+        for turn in range(1, turns + 1):
+            game.handleKey(chooseKey(game, rng), draw=False)
+            live[turn] = gameState(game)
+            if game.floors is not None:
+                deepest = max(deepest, game.floors.depth)
+        if game.floors is not None:
+            # the bot has to have taken some stairs for this to mean much
+            self.assertGreater(deepest, 1)
+        path = os.path.join(self.tmp, 'session.rec')
+        recorder.save(path)
+        if game.floors is not None:
+            game.floors.close()
+
+        recording = loadRecording(path)
+        self.assertEqual(recording.turns, turns)
+        replayer = Replayer(recording)
+        try:
+            for turn in rng.sample(range(turns + 1), 40) + [turns, 0]:
+                self.assertEqual(replayer.seek(turn), turn)
+                self.assertEqual(gameState(replayer.game), live[turn], turn)
+        finally:
+            replayer.close()
+
+    def testLevel(self):
+        self.checkSeek(lambda: Game(Level(80, 20, 3), NullRenderer()),
+                       randomKey, 400, 1)
+
+    def testDungeon(self):
+        self.checkSeek(lambda: Game(renderer=NullRenderer(), floors=Dungeon(4)),
+                       StairBot(), 600, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
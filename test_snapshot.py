@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Checks level snapshots: round trips through restore(), row sharing,
+   forks and diffs."""
+import random
+import unittest
+from level import Level, TILE_UNUSED, TILE_FLOOR, TILE_WALL, OCCUPIED_TABLE
+from occupancy import OccupancyIndex
+from snapshot import changedSpan
+
+TILES = (TILE_UNUSED, TILE_FLOOR, TILE_WALL)
+
+def scribble(level, rng, changes=20):
+    """Makes random tile changes to level."""
+
+    for i in range(changes):
+        y, x = rng.randrange(level.getYDim()), rng.randrange(level.getXDim())
+        if rng.random() < 0.5:
+            level.setTile(y, x, rng.choice(TILES))
+        else:
+            level.fillRect(y, x, rng.randint(1, 5), rng.randint(1, 9), rng.choice(TILES))
+
+class SnapshotTest(unittest.TestCase):
+
+
+    def testRoundTrips(self):
+        rng = random.Random(9)
+        level = Level(80, 20, 3)
+        taken = []
+        for i in range(15):
+            taken.append((level.snapshot(), bytes(level.levelArr)))
+            scribble(level, rng)
+        for snap, tiles in rng.sample(taken, len(taken)):
+            level.restore(snap)
+            self.assertEqual(bytes(level.levelArr), tiles)
+            # restore goes through setRect, so the occupancy index follows
+            fresh = OccupancyIndex.fromCells(level.getYDim(), level.getXDim(),
+                                             tiles.translate(OCCUPIED_TABLE))
+            self.assertEqual(level.occupancy.tree, fresh.tree)
+            self.assertEqual(level.diff(snap), [])
+
+    def testUnchangedRowsShared(self):
+        level = Level(80, 20, 4)
+        first = level.snapshot()
+        self.assertIs(level.snapshot(), first)
+        level.setTile(5, 5, TILE_WALL if level.getTile(5, 5) != TILE_WALL else TILE_FLOOR)
+        second = level.snapshot()
+        for y in range(level.getYDim()):
+            if y == 5:
+                self.assertIsNot(second.rows[y], first.rows[y])
+            else:
+                self.assertIs(second.rows[y], first.rows[y])
+
+    def testDiff(self):
+        level = Level(80, 20, 5)
+        snap = level.snapshot()
+        old = level.getTile(3, 7)
+        new = TILE_WALL if old != TILE_WALL else TILE_FLOOR
+        level.setTile(3, 7, new)
+        self.assertEqual(level.diff(snap), [(3, 7, old, new)])
+
+    def testForkLeavesBaseAlone(self):
+        level = Level(80, 20, 6)
+        base = level.snapshot()
+        fork = base.fork()
+        fork.setTile(2, 3, TILE_WALL)
+        fork.fillRect(10, 10, 3, 4, TILE_FLOOR)
+        changed = fork.snapshot()
+        self.assertEqual(base.rows, level.snapshot().rows)
+        self.assertEqual(changed.getTile(2, 3), TILE_WALL)
+        self.assertEqual(changed.getTile(11, 12), TILE_FLOOR)
+        # rows the fork never wrote are still the base's
+        self.assertIs(changed.rows[0], base.rows[0])
+        level.restore(changed)
+        self.assertEqual(level.getTile(2, 3), TILE_WALL)
+        self.assertEqual(level.diff(changed), [])
+
+    def testChangedSpan(self):
+        rng = random.Random(10)
+        for i in range(300):
+            old = bytes(rng.randrange(3) for x in range(rng.randint(0, 30)))
+            new = bytearray(old)
+            for k in range(rng.randint(0, 3)):
+                if new:
+                    new[rng.randrange(len(new))] = rng.randrange(3)
+            new = bytes(new)
+            start, end = changedSpan(old, new)
+            differ = [x for x in range(len(old)) if old[x] != new[x]]
+            if differ:
+                self.assertEqual((start, end), (differ[0], differ[-1] + 1))
+            else:
+                self.assertEqual(start, end)
+
+
+if __name__ == '__main__':
+    unittest.main()
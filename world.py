@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+import os
+import hashlib
+from collections import OrderedDict
+from level import Level, TILE_DOOROPEN
+
+# width and height of a chunk in tiles
+CHUNK_SIZE = 64
+# smallest chunk that always has room for Level's first room; below this
+# some seeds can't place it and the Level fails
+MIN_CHUNK_SIZE = 20
+# how many chunks are kept in memory at most
+MAX_CHUNKS = 256
+
+def deriveSeed(worldseed, *key):
+    """Returns a 63-bit seed for the part of the world named by key (chunk
+       coordinates, an edge...). Neighbouring keys give unrelated seeds."""
+
+    text = ':'.join(str(part) for part in (worldseed,) + key)
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') >> 1
+
+class World:
+    """A map with no fixed size, split into square chunks of chunkSize tiles.
+       A chunk is generated the first time one of its tiles is needed, as an
+       ordinary Level seeded from the world seed and the chunk coordinates,
+       so the same world seed always gives the same world no matter in which
+       order it gets explored. Each chunk's border walls get a door on every
+       side, at the same spot as the door of the chunk next to it, with
+       a corridor leading to the nearest room.
+
+       Only the tiles of a chunk are kept (one bytearray of chunkSize *
+       chunkSize bytes), and only maxChunks of them, least recently used
+       first out. A chunk that was changed with setTile() is written to
+       spillDir when it gets thrown out and read back from there later; with
+       no spillDir changes to evicted chunks are lost and the chunk comes
+       back as it was generated.
+
+       Coordinates are world (y, x) and may be negative."""
+
+
+    def __init__(self, seed, chunkSize=CHUNK_SIZE, maxChunks=MAX_CHUNKS, spillDir=None):
+        assert chunkSize >= MIN_CHUNK_SIZE, \
+               "chunks must be at least {0} tiles wide".format(MIN_CHUNK_SIZE)
+        self.seed = seed
+        self.chunkSize = chunkSize
+        self.maxChunks = max(1, maxChunks)
+        self.spillDir = spillDir
+        if spillDir is not None:
+            os.makedirs(spillDir, exist_ok=True)
+        # (chunky, chunkx) -> tiles, least recently used first
+        self.chunks = OrderedDict()
+        # chunks changed since they were generated or loaded
+        self.dirty = set()
+        self.generated = 0
+        self.loaded = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _spillPath(self, cy, cx):
+        return os.path.join(self.spillDir, 'chunk_{0}_{1}.bin'.format(cy, cx))
+
+    def _edgeOffset(self, *key):
+        """Position of the door on a chunk edge, the same for both chunks
+           sharing it."""
+
+        return 2 + deriveSeed(self.seed, *key) % (self.chunkSize - 4)
+
+    def generateChunk(self, cy, cx):
+        """Builds the tiles of chunk (cy, cx) from the world seed."""
+
+        size = self.chunkSize
+        lev = Level(size, size, deriveSeed(self.seed, cy, cx))
+        # doors as (border cell, cell just inside it): top, bottom, left, right
+        top = self._edgeOffset('h', cy, cx)
+        bottom = self._edgeOffset('h', cy + 1, cx)
+        left = self._edgeOffset('v', cy, cx)
+        right = self._edgeOffset('v', cy, cx + 1)
+        doors = (((0, top), (1, top)),
+                 ((size - 1, bottom), (size - 2, bottom)),
+                 ((left, 0), (left, 1)),
+                 ((right, size - 1), (right, size - 2)))
+        for (doory, doorx), (y, x) in doors:
+            if lev.rooms:
+                roomid = lev.roomIndex.nearest(y, x, 1, lev._nearestScratch)[0]
+                roomy, roomx = lev.roomIndex.getPosition(roomid)
+                if not lev.generateCorridor(y, x, roomy, roomx):
+                    continue
+            lev.setTile(doory, doorx, TILE_DOOROPEN)
+        self.generated += 1
+        return lev.levelArr
+
+    def getChunk(self, cy, cx):
+        """Returns the tiles of chunk (cy, cx), generating or loading it if
+           it isn't in memory, and marks it as recently used."""
+
+        key = (cy, cx)
+        chunks = self.chunks
+        tiles = chunks.get(key)
+        if tiles is not None:
+            chunks.move_to_end(key)
+            return tiles
+        if self.spillDir is not None and os.path.exists(self._spillPath(cy, cx)):
+            with open(self._spillPath(cy, cx), 'rb') as f:
+                tiles = bytearray(f.read())
+            self.loaded += 1
+        else:
+            tiles = self.generateChunk(cy, cx)
+        chunks[key] = tiles
+        while len(chunks) > self.maxChunks:
+            self._evict()
+        return tiles
+
+    def _evict(self):
+        key, tiles = self.chunks.popitem(last=False)
+        if key in self.dirty:
+            self.dirty.discard(key)
+            if self.spillDir is not None:
+                self._spill(key, tiles)
+        self.evicted += 1
+
+    def _spill(self, key, tiles):
+        path = self._spillPath(*key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(tiles)
+        os.replace(path + '.tmp', path)
+
+    def flush(self):
+        """Writes every changed chunk in memory to spillDir."""
+
+        if self.spillDir is None:
+            return
+        for key in self.dirty:
+            self._spill(key, self.chunks[key])
+        self.dirty.clear()
+
+    def getTile(self, y, x):
+        """Returns tile ID at given world [y][x]."""
+
+        size = self.chunkSize
+        cy, ty = divmod(y, size)
+        cx, tx = divmod(x, size)
+        return self.getChunk(cy, cx)[ty * size + tx]
+
+    def setTile(self, y, x, tileid):
+        """Sets world [y][x] coordinates to given tile ID."""
+
+        size = self.chunkSize
+        cy, ty = divmod(y, size)
+        cx, tx = divmod(x, size)
+        tiles = self.getChunk(cy, cx)
+        if tiles[ty * size + tx] != tileid:
+            tiles[ty * size + tx] = tileid
+            self.dirty.add((cy, cx))
+
+    def getRect(self, ypos, xpos, leny, lenx):
+        """Returns the leny by lenx rectangle starting at world (ypos, xpos)
+           as a list of bytes rows, copied a chunk-wide run at a time."""
+
+        size = self.chunkSize
+        rows = []
+        for y in range(ypos, ypos + leny):
+            cy, ty = divmod(y, size)
+            parts = []
+            x = xpos
+            while x < xpos + lenx:
+                cx, tx = divmod(x, size)
+                run = min(size - tx, xpos + lenx - x)
+                start = ty * size + tx
+                parts.append(self.getChunk(cy, cx)[start:start + run])
+                x += run
+            rows.append(b''.join(parts))
+        return rows
+
+    def prefetch(self, y, x, radius=1):
+        """Makes sure the chunks within radius chunks of world (y, x) are in
+           memory, e.g. around the player before it walks into them."""
+
+        cy, cx = y // self.chunkSize, x // self.chunkSize
+        # nearest chunks last, so they are the last to be evicted
+        around = sorted(((ny, nx) for ny in range(cy - radius, cy + radius + 1)
+                         for nx in range(cx - radius, cx + radius + 1)),
+                        key=lambda c: -max(abs(c[0] - cy), abs(c[1] - cx)))
+        for ny, nx in around:
+            self.getChunk(ny, nx)